@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Optional
 
 class Settings(BaseSettings):
     API_TITLE: str = "VisionBlocks API"
@@ -8,9 +9,83 @@ class Settings(BaseSettings):
     # Where datasets live 
     DATASETS_DIR: Path = Path(__file__).resolve().parent.parent / "data" / "datasets"
 
+    # Derived, rebuildable data (hash indexes, tiles, ...); safe to delete
+    CACHE_DIR: Path = Path(__file__).resolve().parent.parent / "data" / "cache"
+
     # Image preview max side (px)
     PREVIEW_MAX_SIDE: int = 512
 
+    # Encoders: "auto" | "cv2" | "pil"; preview format "auto" keeps the
+    # source format (PNG/JPEG/WEBP forces one); preset used by batch_export
+    ENCODER_BACKEND: str = "auto"
+    PREVIEW_FORMAT: str = "auto"
+    EXPORT_PRESET: str = "export"
+
+    # In-memory cache of computed virtual dataset images (MB, LRU)
+    VIRTUAL_CACHE_MB: int = 256
+    # Perceptual hashes for /duplicates (services/phash.py) are built in the
+    # background, on one thread, whenever the dataset index is built or a
+    # dataset is installed
+    PHASH_ON_INDEX: bool = True
+
+    # Host-wide cache shared by all workers (decoded frames, previews); 0 = off.
+    # Slab file defaults to /dev/shm (tmpfs) when present, else CACHE_DIR
+    SHARED_CACHE_MB: int = 256
+    SHARED_CACHE_PATH: Optional[Path] = None
+
+    # Archive uploads (POST /datasets/upload): max archive size, max size
+    # of one extracted image and max total extracted size, in MB
+    UPLOAD_MAX_MB: int = 2048
+    UPLOAD_MAX_FILE_MB: int = 64
+    UPLOAD_MAX_EXTRACTED_MB: int = 8192
+
+    # Threads for indexing dataset folders at startup; 0 = min(8, folder count)
+    DISCOVERY_WORKERS: int = 0
+
+    # Threads for per-image work (batch previews); 0 = min(8, cpu count)
+    IMAGE_WORKERS: int = 0
+    # Images with at least this many pixels run through the tiled,
+    # memory-bounded pipeline (0 disables); tile edge length in px
+    TILED_MIN_PIXELS: int = 16_000_000
+    TILE_SIZE: int = 1024
+    # Deep-zoom tiles (/datasets/{key}/tiles): square tile edge in px;
+    # tiles are cached under CACHE_DIR/tiles, least recently opened
+    # pyramids removed past DEEPZOOM_CACHE_MB (0 = unbounded)
+    DEEPZOOM_TILE_SIZE: int = 256
+    DEEPZOOM_CACHE_MB: int = 1024
+
+    # Exports stack up to this many same-shaped frames so point-wise steps
+    # run once per batch (services/batching.py); 1 = image by image
+    EXPORT_BATCH_SIZE: int = 16
+    # Staged I/O for bulk passes (services/staged_io.py): files read ahead
+    # of the compute loop, and encoded outputs queued for a background writer
+    IO_READ_AHEAD: int = 8
+    IO_WRITE_BEHIND: int = 8
+    # batch_export cost limits, checked against a header-only estimate
+    # (services/cost_model.py) before any pixels are touched; 0 = no limit.
+    # Over a WARN value the response carries a warning, over a MAX value
+    # the export is refused (HTTP 413). Real exports only run the estimate
+    # when a MAX value is set; dry runs always do
+    EXPORT_WARN_OUTPUT_MB: int = 1024
+    EXPORT_MAX_OUTPUT_MB: int = 0
+    EXPORT_WARN_SECONDS: float = 600.0
+    EXPORT_MAX_SECONDS: float = 0.0
+
+    # Process-wide budget for decoded pixels (MB, 0 disables), how long work
+    # may wait for budget, and what to do with images that can never fit:
+    # "downscale" on decode or "reject" (HTTP 413)
+    MEMORY_BUDGET_MB: int = 2048
+    MEMORY_WAIT_TIMEOUT_S: float = 30.0
+    MEMORY_OVERSIZE_POLICY: str = "downscale"
+    # Hard cap on source image size; PIL refuses anything over twice this
+    MAX_IMAGE_PIXELS: int = 100_000_000
+
+    # Max images a single /preprocess/batch_apply call may preview
+    BATCH_PREVIEW_MAX_IMAGES: int = 64
+
+    # Per-stage timings (Server-Timing header + /metrics); off = near-zero overhead
+    METRICS_ENABLED: bool = True
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,34 @@
+from __future__ import annotations
+from types import ModuleType
+from typing import Any, Optional
+import importlib
+
+class LazyModule:
+    """
+    Stand-in for a heavy module (numpy, cv2) that is imported on first
+    attribute access. Resolved attributes are cached on the proxy, so the
+    steady-state cost is a plain attribute lookup.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.__dict__["_lazy_name"] = name
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> ModuleType:
+        mod: Optional[ModuleType] = self.__dict__["_lazy_module"]
+        if mod is None:
+            mod = importlib.import_module(self.__dict__["_lazy_name"])
+            self.__dict__["_lazy_module"] = mod
+        return mod
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self._load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_lazy_name']}' ({state})>"
+
+def lazy_import(name: str) -> Any:
+    return LazyModule(name)
@@ -0,0 +1,248 @@
+"""
+Lightweight hot-path timing and Prometheus-style metrics.
+
+    with metrics.stage("decode"):
+        ...
+    with metrics.op("blur_sharpen"):
+        ...
+
+Each timed block is added to the current request's Server-Timing header
+(see ServerTimingMiddleware) and to a process-wide histogram exported at
+/metrics. When disabled, stage()/op() return a shared no-op context
+manager and the middleware passes requests straight through.
+"""
+from __future__ import annotations
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+import bisect
+import threading
+
+from app.core.config import settings
+
+# seconds; covers sub-ms ops up to multi-second exports
+_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_enabled: bool = settings.METRICS_ENABLED
+
+# per-request "stage name" -> accumulated seconds (None outside a request)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def enabled() -> bool:
+    return _enabled
+
+def set_enabled(value: bool) -> None:
+    global _enabled
+    _enabled = bool(value)
+
+# ------------------------
+# Registry
+# ------------------------
+
+class _Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BUCKETS) + 1)  # last = +Inf
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+
+_lock = threading.Lock()
+# (metric name, label pairs) -> histogram / counter value
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histogram] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+# (metric name, label pairs) -> callable read at scrape time
+_gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Callable[[], float]] = {}
+_help: Dict[str, str] = {
+    "visionblocks_stage_seconds": "Time spent per hot-path stage.",
+    "visionblocks_op_seconds": "Time spent per image op type.",
+    "visionblocks_http_request_seconds": "HTTP request latency by route.",
+}
+
+def observe(name: str, seconds: float, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = _Histogram()
+        h.observe(seconds)
+
+def count(name: str, n: float = 1, **labels: str) -> None:
+    """Increment a counter (e.g. cache hits). No-op when disabled."""
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def register_gauge(name: str, fn: Callable[[], float], help: str = "", **labels: str) -> None:
+    """Register a callable sampled at scrape time (queue depths, cache sizes)."""
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = fn
+        if help:
+            _help.setdefault(name, help)
+
+def reset() -> None:
+    """Drop all recorded histograms and counters (gauges stay registered)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+# ------------------------
+# Timers
+# ------------------------
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopTimer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+_NOOP = _NoopTimer()
+
+class _Timer:
+    __slots__ = ("metric", "label", "value", "header", "t0")
+
+    def __init__(self, metric: str, label: str, value: str, header: str) -> None:
+        self.metric = metric
+        self.label = label
+        self.value = value
+        self.header = header
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        dt = perf_counter() - self.t0
+        observe(self.metric, dt, **{self.label: self.value})
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.header] = timings.get(self.header, 0.0) + dt
+
+def stage(name: str):
+    """Time a hot-path stage: index, read, decode, encode, base64, json, ..."""
+    if not _enabled:
+        return _NOOP
+    return _Timer("visionblocks_stage_seconds", "stage", name, name)
+
+def op(op_type: str):
+    """Time one image op; shows up as `op.<type>` in Server-Timing."""
+    if not _enabled:
+        return _NOOP
+    return _Timer("visionblocks_op_seconds", "op", op_type, f"op.{op_type}")
+
+# ------------------------
+# Export
+# ------------------------
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in timings.items())
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(pairs: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = pairs + extra
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in items)
+    return "{" + body + "}"
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format (0.0.4)."""
+    with _lock:
+        hists = {k: (list(h.counts), h.total, h.n) for k, h in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines: List[str] = []
+    seen: set = set()
+
+    def header(name: str, kind: str) -> None:
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), (counts, total, n) in sorted(hists.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for le, c in zip(_BUCKETS + (float("inf"),), counts):
+            cumulative += c
+            le_s = "+Inf" if le == float("inf") else repr(le)
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', le_s),))} {cumulative}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {n}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+
+    for (name, labels), fn in sorted(gauges.items(), key=lambda kv: kv[0]):
+        try:
+            value = float(fn())
+        except Exception:
+            continue
+        header(name, "gauge")
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+# ------------------------
+# ASGI middleware
+# ------------------------
+
+class ServerTimingMiddleware:
+    """
+    Collect per-request stage timings and emit them as a Server-Timing
+    response header, plus a per-route latency histogram. Pure ASGI so it
+    works with streaming responses and adds nothing when disabled.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not _enabled:
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        t0 = perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                timings["app"] = perf_counter() - t0
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            observe(
+                "visionblocks_http_request_seconds",
+                perf_counter() - t0,
+                route=getattr(route, "path", "unmatched"),
+                method=scope.get("method", ""),
+                status=str(status["code"]),
+            )
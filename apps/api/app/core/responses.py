@@ -0,0 +1,75 @@
+from __future__ import annotations
+from typing import Any, List
+import json
+import os
+import re
+
+from fastapi.responses import JSONResponse
+
+from app.core import metrics
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+class RawJSON:
+    """
+    A value that is already encoded JSON (e.g. a data URL string literal as
+    bytes chunks). TimedJSONResponse splices the chunks into the body
+    verbatim, so multi-MB base64 never round-trips through str.
+    """
+    __slots__ = ("chunks",)
+
+    def __init__(self, *chunks: bytes) -> None:
+        self.chunks = chunks
+
+def _dumps(content: Any, default) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+    # Starlette's own settings
+    return json.dumps(
+        content, default=default, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+    ).encode("utf-8")
+
+def json_bytes(content: Any) -> bytes:
+    """
+    Encode `content` (plain JSON types, RawJSON values anywhere) with orjson
+    when installed. Raw values go in as placeholders (via the encoder's
+    `default` hook, so the payload is not walked in Python) and are joined
+    back in with one copy into the final body.
+    """
+    raws: List[RawJSON] = []
+    tag = os.urandom(6).hex()  # per call, so no client string can match
+
+    def swap(v: Any) -> str:
+        if not isinstance(v, RawJSON):
+            raise TypeError(f"Type is not JSON serializable: {type(v).__name__}")
+        raws.append(v)
+        return f"\x00{tag}:{len(raws) - 1}\x00"
+
+    body = _dumps(content, swap)
+    if not raws:
+        return body
+    parts: List[bytes] = []
+    pos = 0
+    # how the encoders write the "\x00<tag>:<i>\x00" placeholder strings
+    placeholder = re.compile(rb'"\\u0000' + tag.encode("ascii") + rb':(\d+)\\u0000"')
+    for m in placeholder.finditer(body):
+        parts.append(body[pos:m.start()])
+        parts.extend(raws[int(m.group(1))].chunks)
+        pos = m.end()
+    parts.append(body[pos:])
+    return b"".join(parts)
+
+class TimedJSONResponse(JSONResponse):
+    """
+    JSONResponse whose body encoding shows up as the `json` stage. Uses
+    orjson when available and accepts RawJSON values (see json_bytes).
+    Routes that build large payloads themselves return this directly,
+    which also skips FastAPI's response_model re-validation.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with metrics.stage("json"):
+            return json_bytes(content)
@@ -2,10 +2,16 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
-from app.routes import health, datasets, preprocess
-from app.services.datasets import get_datasets_index
+from app.core.metrics import ServerTimingMiddleware
+from app.core.responses import TimedJSONResponse
+from app.routes import health, datasets, preprocess, metrics
+from app.services.datasets import warm_datasets_index
 
-app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION)
+app = FastAPI(
+    title=settings.API_TITLE,
+    version=settings.API_VERSION,
+    default_response_class=TimedJSONResponse,
+)
 
 # CORS (allow local web app on 3000)
 app.add_middleware(
@@ -14,14 +20,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # let the browser's devtools show per-stage timings cross-origin
+    expose_headers=["Server-Timing"],
 )
 
+# Per-stage timings -> Server-Timing header + /metrics histograms
+app.add_middleware(ServerTimingMiddleware)
+
 # Routers
 app.include_router(health.router)
 app.include_router(datasets.router)
 app.include_router(preprocess.router)  
+app.include_router(metrics.router)
 
 @app.on_event("startup")
 def _warmup():
-    # Build dataset index in memory for fast access
-    get_datasets_index(force_refresh=True)
+    # Build dataset index in memory for fast access, without blocking startup;
+    # /health/ready reports when it is done
+    warm_datasets_index()
+
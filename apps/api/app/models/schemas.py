@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 
 class DatasetListItem(BaseModel):
     key: str
@@ -17,6 +17,11 @@ class DatasetInfo(BaseModel):
     classes: List[str]
     approx_count: Dict[str, int] = {}
     version: Optional[str] = None
+    # exported/virtual datasets: where they came from and what was applied
+    base_dataset: Optional[str] = None
+    preprocessing: Optional[List[Dict[str, Any]]] = None
+    # True when images are computed on demand from base_dataset
+    virtual: bool = False
 
 class SampleResponse(BaseModel):
     dataset_key: str
@@ -39,3 +44,61 @@ class SplitChannelsResponse(BaseModel):
   g_data_url: str
   b_data_url: str
 
+class MultiViewResponse(BaseModel):
+  dataset_key: str
+  path: str
+  # set when the image was sampled (no explicit path)
+  label: Optional[str] = None
+  index_used: Optional[int] = None
+  # original (height, width, channels) before preview downscale
+  shape: List[int]
+  # view name -> PNG data URL
+  views: Dict[str, str] = {}
+  # per-channel 256-bin counts when "histogram" is requested
+  histogram: Optional[Dict[str, List[int]]] = None
+
+class DuplicateGroup(BaseModel):
+  # first path is the one kept by batch_export(skip_duplicates=True)
+  paths: List[str]
+  classes: List[str]
+  max_distance: int
+
+class DuplicatesResponse(BaseModel):
+  dataset_key: str
+  algo: str
+  max_distance: int
+  images_hashed: int
+  groups: List[DuplicateGroup]
+  hash_ms: float
+  search_ms: float
+
+class TileLevel(BaseModel):
+  level: int
+  size: List[int]  # [w, h]
+  grid: List[int]  # [columns, rows]
+
+class TileInfoResponse(BaseModel):
+  dataset_key: str
+  path: str
+  signature: str
+  width: int
+  height: int
+  tile_size: int
+  format: str
+  max_level: int
+  levels: List[TileLevel]
+
+class IngestJobResponse(BaseModel):
+  id: str
+  dataset_key: str
+  name: str
+  state: str  # receiving | queued | extracting | indexing | done | failed
+  bytes_received: int
+  files_total: int
+  files_probed: int
+  images: int
+  skipped: int
+  classes: List[str]
+  error: Optional[str] = None
+  created: float
+  finished: Optional[float] = None
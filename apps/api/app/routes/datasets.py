@@ -1,20 +1,33 @@
-from fastapi import APIRouter, HTTPException, Query
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from typing import Any, Dict, List, Optional
 from fastapi import HTTPException
+import itertools
+import json
 
 from app.models.schemas import (
     DatasetListResponse, DatasetListItem, DatasetInfo, SampleResponse,
-    GrayResponse, SplitChannelsResponse
+    GrayResponse, SplitChannelsResponse, MultiViewResponse, DuplicatesResponse, TileInfoResponse,
+    IngestJobResponse,
 )
 
 from app.services.datasets import (
-    load_image_by_relpath, to_grayscale_preview_image, split_channels_tinted, image_data_url
+    load_image_by_relpath, to_grayscale_preview_image, split_channels_tinted, image_data_url,
+    render_views,
 )
 
 from app.services.datasets import (
-    list_datasets, dataset_info, sample_from_dataset, image_data_url
+    list_datasets, dataset_info, sample_from_dataset, sample_preview, image_data_url, dataset_duplicates
 )
 
+from app.core.config import settings
+from app.core.responses import TimedJSONResponse
+from app.services import ingest
+from app.services.deepzoom import get_tile, pyramid_info, tile_etag
+from app.services.minibatch import iter_batches
+from app.services.memory import MemoryBudgetExceeded
+
 router = APIRouter(prefix="/datasets", tags=["datasets"])
 
 @router.get("", response_model=DatasetListResponse)
@@ -22,6 +35,60 @@ def get_datasets():
     items = [DatasetListItem(key=k, name=n) for (k, n) in list_datasets()]
     return DatasetListResponse(items=items)
 
+@router.post("/upload", response_model=IngestJobResponse, status_code=202)
+async def upload_dataset(request: Request, name: Optional[str] = Query(None)):
+    """
+    Create dataset `name` from a zip/tar archive of images grouped in class
+    folders, sent either as the raw request body with ?name= (written to
+    disk as it arrives) or as multipart fields `file` and `name`. Bodies
+    whose Content-Length is over UPLOAD_MAX_MB are refused before any of
+    them is read. The archive is processed in the background; poll
+    /datasets/uploads/{id} for progress.
+    """
+    limit = settings.UPLOAD_MAX_MB * 2**20
+    multipart = request.headers.get("content-type", "").startswith("multipart/form-data")
+    length = request.headers.get("content-length", "")
+    # multipart framing around the file is allowed a little slack
+    if length.isdigit() and int(length) > limit + (2**16 if multipart else 0):
+        raise HTTPException(status_code=413, detail=f"Archive is larger than {settings.UPLOAD_MAX_MB} MB.")
+
+    form = await request.form(max_files=1, max_fields=4) if multipart else None
+    try:
+        upload = form.get("file") if form is not None else None
+        if form is not None:
+            name = form.get("name") or name
+            if not hasattr(upload, "read"):
+                raise HTTPException(status_code=400, detail="Multipart upload needs a 'file' field.")
+        if not isinstance(name, str) or not name.strip():
+            raise HTTPException(status_code=400, detail="A dataset 'name' is required.")
+        try:
+            job = ingest.new_job(name)
+        except FileExistsError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        try:
+            if upload is not None:
+                archive = await run_in_threadpool(ingest.receive, job, upload.file)
+            else:
+                archive = await ingest.receive_stream(job, request.stream())
+        except ValueError as e:
+            ingest.fail(job, str(e))
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            ingest.fail(job, str(e))
+            raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if form is not None:
+            await form.close()
+    ingest.start(job, archive)
+    return job.to_dict()
+
+@router.get("/uploads/{job_id}", response_model=IngestJobResponse)
+def upload_status(job_id: str):
+    try:
+        return ingest.get_job(job_id).to_dict()
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 @router.get("/{key}/info", response_model=DatasetInfo)
 def get_dataset_info(key: str):
     try:
@@ -37,13 +104,13 @@ def get_sample(
     index: Optional[int] = None,
 ):
     try:
-        payload, im = sample_from_dataset(key, mode=mode, index=index)
-        data_url = image_data_url(im)
-        return SampleResponse(image_data_url=data_url, **payload)
+        return TimedJSONResponse(sample_preview(key, mode=mode, index=index))
     except KeyError:
         raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -52,15 +119,17 @@ def grayscale(key: str, path: str):
     try:
         im = load_image_by_relpath(key, path)
         gray = to_grayscale_preview_image(im)
-        return {
+        return TimedJSONResponse({
             "dataset_key": key,
             "path": path,
-            "image_data_url": image_data_url(gray),
-        }
+            "image_data_url": image_data_url(gray, as_json=True),
+        })
     except KeyError:
         raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -69,16 +138,170 @@ def split_channels(key: str, path: str):
     try:
         im = load_image_by_relpath(key, path)
         r_img, g_img, b_img = split_channels_tinted(im)
-        return {
+        return TimedJSONResponse({
             "dataset_key": key,
             "path": path,
-            "r_data_url": image_data_url(r_img),
-            "g_data_url": image_data_url(g_img),
-            "b_data_url": image_data_url(b_img),
-        }
+            "r_data_url": image_data_url(r_img, as_json=True),
+            "g_data_url": image_data_url(g_img, as_json=True),
+            "b_data_url": image_data_url(b_img, as_json=True),
+        })
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{key}/views", response_model=MultiViewResponse)
+def multi_view(
+    key: str,
+    path: Optional[str] = None,
+    views: List[str] = Query(["original", "grayscale", "r", "g", "b"]),
+    mode: str = Query("random", pattern="^(random|index)$"),
+    index: Optional[int] = None,
+    edges_method: str = Query("canny", pattern="^(canny|sobel|laplacian|prewitt)$"),
+    edges_threshold: int = Query(100, ge=0, le=255),
+):
+    """
+    Several views of one image in one round trip. With `path` the image is
+    loaded directly; without it a sample is drawn like /sample (mode/index).
+    """
+    try:
+        if path is None:
+            payload, im = sample_from_dataset(key, mode=mode, index=index)
+        else:
+            im = load_image_by_relpath(key, path)
+            payload = {"dataset_key": key, "path": path}
+        urls, hist = render_views(im, views, edges_method=edges_method, edges_threshold=edges_threshold, as_json=True)
+        return TimedJSONResponse({
+            **payload,
+            "shape": [im.height, im.width, len(im.getbands())],
+            "views": urls,
+            "histogram": hist,
+        })
     except KeyError:
         raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{key}/duplicates", response_model=DuplicatesResponse)
+def duplicates(
+    key: str,
+    max_distance: int = Query(6, ge=0, le=32),
+    algo: str = Query("phash", pattern="^(phash|dhash)$"),
+):
+    """
+    Groups of near-duplicate images (Hamming distance <= max_distance between
+    64-bit perceptual hashes). Hashes are cached per file and only recomputed
+    when a file changes.
+    """
+    try:
+        return dataset_duplicates(key, max_distance=max_distance, algo=algo)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
+
+def _parse_ops(ops: Optional[str]) -> List[Dict[str, Any]]:
+    """`ops` query parameter: a JSON list of op objects (as in /preprocess)."""
+    if not ops:
+        return []
+    parsed = json.loads(ops)
+    if not isinstance(parsed, list) or not all(isinstance(o, dict) for o in parsed):
+        raise ValueError("ops must be a JSON list of op objects.")
+    return parsed
+
+@router.get("/{key}/tiles/info", response_model=TileInfoResponse)
+def tile_info(
+    key: str,
+    path: str,
+    ops: Optional[str] = None,
+    format: str = Query("auto", pattern="^(auto|png|jpeg|webp)$"),
+):
+    """
+    Deep-zoom pyramid of one image (processed by `ops`, a JSON list, if
+    given): full size, tile size and the tile grid of every level.
+    """
+    try:
+        info = pyramid_info(key, path, _parse_ops(ops), format)
+        return {"dataset_key": key, "path": path, **info}
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{key}/tiles/{level}/{x}/{y}")
+def tile(
+    request: Request,
+    key: str,
+    level: int,
+    x: int,
+    y: int,
+    path: str,
+    ops: Optional[str] = None,
+    format: str = Query("auto", pattern="^(auto|png|jpeg|webp)$"),
+):
+    """
+    One deep-zoom tile as raw image bytes. Levels are built lazily and
+    cached on disk; the ETag changes whenever the file or the ops do, and
+    a matching If-None-Match is answered before the tile is read or built.
+    """
+    try:
+        op_list = _parse_ops(ops)
+        etag = tile_etag(key, path, op_list, level, x, y, format)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "public, max-age=86400"})
+        data, mime, etag = get_tile(key, path, op_list, level, x, y, format)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    return Response(content=data, media_type=mime, headers=headers)
+
+@router.get("/{key}/batches")
+def batches(
+    key: str,
+    batch_size: int = Query(32, ge=1, le=1024),
+    order: str = Query("shuffle", pattern="^(sequential|shuffle|stratified)$"),
+    seed: int = 0,
+    ops: Optional[str] = None,
+    split: Optional[str] = None,
+    epochs: int = Query(1, ge=1, le=1000),
+    drop_last: bool = False,
+    channels: str = Query("rgb", pattern="^(rgb|bgr)$"),
+    max_batches: Optional[int] = Query(None, ge=1),
+):
+    """
+    Stream mini-batches for a training loop: records of a JSON header plus
+    .npy-framed uint8 images (B, H, W, 3) and int64 labels (format in
+    services/minibatch.py). `ops` (JSON list) must give every image the
+    same size, e.g. a resize with mode=size. Decoding runs up to two
+    frames per image worker ahead of the client.
+    """
+    try:
+        stream = iter_batches(
+            key, batch_size=batch_size, order=order, seed=seed, ops=_parse_ops(ops), split=split,
+            epochs=epochs, drop_last=drop_last, channels=channels,
+            max_batches=max_batches,
+        )
+        first = next(stream)  # argument errors surface here, before any bytes are sent
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {key}")
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(itertools.chain([first], stream), media_type="application/octet-stream")
@@ -1,7 +1,28 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.datasets import datasets_index_error, datasets_index_ready
+from app.services.memory import governor
 
 router = APIRouter(tags=["health"])
 
 @router.get("/health")
 def health():
-    return {"status": "ok"}
+    # liveness: the process is up; "ready" is informational here
+    return {"status": "ok", "ready": datasets_index_ready()}
+
+@router.get("/health/ready")
+def ready():
+    # readiness: 503 until the dataset index has been built once
+    if not datasets_index_ready():
+        error = datasets_index_error()
+        if error is not None:
+            # the warm-up keeps retrying; say why instead of "starting" forever
+            return JSONResponse(status_code=503, content={"status": "error", "ready": False, "detail": error})
+        return JSONResponse(status_code=503, content={"status": "starting", "ready": False})
+    return {"status": "ok", "ready": True}
+
+@router.get("/health/memory")
+def memory():
+    # decoded-pixel budget: reserved/peak bytes, waiting work, rejections
+    return governor.snapshot()
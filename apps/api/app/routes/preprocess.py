@@ -1,18 +1,37 @@
 from __future__ import annotations
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from pathlib import Path
+import asyncio
+import json
 import random
+import time
 
+from app.core.config import settings
+from app.core.responses import TimedJSONResponse
+from app.services.datasets import create_virtual_dataset, pixel_source, virtual_spec
+from app.services.encoding import data_url_json, preview_format
 from app.services.image_ops import (
     DATASETS_DIR,
-    load_dataset_image,
+    dataset_image_key,
+    open_dataset_image,
     list_all_images,
-    apply_pipeline,
-    pil_to_data_url,
+    compile_pipeline,
+    run_pipeline,
+    preview_many,
     export_dataset,
+    frame_shape,
+    submit_work,
+    sanitize_name,
 )
+from app.services.cost_model import estimate_export
+from app.services.live_preview import PreviewSession, Superseded
+from app.services.memory import MemoryBudgetExceeded
+from app.services import shared_cache
+from app.services.phash import drop_duplicates
 
 router = APIRouter(prefix="/preprocess", tags=["preprocess"])
 
@@ -30,70 +49,229 @@ class ApplyResponse(BaseModel):
 
 @router.post("/apply", response_model=ApplyResponse)
 def preprocess_apply(req: ApplyRequest):
+    # identical requests (same file, ops, encoder settings) are shared across
+    # workers; the body echoes dataset_key and path, so they are keyed as sent
     try:
-        before_img, abs_path, fmt = load_dataset_image(req.dataset_key, req.path)
+        cache_key = json.dumps(
+            [
+                req.dataset_key, req.path, dataset_image_key(req.dataset_key, req.path),
+                req.ops, settings.PREVIEW_FORMAT, settings.ENCODER_BACKEND,
+            ],
+            sort_keys=True,
+        )
+    except (FileNotFoundError, ValueError):
+        cache_key = None  # reported below
+    hit = shared_cache.get_bytes("apply_body", cache_key) if cache_key else None
+    if hit is not None:
+        return Response(hit, media_type="application/json")
+
+    try:
+        steps = compile_pipeline(req.ops)
+        with open_dataset_image(req.dataset_key, req.path, steps, share=True) as (before_img, fmt):
+            after_img = run_pipeline(before_img, steps)
+            before_url = data_url_json(before_img, preview_format(fmt), preset="preview")
+            after_url  = data_url_json(after_img, preview_format(fmt), preset="preview")
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-
-    after_img = apply_pipeline(before_img, req.ops)
-    before_url = pil_to_data_url(before_img, fmt_hint=fmt)
-    after_url  = pil_to_data_url(after_img, fmt_hint=fmt)
-    shape = (after_img.height, after_img.width, len(after_img.getbands()))
-
-    return ApplyResponse(
-        dataset_key=req.dataset_key,
-        path=req.path,
-        before_data_url=before_url,
-        after_data_url=after_url,
-        after_shape=shape,
-    )
+    # built server-side, so no response_model re-validation; the cached
+    # body is byte-identical for the same request
+    resp = TimedJSONResponse({
+        "dataset_key": req.dataset_key,
+        "path": req.path,
+        "before_data_url": before_url,
+        "after_data_url": after_url,
+        "after_shape": list(frame_shape(after_img)),
+    })
+    if cache_key:
+        shared_cache.put_bytes("apply_body", cache_key, resp.body)
+    return resp
 
 class LoopSubset(BaseModel):
-    mode: str = Field(pattern="^(all|firstN|randomN)$")
+    mode: str = Field(pattern="^(all|firstN|randomN|perClass)$")
+    # firstN/randomN: total images; perClass: images per class
     n: Optional[int] = None
     shuffle: bool = False
 
+def _select_rel_paths(dataset_key: str, subset: LoopSubset) -> List[str]:
+    """Resolve a LoopSubset to dataset-relative paths like 'images/<class>/file.jpg'."""
+    all_paths = list_all_images(dataset_key)
+    rels = []
+    for p in all_paths:
+        # relative to dataset root
+        rel = p.relative_to((DATASETS_DIR / dataset_key).resolve()).as_posix()
+        rels.append(rel)
+
+    if subset.mode == "firstN":
+        n = max(1, int(subset.n or 1))
+        rels = rels[:n]
+    elif subset.mode == "randomN":
+        n = max(1, int(subset.n or 1))
+        random.shuffle(rels)
+        rels = rels[:n]
+    elif subset.mode == "perClass":
+        n = max(1, int(subset.n or 1))
+        by_class: Dict[str, List[str]] = {}
+        for rel in rels:
+            parts = rel.split("/")
+            cls = parts[1] if len(parts) >= 3 else "unknown"
+            by_class.setdefault(cls, []).append(rel)
+        rels = []
+        for cls in sorted(by_class):
+            group = by_class[cls]
+            if subset.shuffle:
+                random.shuffle(group)
+            rels.extend(group[:n])
+    else:
+        # all
+        pass
+
+    if subset.shuffle:
+        random.shuffle(rels)
+    return rels
+
+class BatchApplyRequest(BaseModel):
+    dataset_key: str
+    # explicit paths win over subset; one of the two is required
+    paths: Optional[List[str]] = None
+    subset: Optional[LoopSubset] = None
+    ops: List[Dict[str, Any]] = Field(default_factory=list)
+    # longest side of the returned thumbnails
+    max_side: int = Field(128, ge=16, le=1024)
+    include_before: bool = False
+    # stream results as NDJSON lines in completion order
+    stream: bool = False
+
+class BatchApplyItem(BaseModel):
+    path: str
+    before_data_url: Optional[str] = None
+    after_data_url: Optional[str] = None
+    after_shape: Optional[tuple] = None
+    error: Optional[str] = None
+
+class BatchApplyResponse(BaseModel):
+    dataset_key: str
+    items: List[BatchApplyItem]
+
+@router.post("/batch_apply", response_model=BatchApplyResponse)
+def preprocess_batch_apply(req: BatchApplyRequest):
+    if req.paths is not None:
+        rels = list(req.paths)
+    elif req.subset is not None:
+        rels = _select_rel_paths(req.dataset_key, req.subset)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either 'paths' or 'subset'.")
+
+    if not rels:
+        raise HTTPException(status_code=400, detail="No images found for the requested subset.")
+    if len(rels) > settings.BATCH_PREVIEW_MAX_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many images for a preview ({len(rels)} > {settings.BATCH_PREVIEW_MAX_IMAGES}).",
+        )
+    try:
+        # fail fast on bad params before any work is queued
+        compile_pipeline(req.ops)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    items = preview_many(req.dataset_key, rels, req.ops, req.max_side, req.include_before)
+
+    if req.stream:
+        def ndjson():
+            for item in items:
+                yield json.dumps(item) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    # keep request order in the buffered response
+    by_path = {item["path"]: item for item in items}
+    return BatchApplyResponse(
+        dataset_key=req.dataset_key,
+        items=[BatchApplyItem(**by_path[rel]) for rel in rels if rel in by_path],
+    )
+
 class BatchExportRequest(BaseModel):
     dataset_key: str
     subset: LoopSubset
     ops: List[Dict[str, Any]]
     new_dataset_name: str
     overwrite: bool = False
+    # drop near-duplicates (perceptual hash), keeping the first of each group
+    skip_duplicates: bool = False
+    duplicate_max_distance: int = Field(4, ge=0, le=32)
+    # output encoding; presets trade encode time for size (see services/encoding.py)
+    output_format: str = Field("same_as_source", pattern="^(same_as_source|png|jpeg|webp)$")
+    encode_preset: Optional[str] = Field(None, pattern="^(export|export_small|export_lossless)$")
+    # estimate size/time/memory from image headers only; nothing is written
+    dry_run: bool = False
+
+class ExportEstimate(BaseModel):
+    images: int
+    unreadable: int
+    output_bytes: int
+    raw_bytes: int           # uncompressed 8-bit RGB
+    peak_memory_bytes: int   # largest single-image working set
+    seconds: float
+    seconds_by_stage: Dict[str, float]
+    largest_output: List[int]  # (w, h)
+    free_disk_bytes: int
+    calibrated: bool = True  # False: some costs still being measured, time is a floor
+    warnings: List[str]
+    exceeds: List[str]       # limits that would refuse the export
 
 class BatchExportResponse(BaseModel):
     base_dataset: str
     new_dataset_key: str
     processed: int
     classes: List[str]
+    skipped_duplicates: int = 0
+    estimate: Optional[ExportEstimate] = None
+    warnings: List[str] = Field(default_factory=list)
 
 @router.post("/batch_export", response_model=BatchExportResponse)
 def preprocess_batch_export(req: BatchExportRequest):
-    all_paths = list_all_images(req.dataset_key)
-    rels = []
-    for p in all_paths:
-        # relative to dataset root
-        rel = str(p.relative_to((DATASETS_DIR / req.dataset_key).resolve()))
-        rels.append(rel)
-
-    if req.subset.mode == "firstN":
-        n = max(1, int(req.subset.n or 1))
-        rels = rels[:n]
-    elif req.subset.mode == "randomN":
-        n = max(1, int(req.subset.n or 1))
-        random.shuffle(rels)
-        rels = rels[:n]
-    else:
-        # all
-        pass
-
-    if req.subset.shuffle:
-        random.shuffle(rels)
+    rels = _select_rel_paths(req.dataset_key, req.subset)
 
     if not rels:
         raise HTTPException(status_code=400, detail="No images found for the requested subset.")
 
+    skipped = 0
+    if req.skip_duplicates:
+        src_key, src_root = pixel_source(req.dataset_key)
+        kept = drop_duplicates(src_key, src_root, rels, req.duplicate_max_distance)
+        skipped = len(rels) - len(kept)
+        rels = kept
+
+    # a real export only pays for the header pass when a limit can refuse
+    # it, and never waits for cost calibration
+    est = None
+    if req.dry_run or settings.EXPORT_MAX_OUTPUT_MB or settings.EXPORT_MAX_SECONDS:
+        try:
+            est = estimate_export(
+                req.dataset_key, rels, req.ops, req.output_format, req.encode_preset, measure=req.dry_run
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if req.dry_run:
+        new_key = sanitize_name(req.new_dataset_name)
+        warnings = list(est["warnings"])
+        if (DATASETS_DIR / new_key).exists() and not req.overwrite:
+            warnings.append(f"Dataset '{new_key}' already exists; set overwrite to replace it.")
+        return BatchExportResponse(
+            base_dataset=req.dataset_key,
+            new_dataset_key=new_key,
+            processed=0,
+            classes=sorted({rel.split("/")[1] if rel.count("/") >= 2 else "unknown" for rel in rels}),
+            skipped_duplicates=skipped,
+            estimate=ExportEstimate(**est),
+            warnings=warnings,
+        )
+    if est is not None and est["exceeds"]:
+        raise HTTPException(status_code=413, detail=" ".join(est["exceeds"]))
+
     try:
         result = export_dataset(
             base_dataset=req.dataset_key,
@@ -101,13 +279,234 @@ def preprocess_batch_export(req: BatchExportRequest):
             ops=req.ops,
             new_name=req.new_dataset_name,
             overwrite=req.overwrite,
+            output_format=req.output_format,
+            preset=req.encode_preset,
         )
     except FileExistsError as e:
         raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
     return BatchExportResponse(
         base_dataset=req.dataset_key,
         new_dataset_key=result["new_key"],
         processed=result["processed"],
         classes=result["classes"],
+        skipped_duplicates=skipped,
+        warnings=est["warnings"] if est is not None else [],
+    )
+
+# ------------------------
+# Virtual datasets
+# ------------------------
+
+class VirtualDatasetRequest(BaseModel):
+    dataset_key: str
+    subset: LoopSubset
+    ops: List[Dict[str, Any]]
+    new_dataset_name: str
+    overwrite: bool = False
+
+class VirtualDatasetResponse(BaseModel):
+    base_dataset: str
+    new_dataset_key: str
+    image_count: int
+
+@router.post("/virtual", response_model=VirtualDatasetResponse)
+def preprocess_virtual(req: VirtualDatasetRequest):
+    """
+    Register `ops` over a subset as a new dataset without writing any
+    pixels; images are computed (and cached) when they are first viewed.
+    """
+    rels = _select_rel_paths(req.dataset_key, req.subset)
+    if not rels:
+        raise HTTPException(status_code=400, detail="No images found for the requested subset.")
+    try:
+        key = create_virtual_dataset(
+            name=req.new_dataset_name,
+            base_dataset=req.dataset_key,
+            rel_paths=rels,
+            ops=req.ops,
+            overwrite=req.overwrite,
+            subset=req.subset.model_dump(),
+        )
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return VirtualDatasetResponse(base_dataset=req.dataset_key, new_dataset_key=key, image_count=len(rels))
+
+class MaterializeRequest(BaseModel):
+    dataset_key: str  # a virtual dataset
+    new_dataset_name: str
+    overwrite: bool = False
+    output_format: str = Field("same_as_source", pattern="^(same_as_source|png|jpeg|webp)$")
+    encode_preset: Optional[str] = Field(None, pattern="^(export|export_small|export_lossless)$")
+
+@router.post("/materialize", response_model=BatchExportResponse)
+def preprocess_materialize(req: MaterializeRequest):
+    """Write a virtual dataset's images to disk as a regular dataset."""
+    spec = virtual_spec(req.dataset_key)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Virtual dataset not found: {req.dataset_key}")
+    try:
+        result = export_dataset(
+            base_dataset=spec.base,
+            rel_paths=spec.paths,
+            ops=spec.ops,
+            new_name=req.new_dataset_name,
+            overwrite=req.overwrite,
+            output_format=req.output_format,
+            preset=req.encode_preset,
+        )
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    return BatchExportResponse(
+        base_dataset=spec.base,
+        new_dataset_key=result["new_key"],
+        processed=result["processed"],
+        classes=result["classes"],
     )
+
+# ------------------------
+# Live preview session (WebSocket)
+# ------------------------
+
+async def _stream_steps(ws: WebSocket, session: PreviewSession, generation: int, rev: Any, max_side: int) -> None:
+    """Compute and send the steps of one edit until done or superseded."""
+    t0 = time.perf_counter()
+    ops = list(session.ops)  # this edit's list; session.ops moves on with the next one
+    try:
+        while (i := session.pending(generation)) is not None:
+            fut = submit_work(session.compute_step, generation, i)
+            try:
+                out = await asyncio.wrap_future(fut)
+            except asyncio.CancelledError:
+                fut.cancel()  # not started yet: never runs
+                raise
+            view = await asyncio.wrap_future(submit_work(session.render, out, max_side))
+            if generation != session.generation:
+                return
+            await ws.send_json({
+                "type": "step", "rev": rev, "index": i, "op": ops[i],
+                "after_data_url": view["data_url"], "after_shape": view["shape"],
+            })
+        if generation == session.generation:
+            await ws.send_json({
+                "type": "done", "rev": rev, "steps": len(ops),
+                "after_shape": list(frame_shape(session.final())),
+                "ms": round((time.perf_counter() - t0) * 1000.0, 2),
+            })
+    except Superseded:
+        pass
+    except MemoryBudgetExceeded as e:
+        await ws.send_json({"type": "error", "rev": rev, "status": e.status_code, "detail": str(e)})
+    except Exception as e:
+        await ws.send_json({"type": "error", "rev": rev, "status": 400, "detail": str(e)})
+
+def _session_max_side(value: Any) -> int:
+    """Client max_side, clamped to the batch_apply range (16..1024)."""
+    if value is None:
+        return settings.PREVIEW_MAX_SIDE
+    try:
+        return max(16, min(1024, int(value)))
+    except (TypeError, ValueError):
+        raise ValueError("max_side must be an integer.") from None
+
+def _session_ops(value: Any) -> List[Dict[str, Any]]:
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(op, dict) for op in value):
+        raise ValueError("ops must be a list of objects.")
+    return value
+
+@router.websocket("/session")
+async def preprocess_session(ws: WebSocket):
+    """
+    Live preview. Client messages (JSON):
+      {"type": "open", "dataset_key", "path", "max_side"?}
+      {"type": "ops", "rev", "ops": [...]}                 full op list
+      {"type": "splice", "rev", "start", "delete", "insert": [...]}
+    Server messages: "ready" (before image), then per edit one "step" per
+    recomputed step and a "done"; "error" on failure. An edit that arrives
+    mid-run cancels the steps of the previous one.
+    """
+    await ws.accept()
+    session: Optional[PreviewSession] = None
+    task: Optional[asyncio.Task] = None
+    max_side = settings.PREVIEW_MAX_SIDE
+
+    def stop_running() -> None:
+        if session is not None:
+            session.close()
+        if task is not None and not task.done():
+            task.cancel()
+
+    try:
+        while True:
+            try:
+                msg = json.loads(await ws.receive_text())
+            except ValueError:
+                await ws.send_json({"type": "error", "status": 400, "detail": "Message is not valid JSON."})
+                continue
+            if not isinstance(msg, dict):
+                await ws.send_json({"type": "error", "status": 400, "detail": "Message must be a JSON object."})
+                continue
+            kind = msg.get("type")
+            rev = msg.get("rev")
+            if kind == "open":
+                stop_running()
+                session = None
+                try:
+                    max_side = _session_max_side(msg.get("max_side"))
+                    session = await run_in_threadpool(PreviewSession, msg["dataset_key"], msg["path"])
+                    view = await run_in_threadpool(session.render, session.original, max_side)
+                except (KeyError, FileNotFoundError) as e:
+                    await ws.send_json({"type": "error", "status": 404, "detail": str(e)})
+                    continue
+                except MemoryBudgetExceeded as e:
+                    await ws.send_json({"type": "error", "status": e.status_code, "detail": str(e)})
+                    continue
+                except ValueError as e:
+                    await ws.send_json({"type": "error", "status": 400, "detail": str(e)})
+                    continue
+                await ws.send_json({
+                    "type": "ready", "dataset_key": session.dataset_key, "path": session.path,
+                    "before_data_url": view["data_url"], "shape": view["shape"],
+                })
+            elif kind in ("ops", "splice"):
+                if session is None:
+                    await ws.send_json({"type": "error", "rev": rev, "status": 400, "detail": "Send 'open' first."})
+                    continue
+                try:
+                    if kind == "ops":
+                        generation, start = session.set_ops(_session_ops(msg.get("ops")))
+                    else:
+                        generation, start = session.splice(
+                            int(msg.get("start", 0)), int(msg.get("delete", 0)), _session_ops(msg.get("insert")),
+                        )
+                except (ValueError, TypeError) as e:
+                    await ws.send_json({"type": "error", "rev": rev, "status": 400, "detail": str(e)})
+                    continue
+                if task is not None and not task.done():
+                    task.cancel()
+                await ws.send_json({"type": "accepted", "rev": rev, "from_step": start, "steps": len(session.steps)})
+                task = asyncio.create_task(_stream_steps(ws, session, generation, rev, max_side))
+                # a send that fails after the client left surfaces via the receive loop
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            elif kind == "close":
+                break
+            else:
+                await ws.send_json({"type": "error", "rev": rev, "status": 400, "detail": f"Unknown message type: {kind}"})
+        await ws.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stop_running()
@@ -0,0 +1,153 @@
+"""
+Batched execution of compiled pipelines over many frames (exports).
+
+After a fixed-size resize or pad every frame has the same shape, so runs
+of per-pixel steps execute on (B, H, W, C) stacks instead of once per
+image:
+
+- value maps (brightness/contrast, the zero_one/minus_one_one normalizes)
+  depend only on the byte value, so a run of them is fused into one
+  256-entry table (built by running the real ops on a 0..255 ramp) and
+  applied with a single cv2.LUT per stack;
+- to_grayscale runs on the stack viewed as one tall (B*H, W, C) frame;
+- zscore reduces over axes (1, 2), i.e. per image and channel.
+
+Geometry and neighbourhood ops (resize, crop, pad, blur/sharpen, edges,
+reset) still run frame by frame. Stacks are capped at STACK_BYTES so the
+float32 temporaries of zscore stay cache-sized; bigger stacks measured
+slower than the per-image loop. Results are identical to run_compiled on
+each frame.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Tuple
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.image_ops import (
+    CompiledOp,
+    _zscore_map,
+    _zscore_stats,
+    cv2,
+    np,
+    op_normalize,
+    op_to_grayscale,
+    run_pipeline,
+)
+
+STACK_BYTES = 4 * 2**20
+
+Kernel = Callable[[np.ndarray], np.ndarray]
+
+def _is_value_map(step: CompiledOp) -> bool:
+    if step.type == "brightness_contrast":
+        return True
+    return step.type == "normalize" and step.kwargs.get("mode") in ("zero_one", "minus_one_one")
+
+def _tall(stack: np.ndarray) -> np.ndarray:
+    b, h, w, c = stack.shape
+    return stack.reshape(b * h, w, c)
+
+def _lut_kernel(run: List[CompiledOp]) -> Kernel:
+    ramp = np.arange(256, dtype=np.uint8).reshape(1, 256, 1).repeat(3, axis=2)
+    for step in run:
+        ramp = step.fn(ramp, **step.kwargs)
+    table = np.ascontiguousarray(ramp[0, :, 0])
+    return lambda stack: cv2.LUT(_tall(stack), table).reshape(stack.shape)
+
+def _grayscale_kernel(stack: np.ndarray) -> np.ndarray:
+    return op_to_grayscale(_tall(stack)).reshape(stack.shape[:3] + (3,))
+
+def _zscore_kernel(stack: np.ndarray) -> np.ndarray:
+    arr = stack.astype(np.float32)
+    mu, sd = _zscore_stats(arr, axes=(1, 2))
+    return _zscore_map(arr, mu, sd).astype(np.uint8)
+
+def _normalize_kernel(mode: str) -> Kernel:
+    if mode == "zscore":
+        return _zscore_kernel
+    return lambda stack: op_normalize(stack, mode=mode)  # unknown mode: identity
+
+# op types with a batched form; see kernels() for how each is run
+BATCHED_OPS = ("brightness_contrast", "to_grayscale", "normalize")
+
+def kernels(run: List[CompiledOp]) -> List[Tuple[str, Kernel]]:
+    """(timing name, stack -> stack) for a run of batchable steps, value maps fused."""
+    out: List[Tuple[str, Kernel]] = []
+    pending: List[CompiledOp] = []
+    for step in run + [None]:
+        if step is not None and _is_value_map(step):
+            pending.append(step)
+            continue
+        if pending:
+            out.append(("+".join(s.type for s in pending), _lut_kernel(pending)))
+            pending = []
+        if step is None:
+            break
+        if step.type == "to_grayscale":
+            out.append((step.type, _grayscale_kernel))
+        else:
+            out.append((step.type, _normalize_kernel(step.kwargs["mode"])))
+    return out
+
+def segments(steps: List[CompiledOp]) -> List[Tuple[bool, List[CompiledOp]]]:
+    """Split steps into maximal runs of (batchable?, steps)."""
+    out: List[Tuple[bool, List[CompiledOp]]] = []
+    for step in steps:
+        batched = step.type in BATCHED_OPS
+        if out and out[-1][0] == batched:
+            out[-1][1].append(step)
+        else:
+            out.append((batched, [step]))
+    return out
+
+def is_batchable(steps: List[CompiledOp]) -> bool:
+    return any(step.type in BATCHED_OPS for step in steps)
+
+def _stacks(frames: List[np.ndarray], idxs: List[int]) -> List[List[int]]:
+    """Split a same-shape group into chunks of at most STACK_BYTES."""
+    per = max(1, STACK_BYTES // max(1, frames[idxs[0]].nbytes))
+    return [idxs[k:k + per] for k in range(0, len(idxs), per)]
+
+def run_batched(origs: List[np.ndarray], steps: List[CompiledOp]) -> List[np.ndarray]:
+    """
+    run_compiled over every frame in `origs`, stacking same-shaped frames
+    for the batchable runs. Frames large enough for the tiled runner go
+    through run_pipeline on their own. Outputs may be views of a stack.
+    """
+    out: List[np.ndarray] = list(origs)
+    small: List[int] = []
+    for i, frame in enumerate(origs):
+        h, w = frame.shape[:2]
+        if settings.TILED_MIN_PIXELS and w * h >= settings.TILED_MIN_PIXELS:
+            out[i] = run_pipeline(frame, steps)
+        else:
+            small.append(i)
+
+    for batched, run in segments(steps):
+        if not batched:
+            for i in small:
+                for step in run:
+                    out[i] = step(out[i], origs[i])
+            continue
+        ks = kernels(run)
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for i in small:
+            groups.setdefault(out[i].shape, []).append(i)
+        for shape, idxs in groups.items():
+            if len(shape) != 3 or shape[2] != 3:
+                for i in idxs:
+                    for step in run:
+                        out[i] = step(out[i], origs[i])
+                continue
+            for chunk in _stacks(out, idxs):
+                if len(chunk) == 1:
+                    stack = out[chunk[0]][None]
+                else:
+                    with metrics.stage("stack"):
+                        stack = np.stack([out[i] for i in chunk])
+                for name, kernel in ks:
+                    with metrics.op(name):
+                        stack = kernel(stack)
+                for j, i in enumerate(chunk):
+                    out[i] = stack[j]
+    return out
@@ -0,0 +1,313 @@
+"""
+Dry-run cost estimates for exports: output size, disk footprint, peak
+decoded memory and runtime of an op plan over a set of dataset images,
+computed without decoding any of them.
+
+Each image's size comes from its header (services/loader.py); output
+shapes follow analytically through the plan (infer_shapes). Time is
+priced from per-op costs measured on this machine: the first estimate
+that meets an op type, decoder or encode preset runs it a few times on a
+synthetic 512x512 frame, with fixed parameters whose output is no larger
+than that frame, and stores seconds per pixel under
+CACHE_DIR/cost_model.json, keyed by host so a shared cache never mixes
+machines. Each step is then charged per max(input, output) pixel of its
+inferred sizes, so a huge resize costs its output size without ever
+being run. Output bytes scale each source file's own bytes per pixel by
+the calibrated ratio between the source and output encoders.
+
+Dry runs calibrate what is missing before answering (outside the table
+lock, so other estimates are not held up). Real exports never wait for
+it: they price with the table as it is, start the missing measurements
+in the background and skip the time limits until they are in.
+
+Estimates are meant to catch plans that are off by an order of
+magnitude, not to be exact: encode cost and compressed size depend on
+image content, and measure within about 2x of real photos. Time is
+compute only; exports overlap file I/O with it (services/staged_io.py),
+so it is a floor when disks are slow.
+"""
+from __future__ import annotations
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import os
+import platform
+import shutil
+import threading
+
+from app.core.config import settings
+from app.core.lazy import lazy_import
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+_MODEL_VERSION = 2
+_CAL_SIDE = 512
+_CAL_REPEAT = 3
+
+# the one configuration each op type is measured at; none grows the frame
+# (pad runs on a 3/4 crop, see _measure_op)
+_CAL_OPS: Dict[str, Dict[str, Any]] = {
+    "resize": {"type": "resize", "mode": "size", "w": 384, "h": 384},
+    "crop_center": {"type": "crop_center", "w": 384, "h": 384},
+    "pad": {"type": "pad", "w": _CAL_SIDE, "h": _CAL_SIDE, "mode": "edge"},
+    "brightness_contrast": {"type": "brightness_contrast", "b": 10, "c": 10},
+    "blur_sharpen": {"type": "blur_sharpen", "blur": 1.5, "sharp": 0.5},
+    "edges": {"type": "edges", "method": "canny", "threshold": 100},
+    "to_grayscale": {"type": "to_grayscale"},
+    "normalize": {"type": "normalize", "mode": "zscore"},
+}
+
+_lock = threading.Lock()  # guards _table and the file, never held while measuring
+_table: Optional[Dict[str, float]] = None
+_background: Optional[threading.Thread] = None
+
+def _model_path() -> Path:
+    return settings.CACHE_DIR / "cost_model.json"
+
+def _host() -> str:
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}/cv{cv2.__version__}"
+
+def _load() -> Dict[str, float]:
+    global _table
+    if _table is None:
+        _table = {}
+        try:
+            with _model_path().open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == _MODEL_VERSION and data.get("host") == _host():
+                _table = data.get("costs", {})
+        except (OSError, ValueError):
+            pass
+    return _table
+
+def _save(table: Dict[str, float]) -> None:
+    p = _model_path()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"version": _MODEL_VERSION, "host": _host(), "costs": table}, f, indent=1, sort_keys=True)
+    os.replace(tmp, p)
+
+def reset() -> None:
+    """Forget calibrations (in memory and on disk)."""
+    global _table
+    with _lock:
+        _table = None
+        _model_path().unlink(missing_ok=True)
+
+# ------------------------
+# Calibration
+# ------------------------
+
+def _sample_frame() -> "np.ndarray":
+    """Deterministic photo-like BGR frame: gradients, texture, mild noise."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:_CAL_SIDE, 0:_CAL_SIDE].astype(np.float32)
+    base = np.stack([x * 0.4, y * 0.4, (x + y) * 0.25], axis=2)
+    base += (40 * np.sin(x / 23.0) * np.cos(y / 17.0))[..., None]
+    base += rng.normal(0.0, 1.0, base.shape)
+    return np.clip(base, 0, 255).astype(np.uint8)
+
+def _best_of(fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(_CAL_REPEAT):
+        t0 = perf_counter()
+        fn()
+        best = min(best, perf_counter() - t0)
+    return best
+
+def _measure_op(op_type: str) -> float:
+    from app.services.image_ops import compile_pipeline
+
+    if op_type == "reset" or op_type not in _CAL_OPS:
+        return 0.0
+    (step,) = compile_pipeline([_CAL_OPS[op_type]])
+    frame = _sample_frame()
+    if op_type == "pad":
+        frame = frame[: _CAL_SIDE * 3 // 4, : _CAL_SIDE * 3 // 4]
+    out = step.fn(frame, **step.kwargs)
+    px = max(frame.shape[0] * frame.shape[1], out.shape[0] * out.shape[1])
+    return _best_of(lambda: step.fn(frame, **step.kwargs)) / px
+
+def _measure_codec(fmt: str, preset: str) -> Dict[str, float]:
+    from app.services.encoding import encode
+    from app.services.loader import decode_bgr
+
+    frame = _sample_frame()
+    px = frame.shape[0] * frame.shape[1]
+    data, _ = encode(frame, fmt, preset=preset)
+    return {
+        f"encode:{fmt}:{preset}": _best_of(lambda: encode(frame, fmt, preset=preset)) / px,
+        f"decode:{fmt}:{preset}": _best_of(lambda: decode_bgr(data)) / px,
+        f"bpp:{fmt}:{preset}": len(data) / px,
+    }
+
+def _op_key(op_type: str) -> str:
+    return f"op:{op_type}"
+
+def _missing(table: Dict[str, float], steps: List, codecs: List[Tuple[str, str]]) -> Tuple[List[str], List[Tuple[str, str]]]:
+    op_types = sorted({s.type for s in steps if _op_key(s.type) not in table})
+    return op_types, [c for c in codecs if f"bpp:{c[0]}:{c[1]}" not in table]
+
+def calibrate(steps: List, codecs: List[Tuple[str, str]]) -> Dict[str, float]:
+    """
+    Cost table covering the op types of `steps` and the (format, preset)
+    codecs, measuring whatever is missing and persisting it. Returns a
+    snapshot. Measuring runs without the lock; concurrent callers may
+    measure the same entry twice, which is harmless.
+    """
+    with _lock:
+        op_types, codecs = _missing(_load(), steps, codecs)
+    if not op_types and not codecs:
+        return snapshot()
+    found: Dict[str, float] = {_op_key(t): _measure_op(t) for t in op_types}
+    for fmt, preset in codecs:
+        found.update(_measure_codec(fmt, preset))
+    with _lock:
+        table = _load()
+        table.update(found)
+        _save(table)
+        return dict(table)
+
+def calibrate_in_background(steps: List, codecs: List[Tuple[str, str]]) -> None:
+    """calibrate() on a daemon thread, unless one is already running."""
+    global _background
+    with _lock:
+        if _background is not None and _background.is_alive():
+            return
+        _background = threading.Thread(target=calibrate, args=(steps, codecs), name="cost-model", daemon=True)
+        _background.start()
+
+def snapshot() -> Dict[str, float]:
+    with _lock:
+        return dict(_load())
+
+# ------------------------
+# Estimate
+# ------------------------
+
+def _headers(root: Path, rel_paths: List[str]) -> List[Tuple[str, Tuple[int, int], str, int]]:
+    """(rel, (w, h), format, file bytes) for every readable image; header reads only."""
+    from app.services.loader import mapped, read_header
+
+    out = []
+    for rel in rel_paths:
+        try:
+            with mapped(root / rel) as data:
+                h = read_header(data)
+                nbytes = len(data)
+        except Exception:
+            continue
+        if h.format in ("JPEG", "PNG", "WEBP") and h.width > 0 and h.height > 0:
+            out.append((rel, h.size, h.format, nbytes))
+    return out
+
+def estimate_export(
+    dataset_key: str,
+    rel_paths: List[str],
+    ops: List[Dict[str, Any]],
+    output_format: str = "same_as_source",
+    preset: Optional[str] = None,
+    measure: bool = True,
+) -> Dict[str, Any]:
+    """
+    Estimated cost of export_dataset(dataset_key, rel_paths, ops, ...).
+    Virtual datasets are priced from their base files with their own ops
+    in front. Raises ValueError for a bad plan, format or preset. With
+    `measure` False missing costs are measured in the background and the
+    estimate is marked "calibrated": False (time is then a lower bound).
+    """
+    from app.services.datasets import virtual_spec
+    from app.services.encoding import get_preset, normalize_format
+    from app.services.image_ops import DATASETS_DIR, compile_pipeline, infer_shapes
+    from app.services.memory import estimate_bytes
+
+    preset_name = get_preset(preset or settings.EXPORT_PRESET).name
+    forced = None if output_format == "same_as_source" else normalize_format(output_format)
+    steps = compile_pipeline(ops)
+    spec = virtual_spec(dataset_key)
+    if spec is not None:
+        steps = list(spec.steps or compile_pipeline(spec.ops)) + steps
+    root = (DATASETS_DIR / (spec.base if spec is not None else dataset_key)).resolve()
+
+    images = _headers(root, rel_paths)
+    src_formats = sorted({fmt for _, _, fmt, _ in images})
+    codecs = [(fmt, "export") for fmt in src_formats]
+    codecs += [(fmt, preset_name) for fmt in ([forced] if forced else src_formats)]
+    codecs = sorted(set(codecs))
+    if measure:
+        table = calibrate(steps, codecs)
+    else:
+        table = snapshot()
+        if any(_missing(table, steps, codecs)):
+            calibrate_in_background(steps, codecs)
+    calibrated = not any(_missing(table, steps, codecs))
+
+    by_stage: Dict[str, float] = {"decode": 0.0, "encode": 0.0}
+    out_bytes = raw_bytes = peak = 0
+    largest = (0, 0)
+    for _, (w, h), src_fmt, nbytes in images:
+        by_stage["decode"] += table.get(f"decode:{src_fmt}:export", 0.0) * w * h
+        ih, iw = h, w
+        for step, (oh, ow) in zip(steps, infer_shapes(steps, (h, w))):
+            cost = table.get(_op_key(step.type), 0.0)
+            by_stage[step.type] = by_stage.get(step.type, 0.0) + cost * max(ih * iw, oh * ow)
+            ih, iw = oh, ow
+        out_fmt = forced or src_fmt
+        by_stage["encode"] += table.get(f"encode:{out_fmt}:{preset_name}", 0.0) * iw * ih
+        # the source's own compressibility, moved to the output encoder
+        # (kept as is until both encoders are calibrated)
+        out_bpp, src_bpp = table.get(f"bpp:{out_fmt}:{preset_name}"), table.get(f"bpp:{src_fmt}:export")
+        ratio = out_bpp / max(src_bpp, 1e-9) if out_bpp and src_bpp else 1.0
+        bpp = min(nbytes / (w * h) * ratio, 3.0)
+        out_bytes += int(bpp * iw * ih)
+        raw_bytes += iw * ih * 3
+        peak = max(peak, estimate_bytes((w, h), steps, 3))
+        largest = max(largest, (iw, ih), key=lambda s: s[0] * s[1])
+
+    free = shutil.disk_usage(DATASETS_DIR if DATASETS_DIR.exists() else settings.CACHE_DIR).free
+    est = {
+        "images": len(images),
+        "unreadable": len(rel_paths) - len(images),
+        "output_bytes": out_bytes,
+        "raw_bytes": raw_bytes,
+        "peak_memory_bytes": peak,
+        "seconds": round(sum(by_stage.values()), 3),
+        "seconds_by_stage": {k: round(v, 3) for k, v in by_stage.items()},
+        "largest_output": list(largest),
+        "free_disk_bytes": free,
+        "calibrated": calibrated,
+    }
+    est["warnings"], est["exceeds"] = check_limits(est)
+    return est
+
+def check_limits(est: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """
+    (warnings, limit violations) for an estimate against the EXPORT_*
+    settings; an export with violations should not start.
+    """
+    warnings: List[str] = []
+    exceeds: List[str] = []
+    mb = est["output_bytes"] / 2**20
+    secs = est["seconds"]
+    if settings.EXPORT_MAX_OUTPUT_MB and mb > settings.EXPORT_MAX_OUTPUT_MB:
+        exceeds.append(f"Estimated output {mb:.0f} MB is over the {settings.EXPORT_MAX_OUTPUT_MB} MB export limit.")
+    elif settings.EXPORT_WARN_OUTPUT_MB and mb > settings.EXPORT_WARN_OUTPUT_MB:
+        warnings.append(f"Estimated output is {mb:.0f} MB.")
+    timed = est.get("calibrated", True)  # an uncalibrated runtime is partly unpriced
+    if timed and settings.EXPORT_MAX_SECONDS and secs > settings.EXPORT_MAX_SECONDS:
+        exceeds.append(f"Estimated runtime {secs:.0f} s is over the {settings.EXPORT_MAX_SECONDS:g} s export limit.")
+    elif timed and settings.EXPORT_WARN_SECONDS and secs > settings.EXPORT_WARN_SECONDS:
+        warnings.append(f"Estimated runtime is {secs:.0f} s.")
+    if est["output_bytes"] > est["free_disk_bytes"]:
+        exceeds.append(
+            f"Estimated output {mb:.0f} MB does not fit the {est['free_disk_bytes'] / 2**20:.0f} MB free on disk."
+        )
+    if settings.MEMORY_BUDGET_MB and est["peak_memory_bytes"] > settings.MEMORY_BUDGET_MB * 2**20:
+        policy = "downscaled on decode" if settings.MEMORY_OVERSIZE_POLICY == "downscale" else "rejected"
+        warnings.append(f"Some images need more than the {settings.MEMORY_BUDGET_MB} MB pixel budget and will be {policy}.")
+    if est["unreadable"]:
+        warnings.append(f"{est['unreadable']} image(s) could not be read and are not counted.")
+    return warnings, exceeds
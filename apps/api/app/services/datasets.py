@@ -1,15 +1,41 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-import csv, json, random, io, base64, time
+from typing import Any, Dict, List, Tuple, Optional
+import csv, json, random, io, base64, logging, os, shutil, time, threading
 
 from PIL import Image
 
+from app.core import metrics
 from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.services.encoding import data_url_json, preview_format, to_data_url
+from app.services.loader import open_pil
+from app.services import shared_cache
+from app.services.memory import admit
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+logger = logging.getLogger(__name__)
 
 DATASETS_DIR = settings.DATASETS_DIR
 
+# descriptor file marking a virtual dataset folder (no images/ of its own)
+VIRTUAL_FILE = "virtual.json"
+
+@dataclass
+class VirtualSpec:
+    """Pixels come from `base` (a real dataset) with `ops` applied on demand."""
+    base: str
+    ops: List[Dict]
+    paths: List[str]
+    # set once the base chain is resolved at discovery
+    steps: Optional[List] = None
+    signature: str = ""
+
 @dataclass
 class DatasetIndex:
     key: str
@@ -19,6 +45,7 @@ class DatasetIndex:
     rows: List[Dict[str, str]]  # each row: id, path, class, split
     approx_count: Dict[str, int]
     meta: Dict
+    virtual: Optional[VirtualSpec] = None
 
 def _read_json(p: Path) -> Dict:
     with p.open("r", encoding="utf-8") as f:
@@ -38,28 +65,34 @@ def _read_index_csv(p: Path) -> List[Dict[str, str]]:
             })
     return rows
 
-def _encode_preview_png(img: Image.Image, max_side: int) -> str:
+def _preview_size(w: int, h: int, max_side: int) -> Tuple[int, int]:
+    """(w, h) scaled so the longest side is at most max_side."""
+    if max(w, h) <= max_side:
+        return w, h
+    if w >= h:
+        return max_side, int(h * (max_side / w))
+    return int(w * (max_side / h)), max_side
+
+def _downscale_for_preview(img: Image.Image, max_side: int) -> Image.Image:
+    size = _preview_size(img.width, img.height, max_side)
+    if size != img.size:
+        img = img.resize(size, Image.BICUBIC)
+    return img
+
+def _encode_preview_png(img: Image.Image, max_side: int, as_json: bool = False):
+    """Preview data URL: a str, or RawJSON for TimedJSONResponse when as_json."""
     # downscale for UI
-    w, h = img.size
-    if max(w, h) > max_side:
-        if w >= h:
-            new_w = max_side
-            new_h = int(h * (max_side / w))
-        else:
-            new_h = max_side
-            new_w = int(w * (max_side / h))
-        img = img.resize((new_w, new_h), Image.BICUBIC)
+    with metrics.stage("resize"):
+        img = _downscale_for_preview(img, max_side)
 
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-    return f"data:image/png;base64,{b64}"
+    encode_url = data_url_json if as_json else to_data_url
+    return encode_url(img, preview_format("PNG"), preset="preview")
 
 # ----------------------------
 # image scan fallback
 # ----------------------------
 
-_IMG_EXTS = {".jpg", ".jpeg", ".png"}
+_IMG_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
 
 def _scan_images_build_rows(images_dir: Path) -> Tuple[List[Dict[str, str]], Dict[str, int], List[str]]:
     """
@@ -97,80 +130,99 @@ def _scan_images_build_rows(images_dir: Path) -> Tuple[List[Dict[str, str]], Dic
 # Discovery & caching
 # ----------------------------
 
-def discover_datasets() -> Dict[str, DatasetIndex]:
+def _load_dataset_dir(ds_dir: Path) -> Optional[DatasetIndex]:
     """
-    Scan DATASETS_DIR for child folders containing images/.
+    Build the index for one dataset folder, or None if it is not a dataset.
     Prefer metadata.json + index.csv if present; otherwise synthesize rows
     by scanning images/ tree (works for Module 2 exports).
     """
-    datasets: Dict[str, DatasetIndex] = {}
-    if not DATASETS_DIR.exists():
-        return datasets
-
-    for ds_dir in DATASETS_DIR.iterdir():
-        if not ds_dir.is_dir():
-            continue
-
-        images_dir = ds_dir / "images"
-        if not images_dir.exists():
-            # Not a dataset
-            continue
-
-        meta_path = ds_dir / "metadata.json"
-        csv_path = ds_dir / "index.csv"
-
-        # meta: default skeleton if missing
-        meta: Dict = {"key": ds_dir.name, "name": ds_dir.name}
-        if meta_path.exists():
-            try:
-                meta = _read_json(meta_path)
-                # ensure key present
-                meta["key"] = meta.get("key", ds_dir.name)
-            except Exception:
-                # keep default meta if json invalid
-                meta = {"key": ds_dir.name, "name": ds_dir.name}
+    if not ds_dir.is_dir():
+        return None
+    if (ds_dir / VIRTUAL_FILE).exists():
+        return _load_virtual_stub(ds_dir)
 
-        # rows & counts: prefer csv if available; else scan filesystem
-        if csv_path.exists():
-            try:
-                rows = _read_index_csv(csv_path)
-            except Exception:
-                rows = []
-        else:
+    images_dir = ds_dir / "images"
+    if not images_dir.exists():
+        # Not a dataset
+        return None
+
+    meta_path = ds_dir / "metadata.json"
+    csv_path = ds_dir / "index.csv"
+
+    # meta: default skeleton if missing
+    meta: Dict = {"key": ds_dir.name, "name": ds_dir.name}
+    if meta_path.exists():
+        try:
+            meta = _read_json(meta_path)
+            # ensure key present
+            meta["key"] = meta.get("key", ds_dir.name)
+        except Exception:
+            # keep default meta if json invalid
+            meta = {"key": ds_dir.name, "name": ds_dir.name}
+
+    # rows & counts: prefer csv if available; else scan filesystem
+    if csv_path.exists():
+        try:
+            rows = _read_index_csv(csv_path)
+        except Exception:
             rows = []
+    else:
+        rows = []
 
-        counts: Dict[str, int] = {}
-        classes: List[str] = []
-
-        if rows:
-            # derive classes from metadata (fallback to folders)
-            classes = list(meta.get("classes") or [])
-            if not classes:
-                # infer from rows
-                classes = sorted({r["class"] for r in rows if r.get("class")})
-            # count per class from rows
-            counts = {c: 0 for c in classes}
-            for r in rows:
-                c = r.get("class")
-                if c in counts:
-                    counts[c] += 1
-            # if classes somehow still empty, fallback to scanning
-            if not classes:
-                rows, counts, classes = _scan_images_build_rows(images_dir)
-        else:
-            # scan images/ to synthesize rows
+    counts: Dict[str, int] = {}
+    classes: List[str] = []
+
+    if rows:
+        # derive classes from metadata (fallback to folders)
+        classes = list(meta.get("classes") or [])
+        if not classes:
+            # infer from rows
+            classes = sorted({r["class"] for r in rows if r.get("class")})
+        # count per class from rows
+        counts = {c: 0 for c in classes}
+        for r in rows:
+            c = r.get("class")
+            if c in counts:
+                counts[c] += 1
+        # if classes somehow still empty, fallback to scanning
+        if not classes:
             rows, counts, classes = _scan_images_build_rows(images_dir)
+    else:
+        # scan images/ to synthesize rows
+        rows, counts, classes = _scan_images_build_rows(images_dir)
+
+    ds_index = DatasetIndex(
+        key=meta.get("key", ds_dir.name),
+        root=ds_dir,
+        images_dir=images_dir,
+        classes=classes,
+        rows=rows,
+        approx_count=counts,
+        meta=meta
+    )
+    return ds_index
 
-        ds_index = DatasetIndex(
-            key=meta.get("key", ds_dir.name),
-            root=ds_dir,
-            images_dir=images_dir,
-            classes=classes,
-            rows=rows,
-            approx_count=counts,
-            meta=meta
-        )
-        datasets[ds_index.key] = ds_index
+def discover_datasets() -> Dict[str, DatasetIndex]:
+    """
+    Scan DATASETS_DIR for child folders containing images/.
+    Folders are indexed concurrently (the work is mostly stat/readdir/CSV
+    I/O); results keep directory order.
+    """
+    datasets: Dict[str, DatasetIndex] = {}
+    if not DATASETS_DIR.exists():
+        return datasets
+
+    ds_dirs = list(DATASETS_DIR.iterdir())
+    workers = settings.DISCOVERY_WORKERS or min(8, len(ds_dirs))
+    if workers <= 1:
+        found = [_load_dataset_dir(d) for d in ds_dirs]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="discover") as pool:
+            found = list(pool.map(_load_dataset_dir, ds_dirs))
+    for ds_index in found:
+        if ds_index is not None:
+            datasets[ds_index.key] = ds_index
+    _resolve_virtuals(datasets)
     return datasets
 
 # a module-level cache; refreshed on startup and when FS changes
@@ -198,15 +250,110 @@ def _fs_signature() -> Tuple[float, Tuple[str, ...]]:
     names.sort()
     return (mt, tuple(names))
 
+# one rebuild at a time; concurrent callers wait for it instead of rescanning
+_DATASETS_LOCK = threading.Lock()
+_INDEX_READY = threading.Event()
+
 def get_datasets_index(force_refresh: bool = False) -> Dict[str, DatasetIndex]:
     global _DATASETS_CACHE, _DATASETS_FS_SNAPSHOT
-    # Refresh if explicitly requested or FS snapshot changed
-    current_sig = _fs_signature()
-    if _DATASETS_CACHE is None or force_refresh or (_DATASETS_FS_SNAPSHOT != current_sig):
-        _DATASETS_CACHE = discover_datasets()
-        _DATASETS_FS_SNAPSHOT = current_sig
+    with metrics.stage("index"):
+        # Refresh if explicitly requested or FS snapshot changed
+        current_sig = _fs_signature()
+        if _DATASETS_CACHE is None or force_refresh or (_DATASETS_FS_SNAPSHOT != current_sig):
+            with _DATASETS_LOCK:
+                # another thread may have rebuilt it while we waited
+                if _DATASETS_CACHE is None or force_refresh or (_DATASETS_FS_SNAPSHOT != current_sig):
+                    metrics.count("visionblocks_cache_requests_total", cache="datasets_index", result="miss")
+                    _DATASETS_CACHE = discover_datasets()
+                    _DATASETS_FS_SNAPSHOT = current_sig
+                    _INDEX_READY.set()
+        else:
+            metrics.count("visionblocks_cache_requests_total", cache="datasets_index", result="hit")
     return _DATASETS_CACHE
 
+def install_dataset(staged: Path, key: str) -> DatasetIndex:
+    """
+    Move a fully written dataset folder into DATASETS_DIR/<key> and add it
+    to the cached index without rescanning the other datasets. If the index
+    was already stale, the usual rescan on the next request picks it up.
+    """
+    global _DATASETS_FS_SNAPSHOT
+    dest = DATASETS_DIR / key
+    with _DATASETS_LOCK:
+        if dest.exists():
+            raise FileExistsError(f"Dataset '{key}' already exists.")
+        was_current = _DATASETS_CACHE is not None and _DATASETS_FS_SNAPSHOT == _fs_signature()
+        try:
+            os.replace(staged, dest)
+        except OSError:
+            shutil.move(str(staged), str(dest))  # staging on another filesystem
+        ds_index = _load_dataset_dir(dest)
+        if ds_index is None:
+            raise ValueError(f"'{key}' is not a dataset folder (no images/).")
+        if was_current:
+            _DATASETS_CACHE[ds_index.key] = ds_index
+            _DATASETS_FS_SNAPSHOT = _fs_signature()
+    hash_in_background([ds_index])
+    return ds_index
+
+def index_hashes(datasets: List[DatasetIndex]) -> None:
+    """Perceptual hashes for every indexed row of `datasets` (one thread, incremental)."""
+    from app.services.phash import ensure_hashes
+
+    for ds in datasets:
+        if ds.virtual is not None:
+            continue  # hashed through its base dataset
+        try:
+            ensure_hashes(ds.key, ds.root, [r["path"] for r in ds.rows], workers=1)
+        except Exception:
+            logger.exception("Hashing dataset %s failed; /duplicates will retry", ds.key)
+
+def hash_in_background(datasets: List[DatasetIndex]) -> Optional[threading.Thread]:
+    """index_hashes() on a daemon thread, if PHASH_ON_INDEX is set."""
+    if not settings.PHASH_ON_INDEX or not datasets:
+        return None
+    t = threading.Thread(target=index_hashes, args=(list(datasets),), name="datasets-phash", daemon=True)
+    t.start()
+    return t
+
+_INDEX_ERROR: Optional[str] = None  # last warm-up failure, cleared on success
+_WARMUP_RETRY_MAX_S = 30.0
+
+def _warm_up() -> None:
+    """Build the index, retrying with backoff until it succeeds once."""
+    global _INDEX_ERROR
+    delay = 1.0
+    while not _INDEX_READY.is_set():
+        try:
+            idx = get_datasets_index(force_refresh=True)
+            _INDEX_ERROR = None
+            hash_in_background(list(idx.values()))
+            return
+        except Exception as e:
+            _INDEX_ERROR = f"{type(e).__name__}: {e}"
+            logger.exception("Building the dataset index failed; retrying in %.0f s", delay)
+        # a request may rebuild it meanwhile; that also sets _INDEX_READY
+        _INDEX_READY.wait(delay)
+        delay = min(delay * 2, _WARMUP_RETRY_MAX_S)
+
+def warm_datasets_index() -> threading.Thread:
+    """
+    Build the index in a background thread so the server accepts traffic
+    (and answers liveness checks) while indexing finishes, then hash its
+    datasets (hash_in_background). Failures are logged and retried;
+    datasets_index_error() reports the latest one.
+    """
+    t = threading.Thread(target=_warm_up, name="datasets-index-warmup", daemon=True)
+    t.start()
+    return t
+
+def datasets_index_ready() -> bool:
+    return _INDEX_READY.is_set()
+
+def datasets_index_error() -> Optional[str]:
+    """Why the index is not ready yet, if the warm-up build has failed."""
+    return None if _INDEX_READY.is_set() else _INDEX_ERROR
+
 def list_datasets() -> List[Tuple[str, str]]:
     idx = get_datasets_index()  # auto-refreshes if FS changed
     items: List[Tuple[str, str]] = []
@@ -236,7 +383,8 @@ def dataset_info(key: str) -> Dict:
         meta["image_shape"] = [None, None, 3]
     return meta
 
-def sample_from_dataset(key: str, mode: str = "random", index: Optional[int] = None) -> Tuple[Dict, Image.Image]:
+def _sample_row(key: str, mode: str, index: Optional[int]) -> Tuple[Dict, DatasetIndex]:
+    """Pick the row for /sample; returns (payload without image, dataset)."""
     idx = get_datasets_index()
     if key not in idx:
         # Refresh and retry once (handles newly created datasets)
@@ -256,7 +404,18 @@ def sample_from_dataset(key: str, mode: str = "random", index: Optional[int] = N
         i = random.randrange(0, len(rows))
 
     row = rows[i]
-    rel = row["path"]
+    payload = {
+        "dataset_key": key,
+        "index_used": i,
+        "label": row["class"],
+        "path": row["path"]
+    }
+    return payload, ds
+
+def _load_row_image(ds: DatasetIndex, rel: str) -> Image.Image:
+    if ds.virtual is not None:
+        return _bgr_to_pil(virtual_frame(ds.key, rel))
+
     img_path = ds.root / rel
     if not img_path.exists():
         # If a row is stale, rebuild the index once and retry
@@ -265,23 +424,40 @@ def sample_from_dataset(key: str, mode: str = "random", index: Optional[int] = N
         if not img_path.exists():
             raise FileNotFoundError(f"Image path not found: {rel}")
 
-    # open image
-    with Image.open(img_path) as im:
+    # open image (decoded pixels outlive the mapping; no copy needed)
+    with open_pil(img_path) as src, admit(src, []) as im:
         # ensure RGB/RGBA friendly to preview
         if im.mode not in ("RGB", "RGBA", "L"):
             im = im.convert("RGB")
-        im_load = im.copy()
+        return im
 
-    payload = {
-        "dataset_key": key,
-        "index_used": i,
-        "label": row["class"],
-        "path": rel
-    }
-    return payload, im_load
+def sample_from_dataset(key: str, mode: str = "random", index: Optional[int] = None) -> Tuple[Dict, Image.Image]:
+    payload, ds = _sample_row(key, mode, index)
+    return payload, _load_row_image(ds, payload["path"])
 
-def image_data_url(im: Image.Image) -> str:
-    return _encode_preview_png(im, settings.PREVIEW_MAX_SIDE)
+def sample_preview(key: str, mode: str = "random", index: Optional[int] = None) -> Dict:
+    """
+    /sample payload including image_data_url. The encoded preview is shared
+    across workers (services/shared_cache.py): a hit skips decode and encode.
+    """
+    from app.services.image_ops import dataset_image_key
+
+    payload, ds = _sample_row(key, mode, index)
+    rel = payload["path"]
+    try:
+        ck = f"{dataset_image_key(key, rel)}:{settings.PREVIEW_MAX_SIDE}:{settings.PREVIEW_FORMAT}"
+    except FileNotFoundError:
+        ck = None  # stale row: _load_row_image refreshes or raises
+    hit = shared_cache.get_bytes("preview", ck) if ck else None
+    if hit is not None:
+        return {**payload, "image_data_url": hit.decode("ascii")}
+    url = image_data_url(_load_row_image(ds, rel))
+    if ck:
+        shared_cache.put_bytes("preview", ck, url.encode("ascii"))
+    return {**payload, "image_data_url": url}
+
+def image_data_url(im: Image.Image, as_json: bool = False):
+    return _encode_preview_png(im, settings.PREVIEW_MAX_SIDE, as_json)
 
 def load_image_by_relpath(key: str, relpath: str) -> Image.Image:
     idx = get_datasets_index()
@@ -290,13 +466,180 @@ def load_image_by_relpath(key: str, relpath: str) -> Image.Image:
         if key not in idx:
             raise KeyError(f"Unknown dataset: {key}")
     ds = idx[key]
+    if ds.virtual is not None:
+        return _bgr_to_pil(virtual_frame(key, relpath))
     img_path = ds.root / relpath
     if not img_path.exists():
         raise FileNotFoundError(f"Image path not found: {relpath}")
-    with Image.open(img_path) as im:
+    with open_pil(img_path) as src, admit(src, []) as im:
         if im.mode not in ("RGB", "RGBA", "L"):
             im = im.convert("RGB")
-        return im.copy()
+        return im
+
+# ----------------------------
+# Virtual datasets
+# ----------------------------
+
+def _load_virtual_stub(ds_dir: Path) -> Optional[DatasetIndex]:
+    """Index entry for a virtual.json folder; rows are filled in by _resolve_virtuals."""
+    try:
+        desc = _read_json(ds_dir / VIRTUAL_FILE)
+        spec = VirtualSpec(
+            base=str(desc["base_dataset"]),
+            ops=list(desc.get("preprocessing") or []),
+            paths=[str(p) for p in desc.get("paths") or []],
+        )
+    except Exception:
+        return None
+    desc["key"] = desc.get("key", ds_dir.name)
+    desc["name"] = desc.get("name", ds_dir.name)
+    return DatasetIndex(
+        key=desc["key"], root=ds_dir, images_dir=ds_dir / "images",
+        classes=[], rows=[], approx_count={}, meta=desc, virtual=spec,
+    )
+
+def _resolve_virtuals(datasets: Dict[str, DatasetIndex]) -> None:
+    """
+    Point every virtual dataset at the real dataset its pixels come from
+    (virtual-on-virtual chains concatenate their ops), take its rows from
+    that dataset and compile the ops once. Unresolvable entries are dropped.
+    """
+    from app.services.image_ops import compile_pipeline
+
+    for key in [k for k, d in datasets.items() if d.virtual is not None]:
+        ds = datasets[key]
+        spec = ds.virtual
+        base, ops, seen = spec.base, list(spec.ops), {key}
+        while base in datasets and datasets[base].virtual is not None and base not in seen:
+            seen.add(base)
+            parent = datasets[base].virtual
+            base, ops = parent.base, list(parent.ops) + ops
+        root = datasets.get(base)
+        if root is None or root.virtual is not None:
+            del datasets[key]
+            continue
+        try:
+            steps = compile_pipeline(ops)
+        except ValueError:
+            del datasets[key]
+            continue
+        wanted = set(spec.paths)
+        rows = [r for r in root.rows if r["path"] in wanted]
+        counts: Dict[str, int] = {}
+        for r in rows:
+            counts[r["class"]] = counts.get(r["class"], 0) + 1
+        ds.virtual = VirtualSpec(
+            base=base, ops=ops, paths=[r["path"] for r in rows], steps=steps,
+            signature=json.dumps(ops, sort_keys=True),
+        )
+        ds.rows = rows
+        ds.classes = [c for c in root.classes if c in counts] or sorted(counts)
+        ds.approx_count = counts
+
+def virtual_spec(key: str) -> Optional[VirtualSpec]:
+    """Resolved spec if `key` is a virtual dataset (cheap check before the index)."""
+    if not (DATASETS_DIR / key / VIRTUAL_FILE).exists():
+        return None
+    ds = get_datasets_index().get(key)
+    return ds.virtual if ds is not None else None
+
+# dataset_image_key() -> read-only BGR frame, least recently used first
+_VIRTUAL_FRAMES: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_VIRTUAL_BYTES = 0
+_VIRTUAL_LOCK = threading.Lock()
+
+def virtual_frame(key: str, rel: str, share: bool = True) -> np.ndarray:
+    """
+    One image of a virtual dataset: decoded from the base dataset with the
+    ops applied, cached in memory (VIRTUAL_CACHE_MB, LRU). `share` False
+    (bulk passes) keeps it out of the cross-worker tier.
+    """
+    global _VIRTUAL_BYTES
+    from app.services.image_ops import dataset_image_key, open_dataset_image, run_pipeline
+
+    spec = virtual_spec(key)
+    if spec is None:
+        raise KeyError(f"Unknown dataset: {key}")
+    if rel not in spec.paths:
+        raise FileNotFoundError(f"Image path not found: {rel}")
+    # base file identity + ops: an edited base image is a new entry
+    ck = dataset_image_key(key, rel)
+    with _VIRTUAL_LOCK:
+        frame = _VIRTUAL_FRAMES.get(ck)
+        if frame is not None:
+            _VIRTUAL_FRAMES.move_to_end(ck)
+    if frame is not None:
+        metrics.count("visionblocks_cache_requests_total", cache="virtual", result="hit")
+        return frame
+    metrics.count("visionblocks_cache_requests_total", cache="virtual", result="miss")
+
+    # second tier: computed by another worker
+    frame = shared_cache.get_frame(ck)
+    if frame is None:
+        with open_dataset_image(spec.base, rel, spec.steps, share=share) as (img, _):
+            frame = run_pipeline(img, spec.steps)
+        if frame.flags.writeable:
+            frame.flags.writeable = False
+        if share:
+            shared_cache.put_frame(ck, frame)
+
+    limit = settings.VIRTUAL_CACHE_MB * 2**20
+    with _VIRTUAL_LOCK:
+        if ck not in _VIRTUAL_FRAMES and frame.nbytes <= limit:
+            _VIRTUAL_FRAMES[ck] = frame
+            _VIRTUAL_BYTES += frame.nbytes
+            while _VIRTUAL_BYTES > limit:
+                _, old = _VIRTUAL_FRAMES.popitem(last=False)
+                _VIRTUAL_BYTES -= old.nbytes
+    return frame
+
+def _bgr_to_pil(frame: np.ndarray) -> Image.Image:
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+def pixel_source(key: str) -> Tuple[str, Path]:
+    """(dataset key, root) whose files hold this dataset's source pixels."""
+    spec = virtual_spec(key)
+    name = spec.base if spec is not None else key
+    return name, (DATASETS_DIR / name).resolve()
+
+def create_virtual_dataset(
+    name: str,
+    base_dataset: str,
+    rel_paths: List[str],
+    ops: List[Dict],
+    overwrite: bool = False,
+    subset: Optional[Dict] = None,
+) -> str:
+    """
+    Write a virtual.json descriptor (no pixels are produced). `ops` run on
+    top of `base_dataset`, which may itself be virtual. Returns the new key.
+    """
+    from app.services.image_ops import compile_pipeline, sanitize_name
+    import shutil
+
+    compile_pipeline(ops)  # reject bad ops now, not at first use
+    key = sanitize_name(name)
+    if key == base_dataset:
+        raise ValueError("A virtual dataset cannot use itself as base.")
+    out_root = DATASETS_DIR / key
+    if out_root.exists():
+        if not overwrite:
+            raise FileExistsError(f"Dataset '{key}' already exists.")
+        shutil.rmtree(out_root)
+    out_root.mkdir(parents=True)
+    desc = {
+        "name": key,
+        "virtual": True,
+        "base_dataset": base_dataset,
+        "subset": subset,
+        "preprocessing": ops,
+        "paths": list(rel_paths),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "version": "1.0.0",
+    }
+    with open(out_root / VIRTUAL_FILE, "w", encoding="utf-8") as f:
+        json.dump(desc, f, indent=2)
+    return key
 
 def to_grayscale_preview_image(im: Image.Image) -> Image.Image:
     if im.mode == "L":
@@ -304,18 +647,99 @@ def to_grayscale_preview_image(im: Image.Image) -> Image.Image:
     return im.convert("L")
 
 def split_channels_tinted(im: Image.Image) -> tuple[Image.Image, Image.Image, Image.Image]:
-    if im.mode not in ("RGB", "RGBA", "L"):
-        im = im.convert("RGB")
     if im.mode == "L":
         # replicate grayscale to RGB (all same)
         g = im.convert("RGB")
         return g.copy(), g.copy(), g.copy()
+    r, g, b = _tinted_channels(_rgb_array(im))
+    return Image.fromarray(r), Image.fromarray(g), Image.fromarray(b)
+
+# ----------------------------
+# Multi-view rendering
+# ----------------------------
+
+VIEW_NAMES = ("original", "grayscale", "r", "g", "b", "histogram", "edges")
 
-    r, g, b = im.split()[:3]
+def _rgb_array(im: Image.Image) -> np.ndarray:
+    """PIL (any mode) -> HxWx3 uint8 RGB array (grayscale replicated)."""
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    return np.asarray(im)
+
+def _tinted_channels(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keep one channel, zero the others; one allocation + one strided copy each."""
+    out = []
+    for c in range(3):
+        t = np.zeros_like(rgb)
+        t[..., c] = rgb[..., c]
+        out.append(t)
+    return out[0], out[1], out[2]
+
+def _histogram(rgb: np.ndarray) -> Dict[str, List[int]]:
+    """Per-channel 256-bin histograms in a single bincount pass."""
+    # offset channel c into bins [256*c, 256*c + 255]
+    flat = rgb.reshape(-1, 3).astype(np.uint16) + np.array([0, 256, 512], dtype=np.uint16)
+    counts = np.bincount(flat.ravel(), minlength=768).reshape(3, 256)
+    return {"r": counts[0].tolist(), "g": counts[1].tolist(), "b": counts[2].tolist()}
+
+def render_views(
+    im: Image.Image,
+    views: List[str],
+    edges_method: str = "canny",
+    edges_threshold: int = 100,
+    as_json: bool = False,
+) -> Tuple[Dict[str, Any], Optional[Dict[str, List[int]]]]:
+    """
+    Compute several derived views of one image from a single decoded buffer.
+    The image is downscaled to preview size once; every view is derived
+    from that array. Returns (view name -> data URL, histogram or None);
+    with as_json the URLs are RawJSON for TimedJSONResponse.
+    """
+    unknown = [v for v in views if v not in VIEW_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown view(s): {', '.join(unknown)}")
+
+    base = _downscale_for_preview(im if im.mode == "RGB" else im.convert("RGB"), settings.PREVIEW_MAX_SIDE)
+    rgb = _rgb_array(base)
+
+    urls: Dict[str, Any] = {}
+    hist: Optional[Dict[str, List[int]]] = None
+    wanted = set(views)
+
+    if "original" in wanted:
+        urls["original"] = _encode_preview_png(base, settings.PREVIEW_MAX_SIDE, as_json)
+    if "grayscale" in wanted:
+        urls["grayscale"] = _encode_preview_png(base.convert("L"), settings.PREVIEW_MAX_SIDE, as_json)
+    if wanted & {"r", "g", "b"}:
+        # grayscale sources keep the split_channels convention: all three equal
+        tinted = (rgb, rgb, rgb) if im.mode == "L" else _tinted_channels(rgb)
+        for name, arr in zip(("r", "g", "b"), tinted):
+            if name in wanted:
+                urls[name] = _encode_preview_png(Image.fromarray(arr), settings.PREVIEW_MAX_SIDE, as_json)
+    if "edges" in wanted:
+        from app.services.image_ops import op_edges
+        bgr = np.ascontiguousarray(rgb[..., ::-1])
+        edges = op_edges(bgr, method=edges_method, threshold=int(edges_threshold), overlay=False)
+        urls["edges"] = _encode_preview_png(Image.fromarray(edges[..., 0]), settings.PREVIEW_MAX_SIDE, as_json)
+    if "histogram" in wanted:
+        hist = _histogram(rgb)
+
+    return urls, hist
+
+def dataset_duplicates(key: str, max_distance: int = 6, algo: str = "phash") -> Dict:
+    """Near-duplicate groups among a dataset's indexed rows (see services/phash.py)."""
+    from app.services.phash import find_duplicates
 
-    # make tinted images (keep one channel, zero others)
-    zero = Image.new("L", im.size, 0)
-    r_img = Image.merge("RGB", (r, zero, zero))
-    g_img = Image.merge("RGB", (zero, g, zero))
-    b_img = Image.merge("RGB", (zero, zero, b))
-    return r_img, g_img, b_img
+    idx = get_datasets_index()
+    if key not in idx:
+        idx = get_datasets_index(force_refresh=True)
+        if key not in idx:
+            raise KeyError(f"Unknown dataset: {key}")
+    ds = idx[key]
+    class_of = {r["path"]: r["class"] for r in ds.rows}
+    # virtual datasets hash their base files (ops do not create duplicates)
+    src_key, src_root = (ds.virtual.base, idx[ds.virtual.base].root) if ds.virtual else (key, ds.root)
+    found = find_duplicates(src_key, src_root, [r["path"] for r in ds.rows], max_distance, algo)
+    for g in found["groups"]:
+        g["classes"] = [class_of.get(p, "") for p in g["paths"]]
+    return {"dataset_key": key, "algo": algo, "max_distance": max_distance, **found}
@@ -0,0 +1,227 @@
+"""
+Deep-zoom tile pyramids of dataset images, original or processed by an
+op plan, so clients fetch only the visible region at the zoom they need.
+
+Levels follow the Deep Zoom (DZI) convention: level `max_level` is full
+resolution, each level below halves both sides, level 0 is 1x1. Tiles are
+`TILE_SIZE` squares (edge tiles smaller), no overlap.
+
+Tiles are built lazily, one whole level at a time: the first request for
+a level runs the pipeline on the full-resolution frame, downsamples with
+INTER_AREA, and writes every tile of the level under CACHE_DIR/tiles/<signature>/. The signature covers the
+source file identity, the ops and the encoding, so an edited file or a
+different plan never sees stale tiles. Virtual datasets are tiled from
+their base files with their own ops in front. The tiles folder is kept
+under DEEPZOOM_CACHE_MB by removing the least recently opened pyramids
+after each level build.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import math
+import os
+import threading
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.lazy import lazy_import
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+# striped: a fixed set of locks however many pyramids are built
+_LOCKS = [threading.Lock() for _ in range(64)]
+_prune_guard = threading.Lock()
+
+def _pyramid_lock(sig: str) -> threading.Lock:
+    return _LOCKS[int(sig[:8], 16) % len(_LOCKS)]
+
+def _tiles_dir(sig: str) -> Path:
+    return settings.CACHE_DIR / "tiles" / sig
+
+# ------------------------
+# Level geometry
+# ------------------------
+
+def max_level(width: int, height: int) -> int:
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+def level_size(width: int, height: int, level: int) -> Tuple[int, int]:
+    """(w, h) of `level`; sides are rounded up like DZI."""
+    scale = 2.0 ** (level - max_level(width, height))
+    return max(1, int(math.ceil(width * scale))), max(1, int(math.ceil(height * scale)))
+
+def level_grid(width: int, height: int, level: int, tile: int) -> Tuple[int, int]:
+    """(columns, rows) of tiles at `level`."""
+    lw, lh = level_size(width, height, level)
+    return -(-lw // tile), -(-lh // tile)
+
+# ------------------------
+# Pyramid identity + source frame
+# ------------------------
+
+def _resolve(dataset_key: str, rel_path: str, ops: List[Dict[str, Any]], fmt: str) -> Tuple[str, str]:
+    """(signature, encode format) for one pyramid; stats the file, no decode."""
+    from app.services.datasets import pixel_source
+    from app.services.encoding import normalize_format, preview_format
+    from app.services.image_ops import dataset_image_key, resolve_dataset_image
+
+    # dataset_image_key covers a virtual dataset's ops; the format is the base file's
+    _, src_fmt = resolve_dataset_image(pixel_source(dataset_key)[0], rel_path)
+    out_fmt = preview_format(src_fmt) if fmt == "auto" else normalize_format(fmt)
+    ident = json.dumps(
+        [dataset_image_key(dataset_key, rel_path), ops, out_fmt, settings.DEEPZOOM_TILE_SIZE, settings.ENCODER_BACKEND],
+        sort_keys=True,
+    )
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest(), out_fmt
+
+@contextmanager
+def _frame(dataset_key: str, rel_path: str, ops: List[Dict[str, Any]]) -> Iterator[np.ndarray]:
+    """
+    Full-resolution processed frame, under the memory governor until exit.
+    Not memoized: once a level is built its tiles are on disk.
+    """
+    from app.services.image_ops import compile_pipeline, open_dataset_image, run_pipeline
+
+    steps = compile_pipeline(ops)
+    with open_dataset_image(dataset_key, rel_path, steps) as (img, _):
+        yield run_pipeline(img, steps)
+
+def _load_info(sig: str) -> Optional[Dict[str, Any]]:
+    try:
+        with (_tiles_dir(sig) / "info.json").open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _touch(sig: str) -> None:
+    try:
+        os.utime(_tiles_dir(sig))
+    except OSError:
+        pass
+
+def _prune(keep: str) -> None:
+    """Remove least recently opened pyramids until the tiles folder fits DEEPZOOM_CACHE_MB."""
+    import shutil
+
+    limit = settings.DEEPZOOM_CACHE_MB * 2**20
+    root = settings.CACHE_DIR / "tiles"
+    if not limit or not _prune_guard.acquire(blocking=False):
+        return  # unbounded, or another thread is already pruning
+    try:
+        dirs = []
+        for d in root.iterdir() if root.is_dir() else ():
+            try:
+                size = sum(f.stat().st_size for f in d.rglob("*") if f.is_file())
+                dirs.append((d.stat().st_mtime, size, d))
+            except OSError:
+                continue  # removed meanwhile
+        total = sum(size for _, size, _ in dirs)
+        for _, size, d in sorted(dirs, key=lambda t: t[0]):
+            if total <= limit:
+                break
+            if d.name != keep:
+                shutil.rmtree(d, ignore_errors=True)
+                total -= size
+    finally:
+        _prune_guard.release()
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+# ------------------------
+# Public API
+# ------------------------
+
+def pyramid_info(dataset_key: str, rel_path: str, ops: List[Dict[str, Any]], fmt: str = "auto") -> Dict[str, Any]:
+    """Size, tile size, level count and per-level grids of one pyramid."""
+    sig, out_fmt = _resolve(dataset_key, rel_path, ops, fmt)
+    info = _load_info(sig)
+    if info is not None:
+        _touch(sig)
+        return info
+    with _pyramid_lock(sig):
+        info = _load_info(sig)
+        if info is not None:
+            return info
+        with _frame(dataset_key, rel_path, ops) as frame:
+            h, w = frame.shape[:2]
+        tile = settings.DEEPZOOM_TILE_SIZE
+        info = {
+            "signature": sig,
+            "width": w,
+            "height": h,
+            "tile_size": tile,
+            "format": out_fmt.lower(),
+            "max_level": max_level(w, h),
+            "levels": [
+                {"level": lv, "size": list(level_size(w, h, lv)), "grid": list(level_grid(w, h, lv, tile))}
+                for lv in range(max_level(w, h) + 1)
+            ],
+        }
+        _write_atomic(_tiles_dir(sig) / "info.json", json.dumps(info).encode("utf-8"))
+        return info
+
+def _build_level(sig: str, info: Dict[str, Any], frame: np.ndarray, level: int, out_fmt: str) -> None:
+    from app.services.encoding import FORMATS, encode
+
+    w, h, tile = info["width"], info["height"], info["tile_size"]
+    lw, lh = level_size(w, h, level)
+    with metrics.stage("resize"):
+        img = frame if (lw, lh) == (w, h) else cv2.resize(frame, (lw, lh), interpolation=cv2.INTER_AREA)
+    ext = FORMATS[out_fmt][1]
+    cols, rows = level_grid(w, h, level, tile)
+    for ty in range(rows):
+        for tx in range(cols):
+            part = img[ty * tile:(ty + 1) * tile, tx * tile:(tx + 1) * tile]
+            data, _ = encode(part, out_fmt, preset="preview")
+            _write_atomic(_tiles_dir(sig) / str(level) / f"{tx}_{ty}{ext}", data)
+
+def _etag(sig: str, level: int, x: int, y: int) -> str:
+    return f'"{sig[:16]}-{level}-{x}-{y}"'
+
+def tile_etag(
+    dataset_key: str, rel_path: str, ops: List[Dict[str, Any]], level: int, x: int, y: int, fmt: str = "auto"
+) -> str:
+    """ETag get_tile() would send; stats the file only, for If-None-Match."""
+    sig, _ = _resolve(dataset_key, rel_path, ops, fmt)
+    return _etag(sig, level, x, y)
+
+def get_tile(
+    dataset_key: str, rel_path: str, ops: List[Dict[str, Any]], level: int, x: int, y: int, fmt: str = "auto"
+) -> Tuple[bytes, str, str]:
+    """
+    Encoded tile (x, y) of `level`: (bytes, mime, etag). Raises
+    FileNotFoundError for tiles outside the pyramid.
+    """
+    from app.services.encoding import FORMATS
+
+    sig, out_fmt = _resolve(dataset_key, rel_path, ops, fmt)
+    ext, mime = FORMATS[out_fmt][1], FORMATS[out_fmt][0]
+    etag = _etag(sig, level, x, y)
+    path = _tiles_dir(sig) / str(level) / f"{x}_{y}{ext}"
+    try:
+        with metrics.stage("read"):
+            return path.read_bytes(), mime, etag
+    except FileNotFoundError:
+        pass
+
+    info = pyramid_info(dataset_key, rel_path, ops, fmt)
+    if not 0 <= level <= info["max_level"]:
+        raise FileNotFoundError(f"Level {level} outside 0..{info['max_level']}")
+    cols, rows = info["levels"][level]["grid"]
+    if not (0 <= x < cols and 0 <= y < rows):
+        raise FileNotFoundError(f"Tile ({x}, {y}) outside the {cols}x{rows} grid of level {level}")
+    with _pyramid_lock(sig):
+        if not path.exists():
+            with _frame(dataset_key, rel_path, ops) as frame:
+                _build_level(sig, info, frame, level, out_fmt)
+    data = path.read_bytes()
+    _prune(keep=sig)
+    return data, mime, etag
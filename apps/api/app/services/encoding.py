@@ -0,0 +1,210 @@
+"""
+Image encoder layer: one entry point for previews, data URLs and exports.
+
+Each format can be written by OpenCV (`cv2.imencode`, releases the GIL) or
+Pillow. Presets bundle the effort/quality knobs: "preview" favours speed
+(PNG level 1), the export presets favour size or exactness. Encoder
+parameters are built once per (preset, format, backend) and shared; both
+backends are safe to call from many threads.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Union
+import base64
+import binascii
+import io
+
+from PIL import Image, features
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.core.responses import RawJSON
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+# format -> (mime, file extension)
+FORMATS: Dict[str, Tuple[str, str]] = {
+    "PNG": ("image/png", ".png"),
+    "JPEG": ("image/jpeg", ".jpg"),
+    "WEBP": ("image/webp", ".webp"),
+}
+
+BACKENDS = ("auto", "cv2", "pil")
+
+@dataclass(frozen=True)
+class EncodePreset:
+    name: str
+    png_level: int          # 0 (none) .. 9 (smallest, slowest)
+    jpeg_quality: int       # 1 .. 100
+    webp_quality: int       # 1 .. 100 (ignored when lossless)
+    webp_lossless: bool = False
+
+PRESETS: Dict[str, EncodePreset] = {
+    # interactive previews: fastest encode, sizes still fine for a browser
+    "preview": EncodePreset("preview", png_level=1, jpeg_quality=85, webp_quality=80),
+    # exports: the long-standing defaults (PIL PNG level 6, JPEG q90)
+    "export": EncodePreset("export", png_level=6, jpeg_quality=90, webp_quality=90),
+    # exports: smallest files
+    "export_small": EncodePreset("export_small", png_level=9, jpeg_quality=82, webp_quality=75),
+    # exports: bit-exact pixels (JPEG stays lossy; use PNG/WEBP)
+    "export_lossless": EncodePreset("export_lossless", png_level=9, jpeg_quality=100, webp_quality=100, webp_lossless=True),
+}
+
+ImageLike = Union[Image.Image, "np.ndarray"]
+
+def normalize_format(fmt: Optional[str]) -> str:
+    f = (fmt or "PNG").upper()
+    if f == "JPG":
+        f = "JPEG"
+    if f not in FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    return f
+
+def get_preset(name: str) -> EncodePreset:
+    try:
+        return PRESETS[name]
+    except KeyError:
+        raise ValueError(f"Unknown encode preset: {name}") from None
+
+# ------------------------
+# Backends
+# ------------------------
+
+@lru_cache(maxsize=None)
+def _cv2_params(preset: EncodePreset, fmt: str) -> Tuple[str, Tuple[int, ...]]:
+    if fmt == "PNG":
+        return ".png", (cv2.IMWRITE_PNG_COMPRESSION, preset.png_level)
+    if fmt == "JPEG":
+        return ".jpg", (cv2.IMWRITE_JPEG_QUALITY, preset.jpeg_quality)
+    # OpenCV encodes lossless WebP for quality > 100
+    return ".webp", (cv2.IMWRITE_WEBP_QUALITY, 101 if preset.webp_lossless else preset.webp_quality)
+
+@lru_cache(maxsize=None)
+def _pil_params(preset: EncodePreset, fmt: str) -> Tuple[Tuple[str, Any], ...]:
+    if fmt == "PNG":
+        return (("compress_level", preset.png_level),)
+    if fmt == "JPEG":
+        return (("quality", preset.jpeg_quality),)
+    if preset.webp_lossless:
+        return (("lossless", True), ("quality", 100), ("method", 4))
+    return (("quality", preset.webp_quality), ("method", 4))
+
+@lru_cache(maxsize=None)
+def _cv2_can_write(fmt: str) -> bool:
+    try:
+        return bool(cv2.haveImageWriter(FORMATS[fmt][1]))
+    except Exception:
+        return False
+
+def _pil_can_write(fmt: str) -> bool:
+    return fmt != "WEBP" or features.check("webp")
+
+def _to_cv(img: ImageLike) -> "np.ndarray":
+    """PIL/RGB -> array in OpenCV channel order; arrays are assumed BGR already."""
+    if not isinstance(img, Image.Image):
+        return img
+    if img.mode == "L":
+        return np.asarray(img)
+    if img.mode == "RGBA":
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGBA2BGRA)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+
+def _to_pil(img: ImageLike) -> Image.Image:
+    if isinstance(img, Image.Image):
+        return img
+    if img.ndim == 2:
+        return Image.fromarray(img)
+    code = cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else cv2.COLOR_BGR2RGB
+    return Image.fromarray(cv2.cvtColor(img, code))
+
+def _encode_cv2(img: ImageLike, fmt: str, preset: EncodePreset) -> bytes:
+    arr = _to_cv(img)
+    if fmt == "JPEG" and arr.ndim == 3 and arr.shape[2] == 4:
+        arr = arr[..., :3]
+    ext, params = _cv2_params(preset, fmt)
+    ok, buf = cv2.imencode(ext, arr, list(params))
+    if not ok:
+        raise ValueError(f"OpenCV failed to encode {fmt}")
+    return buf.tobytes()
+
+def _encode_pil(img: ImageLike, fmt: str, preset: EncodePreset) -> bytes:
+    pil = _to_pil(img)
+    if fmt == "JPEG" and pil.mode not in ("RGB", "L"):
+        pil = pil.convert("RGB")
+    buf = io.BytesIO()
+    pil.save(buf, format=fmt, **dict(_pil_params(preset, fmt)))
+    return buf.getvalue()
+
+def _pick_backend(img: ImageLike, fmt: str, backend: str) -> str:
+    if backend == "auto":
+        backend = settings.ENCODER_BACKEND
+    if backend == "auto":
+        # arrays: cv2. PIL images: cv2 wins PNG/WEBP despite the RGB->BGR
+        # copy, PIL's libjpeg path wins JPEG; palette/odd modes stay on PIL
+        if not isinstance(img, Image.Image):
+            backend = "cv2"
+        elif img.mode not in ("RGB", "RGBA", "L") or fmt == "JPEG":
+            backend = "pil"
+        else:
+            backend = "cv2"
+    if backend == "cv2" and not _cv2_can_write(fmt):
+        backend = "pil"
+    elif backend == "pil" and not _pil_can_write(fmt):
+        backend = "cv2"
+    return backend
+
+# ------------------------
+# Public API
+# ------------------------
+
+def encode(
+    img: ImageLike,
+    fmt: str = "PNG",
+    preset: Union[str, EncodePreset] = "preview",
+    backend: str = "auto",
+) -> Tuple[bytes, str]:
+    """
+    Encode a PIL image or a BGR(A)/gray uint8 array. Returns (bytes, mime).
+    """
+    fmt = normalize_format(fmt)
+    p = preset if isinstance(preset, EncodePreset) else get_preset(preset)
+    chosen = _pick_backend(img, fmt, backend)
+    with metrics.stage("encode"):
+        data = _encode_cv2(img, fmt, p) if chosen == "cv2" else _encode_pil(img, fmt, p)
+    return data, FORMATS[fmt][0]
+
+def to_data_url(
+    img: ImageLike,
+    fmt: str = "PNG",
+    preset: Union[str, EncodePreset] = "preview",
+    backend: str = "auto",
+) -> str:
+    data, mime = encode(img, fmt, preset, backend)
+    with metrics.stage("base64"):
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+def data_url_json(
+    img: ImageLike,
+    fmt: str = "PNG",
+    preset: Union[str, EncodePreset] = "preview",
+    backend: str = "auto",
+) -> RawJSON:
+    """
+    to_data_url as a ready-made JSON string for TimedJSONResponse: the
+    base64 bytes go into the response body without a str round trip.
+    """
+    data, mime = encode(img, fmt, preset, backend)
+    with metrics.stage("base64"):
+        b64 = binascii.b2a_base64(data, newline=False)
+    return RawJSON(b'"data:', mime.encode("ascii"), b";base64,", b64, b'"')
+
+def preview_format(fmt_hint: Optional[str]) -> str:
+    """Format for previews: PREVIEW_FORMAT, or the source format when 'auto'."""
+    if settings.PREVIEW_FORMAT.lower() != "auto":
+        return normalize_format(settings.PREVIEW_FORMAT)
+    return normalize_format(fmt_hint if fmt_hint in ("JPEG", "PNG", "WEBP") else "PNG")
@@ -1,17 +1,30 @@
 from __future__ import annotations
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple, Any
+from typing import Callable, Dict, Iterator, List, Tuple, Any
 import io
 import json
+import os
+import threading
 
-import numpy as np
-import cv2
 from PIL import Image
 
+from app.core import metrics
+from app.core.config import settings
+from app.core.lazy import lazy_import
+
+# OpenCV/NumPy are only needed once an op actually runs; keep them off the
+# import path so the API starts (and forks workers) quickly.
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
 # Root containing datasets/<dataset_key>/
 DATASETS_DIR = (Path(__file__).resolve().parents[1] / "data" / "datasets").resolve()
 
-IMG_EXTS = {".jpg", ".jpeg", ".png"}
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
 
 # ------------------------
 # Utilities
@@ -35,22 +48,17 @@ def _ensure_rgb_pil(img: Image.Image) -> Image.Image:
 def pil_to_data_url(img: Image.Image, fmt_hint: str | None = None) -> str:
     """
     Convert PIL image to data URL. Keep JPEG/PNG per hint.
+    Encoded with the fast "preview" preset (see services/encoding.py).
     """
+    from app.services.encoding import preview_format, to_data_url
+
     fmt = fmt_hint or (img.format if img.format in ("JPEG", "PNG") else "PNG")
-    buf = io.BytesIO()
-    if fmt == "JPEG":
-        img.save(buf, format="JPEG", quality=90)
-        mime = "image/jpeg"
-    else:
-        img.save(buf, format="PNG")
-        mime = "image/png"
-    import base64
-    return f"data:{mime};base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+    return to_data_url(img, preview_format(fmt), preset="preview")
 
-def load_dataset_image(dataset_key: str, rel_path: str) -> Tuple[Image.Image, Path, str]:
+def resolve_dataset_image(dataset_key: str, rel_path: str) -> Tuple[Path, str]:
     """
-    Load image by dataset key + relative path (e.g., 'images/class/file.jpg').
-    Returns (PIL image, absolute path, 'JPEG'|'PNG' by extension).
+    Absolute path of a dataset image (e.g. 'images/class/file.jpg') and its
+    'JPEG'|'PNG'|'WEBP' format by extension.
     """
     ds_root = (DATASETS_DIR / dataset_key).resolve()
     abs_path = (ds_root / rel_path).resolve()
@@ -58,15 +66,72 @@ def load_dataset_image(dataset_key: str, rel_path: str) -> Tuple[Image.Image, Pa
         raise ValueError("Invalid path.")
     if not abs_path.exists():
         raise FileNotFoundError(f"Image not found: {rel_path}")
-    img = Image.open(abs_path)
     ext = abs_path.suffix.lower()
-    fmt = "JPEG" if ext in (".jpg", ".jpeg") else "PNG"
-    return img, abs_path, fmt
+    fmt = "JPEG" if ext in (".jpg", ".jpeg") else "WEBP" if ext == ".webp" else "PNG"
+    return abs_path, fmt
+
+def dataset_image_key(dataset_key: str, rel_path: str) -> str:
+    """Cache identity of a dataset image's pixels: the file's (+ virtual ops)."""
+    from app.services import shared_cache
+    from app.services.datasets import virtual_spec
+
+    spec = virtual_spec(dataset_key)
+    if spec is not None:
+        abs_path, _ = resolve_dataset_image(spec.base, rel_path)
+        return f"{shared_cache.file_key(abs_path)}:{spec.signature}"
+    abs_path, _ = resolve_dataset_image(dataset_key, rel_path)
+    return shared_cache.file_key(abs_path)
+
+@contextmanager
+def open_dataset_image(
+    dataset_key: str, rel_path: str, steps: List["CompiledOp"] = (), data: bytes | None = None,
+    timeout: float | None = None, share: bool = False,
+) -> Iterator[Tuple[np.ndarray, str]]:
+    """
+    Decode a dataset image through the memory governor (mmap loader, no
+    open handles afterwards). Yields (read-only BGR array, format); the
+    budget reservation for `steps` is held until exit. Virtual datasets
+    yield their computed (cached) frame. `data`: the file's bytes from
+    read_dataset_file(), if already read ahead. `timeout`: the budget wait
+    (governor.acquire; 0 tries once). `share`: publish the decoded frame to
+    the cross-worker tier (interactive requests only, see admit_file).
+    """
+    from app.services.datasets import virtual_frame, virtual_spec
+    from app.services.memory import admit_file, estimate_bytes, governor
+
+    spec = virtual_spec(dataset_key)
+    if spec is not None:
+        # virtual dataset: the (cached) base image with its ops applied
+        _, fmt = resolve_dataset_image(spec.base, rel_path)
+        frame = virtual_frame(dataset_key, rel_path, share)
+        with governor.reserve(estimate_bytes((frame.shape[1], frame.shape[0]), list(steps), 3), timeout):
+            yield frame, fmt
+        return
+
+    abs_path, fmt = resolve_dataset_image(dataset_key, rel_path)
+    with admit_file(abs_path, list(steps), data, timeout, share) as arr:
+        yield arr, fmt
+
+def read_dataset_file(dataset_key: str, rel_path: str) -> bytes | None:
+    """
+    Raw bytes of a dataset image, for read-ahead stages (services/staged_io.py).
+    None for virtual datasets, whose frames are computed, not read.
+    """
+    from app.services.datasets import virtual_spec
+
+    if virtual_spec(dataset_key) is not None:
+        return None
+    abs_path, _ = resolve_dataset_image(dataset_key, rel_path)
+    return abs_path.read_bytes()
 
 def list_all_images(dataset_key: str) -> List[Path]:
     base = (DATASETS_DIR / dataset_key / "images").resolve()
     if not base.exists():
-        return []
+        # virtual datasets list their (base dataset) paths under their own key
+        from app.services.datasets import virtual_spec
+        spec = virtual_spec(dataset_key)
+        root = (DATASETS_DIR / dataset_key).resolve()
+        return [root / rel for rel in spec.paths] if spec is not None else []
     return [p for p in base.rglob("*") if p.is_file() and p.suffix.lower() in IMG_EXTS]
 
 # ------------------------
@@ -74,7 +139,13 @@ def list_all_images(dataset_key: str) -> List[Path]:
 # ------------------------
 
 def op_reset(cv_img: np.ndarray, cv_orig: np.ndarray, **_) -> np.ndarray:
-    return cv_orig.copy()
+    # ops never write into their input, so the original can be shared
+    return cv_orig
+
+def _keep_flag(keep: bool | str | None) -> bool:
+    if isinstance(keep, str):
+        return keep.upper() == "TRUE"
+    return bool(keep) if isinstance(keep, bool) else False
 
 def op_resize(
     cv_img: np.ndarray,
@@ -85,11 +156,7 @@ def op_resize(
     maxside: int | None = None,
     pct: int | None = None,
 ) -> np.ndarray:
-    keep_bool = False
-    if isinstance(keep, str):
-        keep_bool = keep.upper() == "TRUE"
-    elif isinstance(keep, bool):
-        keep_bool = keep
+    keep_bool = _keep_flag(keep)
 
     if mode == "size":
         w = int(w or 256); h = int(h or 256)
@@ -162,7 +229,7 @@ def op_brightness_contrast(cv_img: np.ndarray, b: float, c: float) -> np.ndarray
 def op_blur_sharpen(cv_img: np.ndarray, blur: float, sharp: float) -> np.ndarray:
     blur = float(blur or 0)
     sharp = float(sharp or 0)
-    out = cv_img.copy()
+    out = cv_img
     if blur > 0:
         # Cap radius, compute kernel size as odd
         k = max(1, int(round(blur * 2 + 1)))
@@ -180,42 +247,45 @@ def op_blur_sharpen(cv_img: np.ndarray, blur: float, sharp: float) -> np.ndarray
         out = np.clip(out, 0, 255).astype(np.uint8)
     return out
 
-def _edges_mask(cv_img: np.ndarray, method: str, threshold: float) -> np.ndarray:
-    gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-    if method == "canny":
-        lo = max(0, int(threshold))
-        hi = min(255, int(threshold) + 60)
-        edges = cv2.Canny(gray, lo, hi)
-        return (edges > 0).astype(np.uint8)
-    elif method == "sobel":
+def _edge_magnitude(gray: np.ndarray, method: str) -> np.ndarray:
+    """Unnormalized float32 gradient magnitude for sobel/laplacian/prewitt."""
+    if method == "sobel":
         gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
         gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
-        mag = cv2.magnitude(gx, gy)
-        mag = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        return (mag >= int(threshold)).astype(np.uint8)
+        return cv2.magnitude(gx, gy)
     elif method == "laplacian":
         lap = cv2.Laplacian(gray, cv2.CV_32F, ksize=3)
-        mag = np.abs(lap)
-        mag = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        return (mag >= int(threshold)).astype(np.uint8)
-    elif method == "prewitt":
+        return np.abs(lap)
+    else:  # prewitt
         kx = np.array([[ -1, 0, 1],
                        [ -1, 0, 1],
                        [ -1, 0, 1]], dtype=np.float32)
         ky = np.array([[  1,  1,  1],
                        [  0,  0,  0],
                        [ -1, -1, -1]], dtype=np.float32)
-        gx = cv2.filter2D(gray.astype(np.float32), -1, kx)
-        gy = cv2.filter2D(gray.astype(np.float32), -1, ky)
-        mag = cv2.magnitude(gx, gy)
+        g32 = gray.astype(np.float32)
+        gx = cv2.filter2D(g32, -1, kx)
+        gy = cv2.filter2D(g32, -1, ky)
+        return cv2.magnitude(gx, gy)
+
+GRADIENT_EDGE_METHODS = ("sobel", "laplacian", "prewitt")
+
+def _edges_mask(cv_img: np.ndarray, method: str, threshold: float) -> np.ndarray:
+    gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
+    if method == "canny":
+        lo = max(0, int(threshold))
+        hi = min(255, int(threshold) + 60)
+        edges = cv2.Canny(gray, lo, hi)
+        return (edges > 0).astype(np.uint8)
+    elif method in GRADIENT_EDGE_METHODS:
+        mag = _edge_magnitude(gray, method)
         mag = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
         return (mag >= int(threshold)).astype(np.uint8)
     else:
         edges = cv2.Canny(gray, 100, 160)
         return (edges > 0).astype(np.uint8)
 
-def op_edges(cv_img: np.ndarray, method: str, threshold: int, overlay: bool) -> np.ndarray:
-    mask = _edges_mask(cv_img, method, float(threshold))
+def _render_edges(cv_img: np.ndarray, mask: np.ndarray, overlay: bool) -> np.ndarray:
     if overlay:
         out = cv_img.copy()
         out[mask.astype(bool)] = (0, 0, 255)  # red in BGR
@@ -225,10 +295,31 @@ def op_edges(cv_img: np.ndarray, method: str, threshold: int, overlay: bool) ->
         e = (mask * 255).astype(np.uint8)
         return cv2.cvtColor(e, cv2.COLOR_GRAY2BGR)
 
+def op_edges(cv_img: np.ndarray, method: str, threshold: int, overlay: bool) -> np.ndarray:
+    mask = _edges_mask(cv_img, method, float(threshold))
+    return _render_edges(cv_img, mask, overlay)
+
 def op_to_grayscale(cv_img: np.ndarray) -> np.ndarray:
     gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
     return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
 
+def _zscore_map(arr: np.ndarray, mu, sd) -> np.ndarray:
+    """Clip z-scores to [-2, 2] and map to [0, 255] (float, rounded) for display."""
+    z = (arr - mu) / sd
+    z = np.clip(z, -2.0, 2.0)
+    return ((z + 2.0) / 4.0 * 255.0).round()
+
+def _zscore_stats(arr: np.ndarray, axes: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-channel mean/std (std 0 -> 1) reduced over the pixel `axes`, kept
+    broadcastable. The batched runner reduces a (B, H, W, C) stack over
+    (1, 2) and gets the same numbers as (0, 1) on each frame.
+    """
+    mu = arr.mean(axis=axes, keepdims=True)
+    sd = arr.std(axis=axes, keepdims=True)
+    sd[sd == 0] = 1.0
+    return mu, sd
+
 def op_normalize(cv_img: np.ndarray, mode: str) -> np.ndarray:
     arr = cv_img.astype(np.float32)
     if mode == "zero_one":
@@ -242,16 +333,8 @@ def op_normalize(cv_img: np.ndarray, mode: str) -> np.ndarray:
         return out
     elif mode == "zscore":
         # per-channel z-score, clip to [-2,2], then min-max to 0..255 for display
-        out = np.empty_like(arr)
-        for c in range(3):
-            ch = arr[..., c]
-            mu = float(ch.mean())
-            sd = float(ch.std()) or 1.0
-            z = (ch - mu) / sd
-            z = np.clip(z, -2.0, 2.0)
-            # map [-2, 2] -> [0, 255]
-            out[..., c] = ((z + 2.0) / 4.0 * 255.0).round()
-        return out.astype(np.uint8)
+        mu, sd = _zscore_stats(arr, axes=(0, 1))
+        return _zscore_map(arr, mu, sd).astype(np.uint8)
     else:
         return cv_img
 
@@ -259,48 +342,261 @@ def op_normalize(cv_img: np.ndarray, mode: str) -> np.ndarray:
 # Pipeline + Export
 # ------------------------
 
-def apply_pipeline(original_pil: Image.Image, ops: List[Dict[str, Any]]) -> Image.Image:
-    """Apply ordered ops to a single image using OpenCV, return PIL RGB result."""
-    orig_cv = _pil_to_cv_bgr(_ensure_rgb_pil(original_pil))
-    cv_img = orig_cv.copy()
+@dataclass(frozen=True)
+class CompiledOp:
+    """One op with its parameters parsed once, ready to run on many images."""
+    type: str
+    kwargs: Dict[str, Any]
+    fn: Callable[..., np.ndarray]
+
+    def __call__(self, cv_img: np.ndarray, cv_orig: np.ndarray) -> np.ndarray:
+        with metrics.op(self.type):
+            if self.type == "reset":
+                return self.fn(cv_img, cv_orig)
+            return self.fn(cv_img, **self.kwargs)
+
+_OP_TABLE: Dict[str, Tuple[Callable[..., np.ndarray], Callable[[Dict[str, Any]], Dict[str, Any]]]] = {
+    "reset": (op_reset, lambda op: {}),
+    "resize": (op_resize, lambda op: dict(
+        mode=op.get("mode","size"),
+        keep=op.get("keep","FALSE"),
+        w=op.get("w"),
+        h=op.get("h"),
+        maxside=op.get("maxside"),
+        pct=op.get("pct"),
+    )),
+    "crop_center": (op_crop_center, lambda op: dict(w=int(op.get("w",224)), h=int(op.get("h",224)))),
+    "pad": (op_pad, lambda op: dict(
+        w=int(op.get("w",256)), h=int(op.get("h",256)),
+        mode=op.get("mode","constant"),
+        r=int(op.get("r",0)), g=int(op.get("g",0)), b=int(op.get("b",0)),
+    )),
+    "brightness_contrast": (op_brightness_contrast, lambda op: dict(b=float(op.get("b",0)), c=float(op.get("c",0)))),
+    "blur_sharpen": (op_blur_sharpen, lambda op: dict(blur=float(op.get("blur",0)), sharp=float(op.get("sharp",0)))),
+    "edges": (op_edges, lambda op: dict(
+        method=str(op.get("method","canny")),
+        threshold=int(op.get("threshold",100)),
+        overlay=bool(op.get("overlay", False)),
+    )),
+    "to_grayscale": (op_to_grayscale, lambda op: {}),
+    "normalize": (op_normalize, lambda op: dict(mode=str(op.get("mode","zero_one")))),
+}
+
+def compile_pipeline(ops: List[Dict[str, Any]]) -> List[CompiledOp]:
+    """
+    Parse an ops list once. Empty and unknown op types are dropped, matching
+    what apply_pipeline has always done; bad parameter values raise ValueError.
+    """
+    steps: List[CompiledOp] = []
     for op in ops:
         t = op.get("type")
-        if t == "reset":
-            cv_img = op_reset(cv_img, orig_cv)
-        elif t == "resize":
-            cv_img = op_resize(
-                cv_img,
-                mode=op.get("mode","size"),
-                keep=op.get("keep","FALSE"),
-                w=op.get("w"),
-                h=op.get("h"),
-                maxside=op.get("maxside"),
-                pct=op.get("pct"),
-            )
-        elif t == "crop_center":
-            cv_img = op_crop_center(cv_img, w=int(op.get("w",224)), h=int(op.get("h",224)))
-        elif t == "pad":
-            cv_img = op_pad(
-                cv_img, w=int(op.get("w",256)), h=int(op.get("h",256)),
-                mode=op.get("mode","constant"),
-                r=int(op.get("r",0)), g=int(op.get("g",0)), b=int(op.get("b",0))
-            )
-        elif t == "brightness_contrast":
-            cv_img = op_brightness_contrast(cv_img, b=float(op.get("b",0)), c=float(op.get("c",0)))
-        elif t == "blur_sharpen":
-            cv_img = op_blur_sharpen(cv_img, blur=float(op.get("blur",0)), sharp=float(op.get("sharp",0)))
-        elif t == "edges":
-            cv_img = op_edges(cv_img, method=str(op.get("method","canny")), threshold=int(op.get("threshold",100)), overlay=bool(op.get("overlay", False)))
-        elif t == "to_grayscale":
-            cv_img = op_to_grayscale(cv_img)
-        elif t == "normalize":
-            cv_img = op_normalize(cv_img, mode=str(op.get("mode","zero_one")))
-        elif t in (None, ""):
-            continue
-        else:
-            # Unknown op: ignore
+        if t not in _OP_TABLE:
+            # empty or unknown op: ignore
             continue
-    return _cv_bgr_to_pil(cv_img)
+        fn, parse = _OP_TABLE[t]
+        try:
+            kwargs = parse(op)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid parameters for op '{t}': {e}") from e
+        steps.append(CompiledOp(type=t, kwargs=kwargs, fn=fn))
+    return steps
+
+def infer_shapes(steps: List[CompiledOp], shape: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """
+    (h, w) after each step, computed analytically (no pixels touched).
+    Mirrors the size arithmetic of op_resize/op_crop_center/op_pad; every
+    other op preserves size. Results are always 3-channel.
+    """
+    ih0, iw0 = int(shape[0]), int(shape[1])
+    ih, iw = ih0, iw0
+    out: List[Tuple[int, int]] = []
+    for step in steps:
+        kw = step.kwargs
+        if step.type == "reset":
+            ih, iw = ih0, iw0
+        elif step.type == "resize":
+            mode = kw.get("mode")
+            if mode == "size":
+                w = int(kw.get("w") or 256); h = int(kw.get("h") or 256)
+                if _keep_flag(kw.get("keep")):
+                    scale = min(w / iw, h / ih) if iw > 0 and ih > 0 else 1.0
+                    iw, ih = max(1, int(iw * scale)), max(1, int(ih * scale))
+                else:
+                    iw, ih = w, h
+            elif mode == "fit":
+                ms = int(kw.get("maxside") or 256)
+                scale = ms / max(iw, ih) if max(iw, ih) > 0 else 1.0
+                iw, ih = max(1, int(iw * scale)), max(1, int(ih * scale))
+            elif mode == "scale":
+                pct = int(kw.get("pct") or 100)
+                iw, ih = max(1, int(iw * pct / 100.0)), max(1, int(ih * pct / 100.0))
+        elif step.type == "crop_center":
+            w, h = kw["w"], kw["h"]
+            x0 = max(0, iw // 2 - w // 2)
+            y0 = max(0, ih // 2 - h // 2)
+            iw, ih = min(iw, x0 + w) - x0, min(ih, y0 + h) - y0
+        elif step.type == "pad":
+            if kw["mode"] in ("constant", "edge", "reflect"):
+                iw, ih = max(iw, kw["w"]), max(ih, kw["h"])
+        out.append((ih, iw))
+    return out
+
+def infer_output_shape(steps: List[CompiledOp], shape: Tuple[int, int]) -> Tuple[int, int, int]:
+    """(h, w, 3) of the pipeline result for an input of (h, w)."""
+    shapes = infer_shapes(steps, shape)
+    h, w = shapes[-1] if shapes else (int(shape[0]), int(shape[1]))
+    return h, w, 3
+
+def run_compiled(orig_cv: np.ndarray, steps: List[CompiledOp]) -> np.ndarray:
+    """
+    Run compiled steps on a BGR uint8 array; returns the BGR result. Ops
+    never write into their input, so `orig_cv` may be read-only and the
+    result may alias it (e.g. empty pipeline).
+    """
+    cv_img = orig_cv
+    for step in steps:
+        cv_img = step(cv_img, orig_cv)
+    return cv_img
+
+def run_pipeline(orig_cv: np.ndarray, steps: List[CompiledOp]) -> np.ndarray:
+    """run_compiled, switching to the tiled runner for very large frames."""
+    h, w = orig_cv.shape[:2]
+    if settings.TILED_MIN_PIXELS and w * h >= settings.TILED_MIN_PIXELS:
+        from app.services.tiling import run_tiled
+        return run_tiled(orig_cv, steps)
+    return run_compiled(orig_cv, steps)
+
+def apply_compiled(original: Image.Image | np.ndarray, steps: List[CompiledOp]) -> Image.Image:
+    """Apply compiled steps to a PIL image or BGR array, return PIL RGB result."""
+    if not isinstance(original, Image.Image):
+        out = run_pipeline(original, steps)
+        with metrics.stage("to_pil"):
+            return _cv_bgr_to_pil(out)
+    if settings.TILED_MIN_PIXELS and original.width * original.height >= settings.TILED_MIN_PIXELS:
+        # very large frames: bounded working set (see services/tiling.py)
+        from app.services.tiling import apply_tiled
+        return apply_tiled(original, steps)
+    with metrics.stage("decode"):
+        orig_cv = _pil_to_cv_bgr(_ensure_rgb_pil(original))
+    out = run_compiled(orig_cv, steps)
+    with metrics.stage("to_pil"):
+        return _cv_bgr_to_pil(out)
+
+def apply_pipeline(original: Image.Image | np.ndarray, ops: List[Dict[str, Any]]) -> Image.Image:
+    """Apply ordered ops to a single image using OpenCV, return PIL RGB result."""
+    return apply_compiled(original, compile_pipeline(ops))
+
+# ------------------------
+# Batch preview
+# ------------------------
+
+_WORKER_POOL: ThreadPoolExecutor | None = None
+_WORKER_POOL_LOCK = threading.Lock()
+_QUEUED = 0  # submitted to the worker pool but not started yet
+
+def worker_count() -> int:
+    return settings.IMAGE_WORKERS or min(8, os.cpu_count() or 1)
+
+def get_worker_pool() -> ThreadPoolExecutor:
+    """Process-wide pool for per-image work (OpenCV releases the GIL)."""
+    global _WORKER_POOL
+    with _WORKER_POOL_LOCK:
+        if _WORKER_POOL is None:
+            _WORKER_POOL = ThreadPoolExecutor(
+                max_workers=worker_count(),
+                thread_name_prefix="image-ops",
+            )
+        return _WORKER_POOL
+
+def submit_work(fn: Callable[..., Any], *args: Any) -> Future:
+    """Submit to the worker pool, tracking queue depth for /metrics."""
+    global _QUEUED
+
+    def run() -> Any:
+        global _QUEUED
+        with _WORKER_POOL_LOCK:
+            _QUEUED -= 1
+        return fn(*args)
+
+    with _WORKER_POOL_LOCK:
+        _QUEUED += 1
+    fut = get_worker_pool().submit(run)
+    def on_done(f: Future) -> None:
+        global _QUEUED
+        # cancelled before it ever started
+        if f.cancelled():
+            with _WORKER_POOL_LOCK:
+                _QUEUED -= 1
+    fut.add_done_callback(on_done)
+    return fut
+
+metrics.register_gauge(
+    "visionblocks_queue_depth", lambda: _QUEUED,
+    help="Work items waiting for a worker thread.", queue="image_ops",
+)
+
+def _thumbnail(img: np.ndarray, max_side: int) -> np.ndarray:
+    h, w = img.shape[:2]
+    if max(w, h) <= max_side:
+        return img
+    scale = max_side / max(w, h)
+    return cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+def frame_shape(img: np.ndarray) -> Tuple[int, int, int]:
+    """(height, width, channels) of a BGR or gray frame."""
+    return (img.shape[0], img.shape[1], img.shape[2] if img.ndim == 3 else 1)
+
+def preview_data_url(img: np.ndarray, max_side: int, fmt_hint: str | None = None) -> str:
+    """BGR frame -> downscaled preview data URL ("preview" encode preset)."""
+    from app.services.encoding import preview_format, to_data_url
+    return to_data_url(_thumbnail(img, max_side), preview_format(fmt_hint), preset="preview")
+
+def preview_one(
+    dataset_key: str,
+    rel_path: str,
+    steps: List[CompiledOp],
+    max_side: int,
+    include_before: bool = False,
+) -> Dict[str, Any]:
+    """Run compiled steps on one image and return a downscaled preview item."""
+    with open_dataset_image(dataset_key, rel_path, steps, share=True) as (img, fmt):
+        out = run_pipeline(img, steps)
+        item: Dict[str, Any] = {
+            "path": rel_path,
+            "after_data_url": preview_data_url(out, max_side, fmt),
+            "after_shape": frame_shape(out),
+        }
+        if include_before:
+            item["before_data_url"] = preview_data_url(img, max_side, fmt)
+    return item
+
+def preview_many(
+    dataset_key: str,
+    rel_paths: List[str],
+    ops: List[Dict[str, Any]],
+    max_side: int,
+    include_before: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Compile `ops` once and preview every path on the worker pool.
+    Items are yielded in completion order; a failing image yields an
+    item with `error` set instead of aborting the batch.
+    """
+    steps = compile_pipeline(ops)
+    futures = {
+        submit_work(preview_one, dataset_key, rel, steps, max_side, include_before): rel
+        for rel in rel_paths
+    }
+    try:
+        for fut in as_completed(futures):
+            try:
+                yield fut.result()
+            except Exception as e:
+                yield {"path": futures[fut], "error": str(e)}
+    finally:
+        # client went away mid-stream: drop work that has not started yet
+        for fut in futures:
+            fut.cancel()
 
 def sanitize_name(name: str) -> str:
     safe = "".join(ch if ch.isalnum() or ch in "-_." else "-" for ch in name).strip("-_.")
@@ -313,7 +609,19 @@ def export_dataset(
     ops: List[Dict[str, Any]],
     new_name: str,
     overwrite: bool = False,
+    output_format: str = "same_as_source",
+    preset: str | None = None,
 ) -> Dict[str, Any]:
+    """
+    Run `ops` over rel_paths into a new dataset folder. `output_format` is
+    "same_as_source" or PNG/JPEG/WEBP; `preset` names an encode preset
+    (default settings.EXPORT_PRESET).
+    """
+    from app.services.encoding import FORMATS, encode, get_preset, normalize_format
+
+    preset_obj = get_preset(preset or settings.EXPORT_PRESET)
+    forced_fmt = None if output_format == "same_as_source" else normalize_format(output_format)
+
     new_key = sanitize_name(new_name)
     src_root = (DATASETS_DIR / base_dataset).resolve()
     out_root = (DATASETS_DIR / new_key).resolve()
@@ -329,10 +637,12 @@ def export_dataset(
 
     processed = 0
     classes = set()
+    steps = compile_pipeline(ops)
 
-    for rel in rel_paths:
-        pil_img, abs_path, fmt = load_dataset_image(base_dataset, rel)
+    taken: Dict[str, set] = defaultdict(set)  # class -> output file names (lowercase)
 
+    def write_one(rel: str, out: np.ndarray, fmt: str) -> None:
+        nonlocal processed
         # infer class folder from rel path: images/<class>/file
         rel_p = Path(rel)
         cls = rel_p.parts[1] if len(rel_p.parts) >= 3 else "unknown"
@@ -341,16 +651,73 @@ def export_dataset(
         out_dir = (out_root / "images" / cls)
         out_dir.mkdir(parents=True, exist_ok=True)
 
-        out_pil = apply_pipeline(pil_img, ops)
-        out_fp = out_dir / Path(rel).name
-
-        if fmt == "JPEG":
-            out_pil = out_pil.convert("RGB")
-            out_pil.save(out_fp, format="JPEG", quality=90)
-        else:
-            out_pil.save(out_fp, format="PNG")
+        out_fmt = forced_fmt or fmt
+        data, _ = encode(out, out_fmt, preset=preset_obj)
+        out_fp = out_dir / rel_p.name
+        if forced_fmt:
+            out_fp = out_fp.with_suffix(FORMATS[out_fmt][1])
+        if out_fp.name.lower() in taken[cls]:
+            # a.jpg and a.png both forced to a.png (or same name in nested
+            # folders): keep both, source extension first, then a counter
+            ext = out_fp.suffix
+            stem = f"{rel_p.stem}_{rel_p.suffix.lstrip('.').lower()}" if rel_p.suffix else rel_p.stem
+            out_fp, n = out_dir / f"{stem}{ext}", 1
+            while out_fp.name.lower() in taken[cls]:
+                out_fp, n = out_dir / f"{stem}_{n}{ext}", n + 1
+        taken[cls].add(out_fp.name.lower())
+
+        writer.put(out_fp, data)
         processed += 1
 
+    # Same-shaped frames are stacked so point-wise steps run once per batch
+    # (services/batching.py). A batch holds its frames' budget reservations
+    # until written, so it is capped at a quarter of the budget, and frames
+    # after the first only try to reserve: when the budget is contended the
+    # batch is flushed instead of waiting while holding part of it.
+    # File reads run ahead and writes behind this loop on their own threads
+    # (services/staged_io.py), so disk time overlaps decode/ops/encode.
+    from app.services.batching import is_batchable, run_batched
+    from app.services.memory import MemoryBudgetExceeded, estimate_bytes, governor
+    from app.services.staged_io import WriteBehind, read_ahead
+
+    batch_size = max(1, settings.EXPORT_BATCH_SIZE) if is_batchable(steps) else 1
+    batch_cap = governor.budget // 4 if governor.enabled else float("inf")
+    reads = read_ahead(rel_paths, lambda rel: read_dataset_file(base_dataset, rel))
+    pending: Tuple[str, bytes | None] | None = None  # read, but refused by the budget
+    i = 0
+    with WriteBehind() as writer:
+        try:
+            while i < len(rel_paths) or pending is not None:
+                with ExitStack() as held:
+                    batch: List[Tuple[str, np.ndarray, str]] = []
+                    held_bytes = 0
+                    while len(batch) < batch_size and (not batch or held_bytes < batch_cap):
+                        if pending is None:
+                            if i >= len(rel_paths):
+                                break
+                            pending = next(reads)
+                            i += 1
+                        rel, data = pending
+                        try:
+                            img, fmt = held.enter_context(
+                                open_dataset_image(base_dataset, rel, steps, data, timeout=0 if batch else None)
+                            )
+                        except MemoryBudgetExceeded:
+                            if not batch:
+                                raise
+                            break  # flush, then wait for this frame with nothing held
+                        pending = None
+                        held_bytes += estimate_bytes((img.shape[1], img.shape[0]), steps, 3)
+                        batch.append((rel, img, fmt))
+                    if len(batch) == 1:
+                        outs = [run_pipeline(batch[0][1], steps)]
+                    else:
+                        outs = run_batched([img for _, img, _ in batch], steps)
+                    for (rel, _, fmt), out in zip(batch, outs):
+                        write_one(rel, out, fmt)
+        finally:
+            reads.close()
+
     # metadata.json
     meta = {
         "name": new_key,
@@ -359,7 +726,8 @@ def export_dataset(
         "classes": sorted(list(classes)),
         "image_count": processed,
         "preprocessing": ops,
-        "format": "same_as_source",
+        "format": output_format if forced_fmt is None else forced_fmt.lower(),
+        "encode_preset": preset_obj.name,
         "version": "1.0.0",
     }
     with open(out_root / "metadata.json", "w", encoding="utf-8") as f:
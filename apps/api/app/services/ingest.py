@@ -0,0 +1,337 @@
+"""
+Dataset ingest from uploaded zip/tar archives.
+
+The upload is streamed to CACHE_DIR/ingest/<job>/ in 1 MB chunks (never
+held in memory; a raw request body is written as it arrives, so an
+oversized one stops at UPLOAD_MAX_MB), then a background job extracts image members one at a
+time into a staging dataset folder while a thread pool header-probes
+each extracted file (files that do not parse as images are dropped). The
+job then writes index.csv + metadata.json and installs the folder into
+DATASETS_DIR, adding it to the dataset index without a full rescan.
+
+Archive layout: images are grouped by their parent folder name, so
+`<class>/x.jpg`, `images/<class>/x.jpg` and `<top>/images/<class>/x.jpg`
+all work; files with no folder go to class "unlabeled". Member names are
+never used as output paths directly (class and file names are
+sanitized), so `..`/absolute names cannot escape the staging folder;
+links and special files are skipped. Extraction counts the bytes it
+actually writes (archive headers can lie) against UPLOAD_MAX_FILE_MB per
+image and UPLOAD_MAX_EXTRACTED_MB in total, so a zip bomb cannot fill
+the disk.
+
+Jobs run on a small dedicated pool, not the image worker pool, so an
+upload of several hundred MB does not hold up other users' requests.
+Progress is polled with get_job().
+"""
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import IO, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
+import csv
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+from app.core import metrics
+from app.core.config import settings
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+_CHUNK = 2**20
+
+@dataclass
+class IngestJob:
+    id: str
+    dataset_key: str
+    name: str
+    state: str = "receiving"  # receiving | queued | extracting | indexing | done | failed
+    bytes_received: int = 0
+    files_total: int = 0   # image members found so far
+    files_probed: int = 0
+    images: int = 0        # accepted after probing
+    skipped: int = 0       # non-images, links, unreadable or oversized members
+    classes: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+_JOBS: Dict[str, IngestJob] = {}
+_JOBS_LOCK = threading.Lock()
+_POOL: Optional[ThreadPoolExecutor] = None
+
+def _ingest_pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _JOBS_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        return _POOL
+
+def _job_dir(job_id: str) -> Path:
+    return settings.CACHE_DIR / "ingest" / job_id
+
+def get_job(job_id: str) -> IngestJob:
+    with _JOBS_LOCK:
+        if job_id not in _JOBS:
+            raise KeyError(f"Unknown ingest job: {job_id}")
+        return _JOBS[job_id]
+
+# ------------------------
+# Receive
+# ------------------------
+
+def new_job(name: str) -> IngestJob:
+    """Register a job for dataset `name`; FileExistsError if the key is taken."""
+    from app.services.image_ops import DATASETS_DIR, sanitize_name
+
+    key = sanitize_name(name)
+    if (DATASETS_DIR / key).exists():
+        raise FileExistsError(f"Dataset '{key}' already exists.")
+    job = IngestJob(id=uuid.uuid4().hex, dataset_key=key, name=name)
+    with _JOBS_LOCK:
+        # finished jobs stay visible for an hour
+        cutoff = time.time() - 3600
+        for old in [j for j in _JOBS.values() if j.finished and j.finished < cutoff]:
+            del _JOBS[old.id]
+        _JOBS[job.id] = job
+    return job
+
+def _archive_path(job: IngestJob) -> Path:
+    d = _job_dir(job.id)
+    d.mkdir(parents=True, exist_ok=True)
+    return d / "upload.bin"
+
+def _received(job: IngestJob, nbytes: int) -> None:
+    job.bytes_received += nbytes
+    if job.bytes_received > settings.UPLOAD_MAX_MB * 2**20:
+        raise ValueError(f"Archive is larger than {settings.UPLOAD_MAX_MB} MB.")
+
+def receive(job: IngestJob, src: IO[bytes]) -> Path:
+    """
+    Copy the uploaded archive to the job folder in chunks (blocking; run it
+    in a worker thread). Enforces UPLOAD_MAX_MB.
+    """
+    archive = _archive_path(job)
+    with metrics.stage("write"), archive.open("wb") as dst:
+        while True:
+            chunk = src.read(_CHUNK)
+            if not chunk:
+                break
+            _received(job, len(chunk))
+            dst.write(chunk)
+    return archive
+
+async def receive_stream(job: IngestJob, chunks: AsyncIterator[bytes]) -> Path:
+    """
+    receive() for a raw request body: chunks are written as they arrive
+    (1 MB at a time, off the event loop), so an oversized upload fails at
+    UPLOAD_MAX_MB instead of being spooled whole first.
+    """
+    archive = _archive_path(job)
+    dst = await asyncio.to_thread(archive.open, "wb")
+    buf = bytearray()
+    try:
+        async for chunk in chunks:
+            _received(job, len(chunk))
+            buf += chunk
+            if len(buf) >= _CHUNK:
+                await asyncio.to_thread(dst.write, bytes(buf))
+                buf.clear()
+        if buf:
+            await asyncio.to_thread(dst.write, bytes(buf))
+    finally:
+        dst.close()
+    return archive
+
+def fail(job: IngestJob, error: str) -> None:
+    job.state, job.error, job.finished = "failed", error, time.time()
+    shutil.rmtree(_job_dir(job.id), ignore_errors=True)
+
+def start(job: IngestJob, archive: Path) -> Future:
+    job.state = "queued"
+    return _ingest_pool().submit(_run, job, archive)
+
+# ------------------------
+# Archive members
+# ------------------------
+
+def _safe_part(name: str) -> str:
+    safe = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in name).strip("._")
+    return safe[:100]
+
+def member_target(member_name: str) -> Optional[Tuple[str, str]]:
+    """
+    (class, file name) for an archive member, or None if it is not an
+    image or is junk (macOS resource forks, hidden files).
+    """
+    parts = [p for p in PurePosixPath(member_name.replace("\\", "/")).parts if p not in ("", ".", "..", "/")]
+    if not parts or any(p.startswith(".") or p == "__MACOSX" for p in parts):
+        return None
+    fname = _safe_part(parts[-1])
+    if not fname or PurePosixPath(fname).suffix.lower() not in IMG_EXTS:
+        return None
+    cls = _safe_part(parts[-2]) if len(parts) >= 2 and parts[-2] != "images" else ""
+    return cls or "unlabeled", fname
+
+def _members(archive: Path) -> Iterator[Tuple[str, int, Optional[IO[bytes]]]]:
+    """
+    (name, uncompressed size, open stream or None for non-regular members),
+    in archive order; tar is read strictly sequentially.
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                # symlinks in zips carry S_IFLNK in the high mode bits
+                if (info.external_attr >> 16) & 0o170000 == 0o120000:
+                    yield info.filename, info.file_size, None
+                    continue
+                with zf.open(info) as f:
+                    yield info.filename, info.file_size, f
+        return
+    try:
+        tf = tarfile.open(archive, mode="r|*")
+    except tarfile.TarError as e:
+        raise ValueError("Upload is not a zip or tar archive.") from e
+    with tf:
+        for m in tf:
+            if m.isdir():
+                continue
+            yield m.name, m.size, tf.extractfile(m) if m.isreg() else None
+
+def _copy_member(src: IO[bytes], dst: IO[bytes], max_file: int, room: int) -> bool:
+    """
+    Copy one member, counting the bytes actually read. False if it is over
+    `max_file` (the caller drops it); ValueError once the archive has
+    expanded past `room`, the extraction bytes left.
+    """
+    n = 0
+    while True:
+        chunk = src.read(_CHUNK)
+        if not chunk:
+            return True
+        n += len(chunk)
+        if n > max_file:
+            return False
+        if n > room:
+            raise ValueError(f"Archive expands to more than {settings.UPLOAD_MAX_EXTRACTED_MB} MB.")
+        dst.write(chunk)
+
+# ------------------------
+# Job
+# ------------------------
+
+def _probe(path: Path) -> bool:
+    """Header-only check that the file is an image we can decode."""
+    from app.services.loader import mapped, read_header
+
+    try:
+        with mapped(path) as data:
+            h = read_header(data)
+        return h.format in ("JPEG", "PNG", "WEBP") and h.width > 0 and h.height > 0
+    except Exception:
+        return False
+
+def _run(job: IngestJob, archive: Path) -> None:
+    from app.services.datasets import install_dataset
+
+    staged = _job_dir(job.id) / "dataset"
+    images = staged / "images"
+    max_file = settings.UPLOAD_MAX_FILE_MB * 2**20
+    room = settings.UPLOAD_MAX_EXTRACTED_MB * 2**20
+    workers = settings.IMAGE_WORKERS or min(8, os.cpu_count() or 1)
+    probes: List[Tuple[str, str, Path, Future]] = []
+    taken: Set[Tuple[str, str]] = set()  # (class, lowercase file name)
+    progress = threading.Lock()
+
+    def probed(f: Future) -> None:
+        with progress:
+            job.files_probed += 1
+
+    try:
+        job.state = "extracting"
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-probe") as pool:
+            for name, size, stream in _members(archive):
+                target = member_target(name)
+                if target is None or stream is None or size > max_file:
+                    job.skipped += 1
+                    continue
+                cls, fname = target
+                # same file name from different folders of one class; the
+                # suffixed name may itself be a real member, so keep counting
+                if (cls, fname.lower()) in taken:
+                    stem, ext = os.path.splitext(fname)
+                    n = 1
+                    while (cls, f"{stem}_{n}{ext}".lower()) in taken:
+                        n += 1
+                    fname = f"{stem}_{n}{ext}"
+                taken.add((cls, fname.lower()))
+                out = images / cls / fname
+                out.parent.mkdir(parents=True, exist_ok=True)
+                with out.open("wb") as dst:
+                    fits = _copy_member(stream, dst, max_file, room)
+                if not fits:
+                    out.unlink()
+                    job.skipped += 1
+                    continue
+                room -= out.stat().st_size
+                job.files_total += 1
+                fut = pool.submit(_probe, out)
+                fut.add_done_callback(probed)
+                probes.append((cls, fname, out, fut))
+
+        job.state = "indexing"
+        rows: List[Dict[str, str]] = []
+        counts: Dict[str, int] = {}
+        for cls, fname, out, fut in probes:
+            if not fut.result():
+                out.unlink(missing_ok=True)
+                job.skipped += 1
+                continue
+            rows.append({
+                "id": f"{len(rows) + 1:06d}",
+                "path": f"images/{cls}/{fname}",
+                "class": cls,
+                "split": "train",
+            })
+            counts[cls] = counts.get(cls, 0) + 1
+        if not rows:
+            raise ValueError("The archive contains no readable images.")
+        classes = sorted(counts)
+        for d in images.iterdir():
+            if d.is_dir() and d.name not in counts:
+                shutil.rmtree(d, ignore_errors=True)
+
+        with (staged / "index.csv").open("w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["id", "path", "class", "split"])
+            writer.writeheader()
+            writer.writerows(rows)
+        meta = {
+            "key": job.dataset_key,
+            "name": job.name,
+            "description": "Uploaded archive.",
+            "image_shape": [None, None, 3],
+            "num_classes": len(classes),
+            "classes": classes,
+            "approx_count": counts,
+            "version": "1.0.0",
+        }
+        with (staged / "metadata.json").open("w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        archive.unlink(missing_ok=True)
+        install_dataset(staged, job.dataset_key)
+        job.images, job.classes = len(rows), classes
+        job.state, job.finished = "done", time.time()
+        shutil.rmtree(_job_dir(job.id), ignore_errors=True)
+    except Exception as e:
+        fail(job, str(e))
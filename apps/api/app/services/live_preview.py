@@ -0,0 +1,150 @@
+"""
+Server-side state for the live preview WebSocket (/preprocess/session).
+
+A session decodes its sample once and keeps every step's output. An edit
+to the op list recomputes only from the first changed step. Each edit
+bumps a generation counter, and work for an older generation stops at the
+next step boundary without storing its result. The frames a session keeps
+hold a governor reservation until they are trimmed or the session closes.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+
+from app.core.lazy import lazy_import
+from app.services.image_ops import CompiledOp, compile_pipeline, frame_shape, open_dataset_image, preview_data_url
+from app.services.memory import MemoryBudgetExceeded, estimate_bytes, governor
+
+np = lazy_import("numpy")
+
+class Superseded(Exception):
+    """The generation a computation belonged to was replaced by a newer edit."""
+
+def first_difference(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> int:
+    """Index of the first op that differs (len of the shorter list if one is a prefix)."""
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            return i
+    return min(len(old), len(new))
+
+def _compile_each(ops: List[Dict[str, Any]]) -> List[Optional[CompiledOp]]:
+    """One entry per op (None for ops compile_pipeline ignores) so indices line up."""
+    out: List[Optional[CompiledOp]] = []
+    for op in ops:
+        compiled = compile_pipeline([op])
+        out.append(compiled[0] if compiled else None)
+    return out
+
+class PreviewSession:
+    def __init__(self, dataset_key: str, path: str) -> None:
+        with open_dataset_image(dataset_key, path, share=True) as (img, fmt):
+            self.original = img  # read-only BGR, kept for the session
+        if governor.enabled and img.nbytes > governor.budget:
+            raise MemoryBudgetExceeded(
+                f"Image needs {img.nbytes / 2**20:.0f} MB to keep for a live preview; "
+                f"the server budget is {governor.budget / 2**20:.0f} MB.",
+                retryable=False,
+            )
+        governor.acquire(img.nbytes)
+        self.dataset_key = dataset_key
+        self.path = path
+        self.fmt = fmt
+        self.ops: List[Dict[str, Any]] = []
+        self.steps: List[Optional[CompiledOp]] = []
+        self.results: List[np.ndarray] = []  # results[i] = output after step i
+        self._held: List[int] = []  # governor bytes held for results[i] (0: shares its input)
+        self.generation = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    # ------------------------
+    # Edits (event loop thread)
+    # ------------------------
+
+    def set_ops(self, ops: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Replace the op list; returns (generation, first step to recompute)."""
+        start = first_difference(self.ops, ops)
+        # only the changed tail is (re)compiled; ValueError leaves state as-is
+        tail = _compile_each(ops[start:])
+        with self._lock:
+            self.generation += 1
+            self.ops = list(ops)
+            self.steps = self.steps[:start] + tail
+            del self.results[start:]
+            self._release(self._held[start:])
+            del self._held[start:]
+            return self.generation, start
+
+    def splice(self, start: int, delete: int, insert: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """list.splice-style edit: drop `delete` ops at `start`, insert `insert` there."""
+        if not 0 <= start <= len(self.ops) or delete < 0:
+            raise ValueError("Splice out of range.")
+        return self.set_ops(self.ops[:start] + list(insert) + self.ops[start + delete:])
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.generation += 1
+
+    def close(self) -> None:
+        """Cancel running work and release every kept frame's reservation (idempotent)."""
+        with self._lock:
+            self.generation += 1
+            if self.closed:
+                return
+            self.closed = True
+            self.results.clear()
+            self._release(self._held + [self.original.nbytes])
+            self._held.clear()
+
+    @staticmethod
+    def _release(held: List[int]) -> None:
+        for nbytes in held:
+            if nbytes:
+                governor.release(nbytes)
+
+    # ------------------------
+    # Compute (worker threads)
+    # ------------------------
+
+    def compute_step(self, generation: int, i: int) -> np.ndarray:
+        """Run step i on step i-1's stored output; raises Superseded if stale."""
+        with self._lock:
+            if generation != self.generation:
+                raise Superseded()
+            step = self.steps[i]
+            prev = self.results[i - 1] if i > 0 else self.original
+        if step is None:
+            out = prev  # ignored op type: pass-through
+        else:
+            h, w = prev.shape[:2]
+            with governor.reserve(estimate_bytes((w, h), [step], 3)):
+                out = step(prev, self.original)
+        # the kept result is charged on top of the session's other frames
+        held = 0 if out is prev else out.nbytes
+        if held:
+            governor.acquire(held)
+        with self._lock:
+            if generation != self.generation or len(self.results) != i:
+                self._release([held])
+                raise Superseded()
+            self.results.append(out)
+            self._held.append(held)
+        return out
+
+    def render(self, img: np.ndarray, max_side: int) -> Dict[str, Any]:
+        """Preview data URL (downscaled to max_side) and full-size shape."""
+        return {
+            "data_url": preview_data_url(img, max_side, self.fmt),
+            "shape": list(frame_shape(img)),
+        }
+
+    def final(self) -> np.ndarray:
+        with self._lock:
+            return self.results[-1] if self.results else self.original
+
+    def pending(self, generation: int) -> Optional[int]:
+        """Next step index to compute for `generation`, or None when done/stale."""
+        with self._lock:
+            if generation != self.generation or len(self.results) >= len(self.steps):
+                return None
+            return len(self.results)
@@ -0,0 +1,113 @@
+"""
+Image file loader: memory-maps the file, reads the header and decodes
+straight from the mapped bytes with cv2.imdecode.
+
+No file handle outlives the call (the fd and the mapping are closed before
+returning), so long exports hold a constant number of fds. Decoded frames
+are returned read-only; pipeline ops never write into their input, so
+callers can pass them on without a defensive copy.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional, Union
+import io
+import mmap
+
+from PIL import Image
+
+from app.core import metrics
+from app.core.lazy import lazy_import
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+Mapped = Union[mmap.mmap, bytes]
+
+@dataclass(frozen=True)
+class ImageHeader:
+    width: int
+    height: int
+    bands: int
+    format: Optional[str]
+
+    @property
+    def size(self) -> tuple:
+        return self.width, self.height
+
+@contextmanager
+def mapped(path: Union[str, Path]) -> Iterator[Mapped]:
+    """Read-only mapping of `path`; fd and mapping are closed on exit."""
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file cannot be mapped
+            yield b""
+            return
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+def read_header(data: Mapped) -> ImageHeader:
+    """Size/bands/format from the header only (no pixel decode)."""
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        src = data
+    else:
+        src = io.BytesIO(data)
+    try:
+        with Image.open(src) as im:
+            return ImageHeader(im.width, im.height, len(im.getbands()), im.format)
+    except Image.DecompressionBombError as e:
+        from app.services.memory import MemoryBudgetExceeded
+        raise MemoryBudgetExceeded(str(e), retryable=False) from e
+
+def reduce_factor(header: ImageHeader, target: tuple) -> int:
+    """
+    Largest JPEG DCT-domain reduction (1, 2, 4 or 8) that still decodes at
+    least `target` (w, h); other formats always decode at full size.
+    """
+    if header.format != "JPEG":
+        return 1
+    for r in (8, 4, 2):
+        if header.width // r >= target[0] and header.height // r >= target[1]:
+            return r
+    return 1
+
+_REDUCED = {1: "IMREAD_COLOR", 2: "IMREAD_REDUCED_COLOR_2", 4: "IMREAD_REDUCED_COLOR_4", 8: "IMREAD_REDUCED_COLOR_8"}
+
+def decode_bgr(data: Mapped, reduce: int = 1) -> "np.ndarray":
+    """
+    Decode to a read-only BGR uint8 array (alpha dropped, gray expanded,
+    EXIF orientation ignored to match the PIL path). `reduce` uses libjpeg's
+    scaled decode.
+    """
+    flags = getattr(cv2, _REDUCED[reduce]) | cv2.IMREAD_IGNORE_ORIENTATION
+    buf = np.frombuffer(data, dtype=np.uint8)
+    try:
+        arr = cv2.imdecode(buf, flags)
+    finally:
+        del buf  # release the buffer export so the mapping can close
+    if arr is None:
+        raise ValueError("Could not decode image.")
+    arr.flags.writeable = False
+    return arr
+
+@contextmanager
+def open_pil(path: Union[str, Path]) -> Iterator[Image.Image]:
+    """
+    Lazily opened PIL image over a mapping of `path` (for the PIL-based
+    views). load() it before exit: the decoded image stays usable after the
+    fd and mapping are closed, so no defensive copy is needed.
+    """
+    with mapped(path) as data:
+        with metrics.stage("read"):
+            im = Image.open(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+        yield im
+
+def load_bgr(path: Union[str, Path]) -> "np.ndarray":
+    """mmap + decode in one call (no memory admission)."""
+    with mapped(path) as data:
+        return decode_bgr(data)
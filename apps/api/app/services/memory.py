@@ -0,0 +1,295 @@
+"""
+Process-wide budget for decoded pixel memory.
+
+Before an image is decoded, `admit()` (lazily opened PIL image) or
+`admit_file()` (path, mmap loader) estimates the peak bytes it will need
+from the header size and the compiled pipeline, then waits until that much
+budget is free. Images whose estimate alone exceeds the budget are either
+downscaled on decode (JPEG draft mode where possible) or rejected, per
+MEMORY_OVERSIZE_POLICY. Waiting longer than MEMORY_WAIT_TIMEOUT_S fails
+with a retryable error so callers can answer 503 instead of piling up.
+"""
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import math
+import threading
+import time
+
+from PIL import Image
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.services.image_ops import CompiledOp, infer_shapes
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+# PIL refuses images over 2x this (DecompressionBombError) and warns above it
+Image.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+class MemoryBudgetExceeded(RuntimeError):
+    """`retryable` is True when the budget is busy, False when the image can never fit."""
+
+    def __init__(self, message: str, retryable: bool) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+    @property
+    def status_code(self) -> int:
+        # 503: try again later; 413: this image is too large for this server
+        return 503 if self.retryable else 413
+
+# Extra bytes per pixel of the op's input used while the op runs (float32
+# copies, gradient planes, masks), on top of its uint8 output.
+_OP_SCRATCH_BPP: Dict[str, float] = {
+    "reset": 0,
+    "resize": 0,
+    "crop_center": 0,
+    "pad": 0,
+    "brightness_contrast": 0,
+    "blur_sharpen": 6,        # blurred copy + addWeighted result
+    "edges": 22,              # gray, gx/gy/mag float32, normalized, mask
+    "to_grayscale": 1,
+    "normalize": 28,          # float32 frame + float temporaries
+}
+
+def estimate_bytes(size: Tuple[int, int], steps: List[CompiledOp], bands: int = 3) -> int:
+    """
+    Peak bytes to decode an image of (w, h) and run `steps` on it.
+    Covers the decoded PIL frame, the original + current BGR frames, and the
+    largest per-op working set; frames of TILED_MIN_PIXELS or more are
+    charged the tiled working set instead.
+    """
+    w, h = int(size[0]), int(size[1])
+    px = w * h
+    decoded = px * max(3, bands)
+    tiled = bool(settings.TILED_MIN_PIXELS) and px >= settings.TILED_MIN_PIXELS
+    if tiled:
+        tile_px = settings.TILE_SIZE ** 2
+        scratch = max((_OP_SCRATCH_BPP.get(s.type, 0) for s in steps), default=0) * tile_px * 2
+        frames = px * 3 * 2
+        # geometry ops still allocate their full-frame output
+        for (oh, ow) in infer_shapes(steps, (h, w)):
+            frames = max(frames, px * 3 + oh * ow * 3)
+        return int(decoded + frames + scratch)
+
+    peak_op = 0
+    ih, iw = h, w
+    for step, (oh, ow) in zip(steps, infer_shapes(steps, (h, w))):
+        peak_op = max(peak_op, int(ih * iw * _OP_SCRATCH_BPP.get(step.type, 0) + oh * ow * 3))
+        ih, iw = oh, ow
+    # decoded + RGB copy + BGR original + working copy, then RGB/PIL result
+    out_h, out_w = ih, iw
+    return int(decoded + px * 3 * 3 + peak_op + out_h * out_w * 3 * 2)
+
+class MemoryGovernor:
+    def __init__(self, budget_bytes: int, wait_timeout: float) -> None:
+        self.budget = int(budget_bytes)
+        self.wait_timeout = float(wait_timeout)
+        self._cond = threading.Condition()
+        self.reserved = 0
+        self.peak_reserved = 0
+        self.waiting = 0
+        self.active = 0
+        self.admitted_total = 0
+        self.downscaled_total = 0
+        self.rejected_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def acquire(self, nbytes: int, timeout: Optional[float] = None) -> None:
+        """
+        Reserve `nbytes`, waiting up to `timeout` (default MEMORY_WAIT_TIMEOUT_S).
+        A timeout of 0 is a try: it fails at once and is not counted as a rejection.
+        """
+        if not self.enabled:
+            return
+        timeout = self.wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                # an oversize request may run alone rather than deadlock
+                while self.reserved and self.reserved + nbytes > self.budget:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if self.reserved + nbytes > self.budget:
+                            if timeout > 0:
+                                self.rejected_total += 1  # under self._cond
+                            raise MemoryBudgetExceeded(
+                                f"Server is busy: {nbytes / 2**20:.0f} MB of pixel memory not available "
+                                f"within {timeout:.0f}s. Try again shortly.",
+                                retryable=True,
+                            )
+            finally:
+                self.waiting -= 1
+            self.reserved += nbytes
+            self.active += 1
+            self.admitted_total += 1
+            self.peak_reserved = max(self.peak_reserved, self.reserved)
+
+    def release(self, nbytes: int) -> None:
+        if not self.enabled:
+            return
+        with self._cond:
+            self.reserved -= nbytes
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int, timeout: Optional[float] = None) -> Iterator[None]:
+        self.acquire(nbytes, timeout)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def count(self, attr: str) -> None:
+        with self._cond:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "budget_bytes": self.budget,
+                "reserved_bytes": self.reserved,
+                "peak_reserved_bytes": self.peak_reserved,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted_total": self.admitted_total,
+                "downscaled_total": self.downscaled_total,
+                "rejected_total": self.rejected_total,
+                "oversize_policy": settings.MEMORY_OVERSIZE_POLICY,
+            }
+
+governor = MemoryGovernor(settings.MEMORY_BUDGET_MB * 2**20, settings.MEMORY_WAIT_TIMEOUT_S)
+
+for _name, _attr in (("budget_bytes", "budget"), ("reserved_bytes", "reserved"), ("waiting", "waiting")):
+    metrics.register_gauge(
+        f"visionblocks_memory_{_name}", lambda a=_attr: getattr(governor, a),
+        help="Decoded-pixel memory governor state.",
+    )
+
+def _fit_size(size: Tuple[int, int], steps: List[CompiledOp], bands: int, limit: int) -> Tuple[int, int]:
+    """Largest (w, h) with the same aspect ratio whose estimate fits `limit`."""
+    w, h = size
+    est = estimate_bytes(size, steps, bands)
+    scale = math.sqrt(limit / est) if est > 0 else 1.0
+    while scale > 0.01:
+        cand = (max(1, int(w * scale)), max(1, int(h * scale)))
+        if estimate_bytes(cand, steps, bands) <= limit:
+            return cand
+        scale *= 0.9
+    return max(1, int(w * 0.01)), max(1, int(h * 0.01))
+
+def _oversize_target(
+    size: Tuple[int, int], steps: List[CompiledOp], bands: int
+) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    (estimate, downscale target or None) for an image of `size`; raises when
+    it does not fit and the oversize policy is to reject.
+    """
+    w, h = size
+    est = estimate_bytes(size, steps, bands)
+    too_many_px = w * h > settings.MAX_IMAGE_PIXELS
+    if not ((governor.enabled and est > governor.budget) or too_many_px):
+        return est, None
+    if settings.MEMORY_OVERSIZE_POLICY != "downscale":
+        governor.count("rejected_total")
+        raise MemoryBudgetExceeded(
+            f"Image {w}x{h} needs ~{est / 2**20:.0f} MB, over the "
+            f"{governor.budget / 2**20:.0f} MB pixel budget.",
+            retryable=False,
+        )
+    limit = governor.budget if governor.enabled else est
+    target = _fit_size(size, steps, bands, limit)
+    if too_many_px:
+        s = math.sqrt(settings.MAX_IMAGE_PIXELS / (target[0] * target[1]))
+        if s < 1:
+            target = (max(1, int(target[0] * s)), max(1, int(target[1] * s)))
+    return est, target
+
+@contextmanager
+def admit(img: Image.Image, steps: List[CompiledOp]) -> Iterator[Image.Image]:
+    """
+    Gate decoding of a lazily opened image (header read, pixels not yet
+    loaded) on the memory budget. Yields the loaded image, downscaled if the
+    oversize policy asked for it; the reservation is held until exit.
+    """
+    bands = len(img.getbands())
+    est, target = _oversize_target(img.size, steps, bands)
+    if target is not None:
+        # decode cost is still charged at source size unless draft can shrink it
+        if img.format == "JPEG":
+            img.draft("RGB", target)
+        est = estimate_bytes(target, steps, bands) + img.width * img.height * max(3, bands)
+
+    with governor.reserve(est):
+        with metrics.stage("decode"):
+            img.load()
+        if target is not None:
+            governor.count("downscaled_total")
+            if img.size != target:
+                img = img.resize(target, Image.BILINEAR, reducing_gap=2.0)
+        yield img
+
+@contextmanager
+def admit_file(
+    path: Union[str, Path], steps: List[CompiledOp], data: Optional[bytes] = None,
+    timeout: Optional[float] = None, share: bool = False,
+) -> Iterator["np.ndarray"]:
+    """
+    admit() for the mmap loader (services/loader.py): header read and decode
+    share one mapping, closed before the frame is yielded. Yields a
+    read-only BGR array; oversize JPEGs use libjpeg's scaled decode.
+    Frames already in the shared tier (services/shared_cache.py) are used
+    as is; `share` puts a freshly decoded full-size frame there too, for
+    interactive paths only: a bulk pass would evict the whole ring. `data` is the file's bytes when a read-ahead stage already loaded them
+    (services/staged_io.py); the file is then not opened again. `timeout`
+    is the budget wait (governor.acquire); nothing is decoded on a refusal.
+    """
+    from app.services import loader, shared_cache
+
+    key = shared_cache.file_key(path) if shared_cache.get_cache() is not None else None
+    with metrics.stage("read"):
+        cached = shared_cache.get_frame(key) if key else None
+    if cached is not None:
+        est, target = _oversize_target((cached.shape[1], cached.shape[0]), steps, 3)
+        if target is None:
+            with governor.reserve(est, timeout):
+                yield cached
+            return
+
+    with (loader.mapped(path) if data is None else nullcontext(data)) as data:
+        with metrics.stage("read"):
+            header = loader.read_header(data)
+        est, target = _oversize_target(header.size, steps, 3)
+        reduce = 1
+        if target is not None:
+            reduce = loader.reduce_factor(header, target)
+            est = estimate_bytes(target, steps, 3) + (header.width // reduce) * (header.height // reduce) * 3
+        # the reservation outlives the mapping: acquire/release by hand
+        governor.acquire(est, timeout)
+        try:
+            with metrics.stage("decode"):
+                arr = loader.decode_bgr(data, reduce)
+        except BaseException:
+            governor.release(est)
+            raise
+    if share and key and target is None:
+        shared_cache.put_frame(key, arr)
+    try:
+        if target is not None:
+            governor.count("downscaled_total")
+            if (arr.shape[1], arr.shape[0]) != target:
+                arr = cv2.resize(arr, target, interpolation=cv2.INTER_AREA)
+                arr.flags.writeable = False
+        yield arr
+    finally:
+        governor.release(est)
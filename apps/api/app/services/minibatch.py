@@ -0,0 +1,243 @@
+"""
+Mini-batch streams for training loops (/datasets/{key}/batches).
+
+Rows of a DatasetIndex are ordered (sequential, seeded shuffle, or
+class-stratified), decoded with an optional op plan on the worker pool
+with a read-ahead of two frames per pool worker (so a stream cannot
+crowd out interactive requests), and written as records:
+
+    <u4 little-endian n><n bytes JSON header><X .npy><y .npy>
+
+X is (B, H, W, 3) uint8 (RGB unless channels="bgr"), y is (B,) int64
+class ids (indices into the header's "classes"). .npy arrays carry their
+own shape, so np.load() on the stream reads each one exactly; read_records()
+does the client side. A batch reserves memory-governor budget for all of
+its frames when the first one arrives (before it holds any), and keeps
+it until the batch is sent. The last record's header has "done": true
+(or "error" when the stream had to stop, e.g. the memory budget stayed
+busy); rows whose files are missing or unreadable are skipped and counted.
+"""
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future
+from typing import IO, Any, Deque, Dict, Iterator, List, Optional, Tuple
+import io
+import json
+import random
+import struct
+
+from app.core import metrics
+from app.core.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+ORDERS = ("sequential", "shuffle", "stratified")
+
+# ------------------------
+# Ordering
+# ------------------------
+
+def batch_order(labels: List[int], order: str, seed: int, epoch: int) -> List[int]:
+    """Row indices for one epoch. Each epoch reshuffles with seed + epoch."""
+    idx = list(range(len(labels)))
+    if order == "sequential":
+        return idx
+    rng = random.Random(seed * 1_000_003 + epoch)
+    if order == "shuffle":
+        rng.shuffle(idx)
+        return idx
+    # stratified: shuffle within each class, then deal classes round-robin
+    # (in a shuffled class order) so every window is close to class-balanced
+    by_class: Dict[int, List[int]] = {}
+    for i in idx:
+        by_class.setdefault(labels[i], []).append(i)
+    queues = list(by_class.values())
+    for q in queues:
+        rng.shuffle(q)
+    rng.shuffle(queues)
+    # interleave proportionally: class c's k-th item sits at (k + 0.5) / n_c
+    keyed = [((k + 0.5) / len(q), j, i) for j, q in enumerate(queues) for k, i in enumerate(q)]
+    keyed.sort()
+    return [i for _, _, i in keyed]
+
+# ------------------------
+# Framing
+# ------------------------
+
+def _npy(arr: "np.ndarray") -> bytes:
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, arr, allow_pickle=False)
+    return buf.getvalue()
+
+def frame_record(header: Dict[str, Any], x: Optional["np.ndarray"] = None, y: Optional["np.ndarray"] = None) -> bytes:
+    head = json.dumps(header).encode("utf-8")
+    parts = [struct.pack("<I", len(head)), head]
+    if x is not None:
+        parts += [_npy(x), _npy(y)]
+    return b"".join(parts)
+
+def _read_exact(stream: IO[bytes], n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            raise EOFError("Stream ended inside a record.")
+        data += chunk
+    return data
+
+def read_records(stream: IO[bytes]) -> Iterator[Tuple[Dict[str, Any], Optional["np.ndarray"], Optional["np.ndarray"]]]:
+    """Client side: yield (header, X, y) until the final header (X, y None)."""
+    while True:
+        (n,) = struct.unpack("<I", _read_exact(stream, 4))
+        header = json.loads(_read_exact(stream, n))
+        if header.get("done") or header.get("error"):
+            yield header, None, None
+            return
+        x = np.lib.format.read_array(stream, allow_pickle=False)
+        y = np.lib.format.read_array(stream, allow_pickle=False)
+        yield header, x, y
+
+# ------------------------
+# Stream
+# ------------------------
+
+def _load_one(dataset_key: str, rel: str, steps: List, bgr: bool) -> "np.ndarray":
+    from app.services.image_ops import open_dataset_image, run_pipeline
+
+    with open_dataset_image(dataset_key, rel, steps) as (img, _):
+        out = run_pipeline(img, steps)
+        # copy out while the budget reservation is held; drop alpha/expand gray
+        if out.ndim == 2:
+            out = np.repeat(out[..., None], 3, axis=2)
+        out = out[..., :3] if bgr else out[..., 2::-1]
+        return np.ascontiguousarray(out)
+
+def iter_batches(
+    dataset_key: str,
+    batch_size: int = 32,
+    order: str = "shuffle",
+    seed: int = 0,
+    ops: Optional[List[Dict[str, Any]]] = None,
+    split: Optional[str] = None,
+    epochs: int = 1,
+    drop_last: bool = False,
+    channels: str = "rgb",
+    max_batches: Optional[int] = None,
+) -> Iterator[bytes]:
+    """
+    Framed mini-batch records for `dataset_key` (see module doc). Raises
+    KeyError/ValueError before the first record; later problems end the
+    stream with an "error" record. `max_batches` stops early (e.g. a quick
+    look at the first few batches) without decoding the rest.
+    """
+    from app.services.datasets import get_datasets_index
+    from app.services.image_ops import compile_pipeline, submit_work, worker_count
+    from app.services.memory import MemoryBudgetExceeded, governor
+
+    if order not in ORDERS:
+        raise ValueError(f"order must be one of {', '.join(ORDERS)}")
+    idx = get_datasets_index()
+    if dataset_key not in idx:
+        idx = get_datasets_index(force_refresh=True)
+        if dataset_key not in idx:
+            raise KeyError(f"Unknown dataset: {dataset_key}")
+    ds = idx[dataset_key]
+    steps = compile_pipeline(ops or [])
+    rows = [r for r in ds.rows if split is None or r.get("split") == split]
+    if not rows:
+        raise ValueError("No rows to stream (empty dataset or split).")
+    classes = list(ds.classes) or sorted({r["class"] for r in rows})
+    class_id = {c: i for i, c in enumerate(classes)}
+    labels = [class_id.get(r["class"], -1) for r in rows]
+
+    def work() -> Iterator[Tuple[int, int]]:
+        for epoch in range(epochs):
+            for i in batch_order(labels, order, seed, epoch):
+                yield epoch, i
+
+    todo = work()
+    window: Deque[Tuple[int, int, Future]] = deque()
+    lookahead = 2 * worker_count()
+    bgr = channels == "bgr"
+
+    def refill() -> None:
+        while len(window) < lookahead:
+            nxt = next(todo, None)
+            if nxt is None:
+                return
+            epoch, i = nxt
+            window.append((epoch, i, submit_work(_load_one, dataset_key, rows[i]["path"], steps, bgr)))
+
+    sent = skipped = held = 0
+    frames: List["np.ndarray"] = []
+    batch_rows: List[int] = []
+    batch_epoch = 0
+
+    def drop_batch() -> None:
+        nonlocal held
+        if held:
+            governor.release(held)
+            held = 0
+        frames.clear()
+        batch_rows.clear()
+
+    def emit() -> bytes:
+        nonlocal sent
+        with metrics.stage("stack"):
+            x = np.stack(frames)
+        y = np.asarray([labels[i] for i in batch_rows], dtype=np.int64)
+        header = {
+            "batch": sent,
+            "epoch": batch_epoch,
+            "paths": [rows[i]["path"] for i in batch_rows],
+            "classes": classes,
+            "shape": list(x.shape),
+        }
+        sent += 1
+        drop_batch()
+        return frame_record(header, x, y)
+
+    try:
+        refill()
+        while window and sent != max_batches:
+            epoch, i, fut = window.popleft()
+            refill()
+            try:
+                frame = fut.result()
+            except MemoryBudgetExceeded:
+                raise
+            except Exception:
+                skipped += 1  # stale index row or unreadable file
+                continue
+            if frames and epoch != batch_epoch:
+                # batches never span epochs
+                if not drop_last:
+                    yield emit()
+                else:
+                    drop_batch()
+            batch_epoch = epoch
+            if frames and frame.shape != frames[0].shape:
+                raise ValueError(
+                    f"Images in a batch differ in shape ({frames[0].shape}, {frame.shape}); "
+                    "add a fixed-size resize or pad op."
+                )
+            if not frames:
+                # the whole batch in one reservation, taken while holding
+                # nothing: streams never wait on budget with part of it held
+                need = batch_size * frame.nbytes
+                governor.acquire(need)
+                held = need
+            frames.append(frame)
+            batch_rows.append(i)
+            if len(frames) == batch_size:
+                yield emit()
+        if frames and not drop_last and sent != max_batches:
+            yield emit()
+        yield frame_record({"done": True, "batches": sent, "skipped": skipped, "classes": classes})
+    except (ValueError, MemoryBudgetExceeded) as e:
+        yield frame_record({"error": str(e), "batches": sent, "skipped": skipped})
+    finally:
+        # client went away mid-stream: drop work that has not started yet
+        for _, _, fut in window:
+            fut.cancel()
+        drop_batch()
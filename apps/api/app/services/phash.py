@@ -0,0 +1,237 @@
+"""
+Perceptual hashes (pHash + dHash, 64-bit) per dataset image, persisted
+under CACHE_DIR/phash/<dataset>.json and rebuilt incrementally: only files
+whose size/mtime changed are re-hashed, in parallel. The dataset index
+hashes every dataset in the background when it is built or a dataset is
+installed (PHASH_ON_INDEX), so the first duplicate query finds them
+ready. Near-duplicate search is a vectorized Hamming scan over the packed
+uint64 hashes.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import io
+import json
+import os
+import threading
+import time
+
+from PIL import Image
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.services.staged_io import staged_map
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+HASH_ALGOS = ("phash", "dhash")
+_STORE_VERSION = 2
+
+# ------------------------
+# Hash functions
+# ------------------------
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def dhash(gray: Image.Image) -> int:
+    """Difference hash: 9x8 grayscale, compare horizontal neighbours."""
+    small = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+def phash(gray: Image.Image) -> int:
+    """DCT hash: 32x32 grayscale, low 8x8 frequencies vs their median (DC excluded)."""
+    small = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.float32)
+    low = cv2.dct(small)[:8, :8]
+    med = np.median(low.ravel()[1:])
+    return _bits_to_int(low > med)
+
+def _hex(gray: Image.Image) -> Dict[str, str]:
+    return {"phash": f"{phash(gray):016x}", "dhash": f"{dhash(gray):016x}"}
+
+def hash_file(path: Path, data: Optional[bytes] = None) -> Dict[str, str]:
+    """
+    Both hashes for one image file (or its already-read bytes), hex encoded.
+    JPEG decodes at 1/8 scale (plenty for a 32x32 hash); other formats
+    decode full size, so they go through the memory governor.
+    """
+    from app.services.memory import admit_file
+
+    with Image.open(path if data is None else io.BytesIO(data)) as im:
+        if im.format == "JPEG":
+            im.draft("L", (64, 64))
+            return _hex(im.convert("L"))
+    with admit_file(path, [], data) as arr:
+        return _hex(Image.fromarray(cv2.cvtColor(arr, cv2.COLOR_BGR2GRAY)))
+
+# ------------------------
+# Persistent store
+# ------------------------
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+def _store_path(dataset_key: str) -> Path:
+    return settings.CACHE_DIR / "phash" / f"{dataset_key}.json"
+
+def _dataset_lock(dataset_key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(dataset_key, threading.Lock())
+
+def _load_store(dataset_key: str) -> Dict[str, Dict]:
+    p = _store_path(dataset_key)
+    try:
+        with p.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == _STORE_VERSION:
+            return data.get("entries", {})
+    except (OSError, ValueError):
+        pass
+    return {}
+
+def _save_store(dataset_key: str, entries: Dict[str, Dict]) -> None:
+    p = _store_path(dataset_key)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"version": _STORE_VERSION, "entries": entries}, f)
+    os.replace(tmp, p)
+
+def ensure_hashes(
+    dataset_key: str, root: Path, rel_paths: Iterable[str], workers: Optional[int] = None
+) -> Dict[str, Dict]:
+    """
+    Return rel path -> {"phash", "dhash", "size", "mtime"} for every readable
+    image in rel_paths, hashing only new or changed files on `workers`
+    threads (default: as many as the image worker pool).
+    """
+    rels = list(dict.fromkeys(rel_paths))
+    with _dataset_lock(dataset_key):
+        entries = _load_store(dataset_key)
+        todo: List[Tuple[str, int, float]] = []
+        current: Dict[str, Dict] = {}
+        for rel in rels:
+            try:
+                st = (root / rel).stat()
+            except OSError:
+                continue
+            old = entries.get(rel)
+            if old and old.get("size") == st.st_size and old.get("mtime") == st.st_mtime:
+                current[rel] = old
+            else:
+                todo.append((rel, st.st_size, st.st_mtime))
+
+        metrics.count("visionblocks_cache_requests_total", len(current), cache="phash", result="hit")
+        metrics.count("visionblocks_cache_requests_total", len(todo), cache="phash", result="miss")
+
+        if todo:
+            def read(item: Tuple[str, int, float]) -> Optional[bytes]:
+                try:
+                    return (root / item[0]).read_bytes()
+                except OSError:
+                    return None
+
+            def work(item: Tuple[str, int, float], data: Optional[bytes]) -> Tuple[str, Optional[Dict]]:
+                rel, size, mtime = item
+                if data is None:
+                    return rel, None
+                try:
+                    return rel, {**hash_file(root / rel, data), "size": size, "mtime": mtime}
+                except Exception:
+                    # unreadable/corrupt image: leave it out of the index
+                    return rel, None
+
+            # file reads run ahead of the hashing threads (services/staged_io.py)
+            with metrics.stage("phash"):
+                workers = workers or settings.IMAGE_WORKERS or min(8, os.cpu_count() or 1)
+                for rel, entry in staged_map(work, todo, read, workers=workers):
+                    if entry is not None:
+                        current[rel] = entry
+
+        if todo:
+            # keep entries for paths outside this call's selection
+            merged = {**{k: v for k, v in entries.items() if k not in current}, **current}
+            _save_store(dataset_key, merged)
+    return current
+
+# ------------------------
+# Search
+# ------------------------
+
+def pack_hashes(hashes: Dict[str, Dict], algo: str) -> Tuple[List[str], np.ndarray]:
+    rels = list(hashes)
+    packed = np.fromiter((int(hashes[r][algo], 16) for r in rels), dtype=np.uint64, count=len(rels))
+    return rels, packed
+
+def near_duplicate_pairs(packed: np.ndarray, max_distance: int, block: int = 512) -> List[Tuple[int, int, int]]:
+    """
+    All (i, j, distance) with i < j and Hamming distance <= max_distance.
+    Processes `block` rows at a time so memory stays O(block * n).
+    """
+    n = len(packed)
+    pairs: List[Tuple[int, int, int]] = []
+    for i0 in range(0, n, block):
+        i1 = min(n, i0 + block)
+        dist = np.bitwise_count(packed[i0:i1, None] ^ packed[None, :])
+        ii, jj = np.nonzero(dist <= max_distance)
+        keep = jj > ii + i0
+        for i, j in zip(ii[keep], jj[keep]):
+            pairs.append((int(i) + i0, int(j), int(dist[i, j])))
+    return pairs
+
+def group_duplicates(n: int, pairs: List[Tuple[int, int, int]]) -> List[List[int]]:
+    """Connected components (size >= 2) of the near-duplicate graph, in index order."""
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j, _ in pairs:
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [g for _, g in sorted(groups.items()) if len(g) > 1]
+
+def find_duplicates(
+    dataset_key: str,
+    root: Path,
+    rel_paths: List[str],
+    max_distance: int = 6,
+    algo: str = "phash",
+) -> Dict:
+    """Hash (incrementally) and group near-duplicates among rel_paths."""
+    if algo not in HASH_ALGOS:
+        raise ValueError(f"Unknown hash algorithm: {algo}")
+    t0 = time.perf_counter()
+    hashes = ensure_hashes(dataset_key, root, rel_paths)
+    t1 = time.perf_counter()
+    # keep the caller's order so "first" in a group is stable
+    ordered = {r: hashes[r] for r in rel_paths if r in hashes}
+    rels, packed = pack_hashes(ordered, algo)
+    pairs = near_duplicate_pairs(packed, max_distance)
+    dist = {(i, j): d for i, j, d in pairs}
+    groups = []
+    for g in group_duplicates(len(rels), pairs):
+        worst = max((dist.get((a, b), 0) for a in g for b in g if a < b), default=0)
+        groups.append({"paths": [rels[i] for i in g], "max_distance": worst})
+    t2 = time.perf_counter()
+    return {
+        "images_hashed": len(rels),
+        "groups": groups,
+        "hash_ms": (t1 - t0) * 1000.0,
+        "search_ms": (t2 - t1) * 1000.0,
+    }
+
+def drop_duplicates(dataset_key: str, root: Path, rel_paths: List[str], max_distance: int, algo: str = "phash") -> List[str]:
+    """rel_paths with every near-duplicate after the first of its group removed."""
+    found = find_duplicates(dataset_key, root, rel_paths, max_distance, algo)
+    drop = {p for g in found["groups"] for p in g["paths"][1:]}
+    return [r for r in rel_paths if r not in drop]
@@ -0,0 +1,347 @@
+"""
+Host-wide cache tier shared by every API worker process.
+
+One mmap'd slab file (tmpfs when /dev/shm exists) holds decoded frames and
+encoded previews, so under `uvicorn --workers N` a hit in one worker serves
+all of them and memory tracks the working set, not the worker count.
+
+Layout: [header][index: SLOTS fixed entries][data ring]. Values are
+appended to the ring at a monotonically growing logical `head`. An entry
+is live while its bytes are still within the last `capacity` bytes written,
+so eviction is FIFO and needs no bookkeeping. Access is serialized with
+flock (across processes) plus a thread lock (within one). Readers copy
+their bytes out under the lock. Without fcntl (Windows) the tier is off.
+
+The header carries a fingerprint of the app code and of the settings that
+shape cached values, so a deploy that changes an op or an encoder never
+reads the previous build's entries. Every attached process holds a shared
+flock on `<slab>.lock`. An empty slab is initialised under the slab's own
+exclusive flock, so workers starting together all attach; a slab with the
+wrong layout or fingerprint is only re-created when nobody else has it mapped (truncating a mapped file would
+SIGBUS its readers); otherwise this process runs without the tier and
+retries later. The last process to detach deletes the slab.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Optional
+import atexit
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.lazy import lazy_import
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, no shared tier
+    fcntl = None
+
+np = lazy_import("numpy")
+
+_MAGIC = 0x5642534C41423031  # "VBSLAB01"
+_HEADER = struct.Struct("<QIIQQQ")  # magic, version, slots, capacity, fingerprint, head
+_HEADER_SIZE = 64
+_ENTRY_SIZE = 32
+_VERSION = 2
+_RETRY_ATTACH_S = 30.0
+
+# settings that change what a cached frame/preview/body contains
+_FINGERPRINT_SETTINGS = (
+    "API_VERSION", "ENCODER_BACKEND", "PREVIEW_FORMAT", "PREVIEW_MAX_SIDE", "EXPORT_PRESET",
+    "MEMORY_OVERSIZE_POLICY", "MAX_IMAGE_PIXELS", "TILED_MIN_PIXELS", "TILE_SIZE",
+)
+_code_digest: Optional[bytes] = None
+
+def _code_hash() -> bytes:
+    """Digest of the app's Python sources, computed once per process."""
+    global _code_digest
+    if _code_digest is None:
+        root = Path(__file__).resolve().parents[1]
+        h = hashlib.blake2b(digest_size=16)
+        # app/*.py and one package level down (skips the data/ tree)
+        for p in sorted([*root.glob("*.py"), *root.glob("*/*.py")]):
+            h.update(p.relative_to(root).as_posix().encode("utf-8"))
+            h.update(p.read_bytes())
+        _code_digest = h.digest()
+    return _code_digest
+
+def fingerprint() -> int:
+    """Build + settings identity stored in the slab header."""
+    h = hashlib.blake2b(_code_hash(), digest_size=8)
+    for name in _FINGERPRINT_SETTINGS:
+        h.update(f"{name}={getattr(settings, name)!r};".encode("utf-8"))
+    return int.from_bytes(h.digest(), "little")
+
+def _entry_dtype():
+    return np.dtype([("h1", "<u8"), ("h2", "<u8"), ("start", "<u8"), ("length", "<u4"), ("used", "<u4")])
+
+def _key_hash(key: str) -> tuple:
+    d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(d[:8], "little"), int.from_bytes(d[8:], "little")
+
+class SlabBusy(OSError):
+    """The slab is mapped by processes with another layout or build."""
+
+class SharedCache:
+    def __init__(self, path: Path, capacity: int, slots: int = 4096, fingerprint: int = 0) -> None:
+        self.path = Path(path)
+        self.capacity = int(capacity)
+        self.slots = int(slots)
+        self.fingerprint = int(fingerprint)
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        self._busy_until = 0.0
+
+    # ------------------------
+    # Attach (lazily, and again after fork)
+    # ------------------------
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".lock")
+
+    def _hold_attach_lock(self) -> int:
+        """Shared flock on the lock file, retrying if it was unlinked meanwhile."""
+        while True:
+            fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self._lock_path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)  # the last process detached and removed it; start over
+
+    def _attach(self) -> None:
+        if self._pid == os.getpid() and self._mm is not None:
+            return
+        if self._pid == os.getpid() and time.monotonic() < self._busy_until:
+            raise SlabBusy(f"Shared cache slab {self.path} is in use with other settings.")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_fd = self._hold_attach_lock()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        total = _HEADER_SIZE + self.slots * _ENTRY_SIZE + self.capacity
+        busy = False
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(fd).st_size
+            header = _HEADER.unpack(os.pread(fd, _HEADER.size, 0)) if size >= _HEADER.size else None
+            want = (_MAGIC, _VERSION, self.slots, self.capacity, self.fingerprint)
+            if header is None or header[0] != _MAGIC:
+                # empty or never initialised: nobody maps a slab without a
+                # valid header, so the exclusive flock on it is enough
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, total)
+                os.pwrite(fd, _HEADER.pack(*want, 0), 0)
+            elif header[:5] == want:
+                if size < total:
+                    os.ftruncate(fd, total)  # growing never faults a mapping
+            else:
+                # another build/settings' slab: re-create it, but only if no
+                # other process has it mapped
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    busy = True
+                else:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, total)
+                    os.pwrite(fd, _HEADER.pack(*want, 0), 0)
+                    fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        if busy:
+            os.close(fd)
+            os.close(lock_fd)
+            self._pid, self._busy_until = os.getpid(), time.monotonic() + _RETRY_ATTACH_S
+            raise SlabBusy(f"Shared cache slab {self.path} is in use with other settings.")
+        self._fd, self._lock_fd = fd, lock_fd
+        self._mm = mmap.mmap(fd, total)
+        self._index = np.ndarray((self.slots,), dtype=_entry_dtype(), buffer=self._mm, offset=_HEADER_SIZE)
+        self._data_off = _HEADER_SIZE + self.slots * _ENTRY_SIZE
+        self._pid = os.getpid()
+
+    def close(self) -> None:
+        """Detach; the last process to leave deletes the slab and its lock file."""
+        with self._lock:
+            if self._mm is None or self._pid != os.getpid():
+                return
+            self._index = None
+            self._mm.close()
+            os.close(self._fd)
+            self._mm = self._fd = None
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.path.unlink(missing_ok=True)
+                self._lock_path.unlink(missing_ok=True)
+            except BlockingIOError:
+                pass  # still attached elsewhere
+            finally:
+                os.close(self._lock_fd)
+                self._lock_fd = self._pid = None
+
+    def _head(self) -> int:
+        return _HEADER.unpack_from(self._mm, 0)[5]
+
+    def _set_head(self, head: int) -> None:
+        struct.pack_into("<Q", self._mm, _HEADER.size - 8, head)
+
+    def _find(self, h1: int, h2: int, head: int) -> int:
+        idx = self._index
+        live = (idx["used"] == 1) & (idx["start"] + self.capacity >= head)
+        hits = np.flatnonzero(live & (idx["h1"] == np.uint64(h1)) & (idx["h2"] == np.uint64(h2)))
+        return int(hits[0]) if hits.size else -1
+
+    # ------------------------
+    # Public API
+    # ------------------------
+
+    def get(self, key: str) -> Optional[bytes]:
+        h1, h2 = _key_hash(key)
+        with self._lock:
+            self._attach()
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                i = self._find(h1, h2, self._head())
+                if i < 0:
+                    return None
+                e = self._index[i]
+                pos = self._data_off + int(e["start"]) % self.capacity
+                return bytes(self._mm[pos:pos + int(e["length"])])
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def put(self, key: str, value: bytes) -> bool:
+        """Store `value`; False (not stored) if it is over a quarter of the slab."""
+        n = len(value)
+        if n == 0 or n > self.capacity // 4:
+            return False
+        h1, h2 = _key_hash(key)
+        with self._lock:
+            self._attach()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                head = self._head()
+                pos = head % self.capacity
+                if pos + n > self.capacity:
+                    head += self.capacity - pos  # keep values contiguous: skip the ring tail
+                    pos = 0
+                idx = self._index
+                slot = self._find(h1, h2, head)
+                if slot < 0:
+                    free = np.flatnonzero((idx["used"] == 0) | (idx["start"] + self.capacity < head + n))
+                    slot = int(free[0]) if free.size else int(np.argmin(idx["start"]))
+                # slot is dead until its bytes are in (a crash mid-write leaves it dead, not torn)
+                idx["used"][slot] = 0
+                self._mm[self._data_off + pos:self._data_off + pos + n] = value
+                idx[slot] = (h1, h2, head, n, 1)
+                self._set_head(head + n)
+                return True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._attach()
+            head = self._head()
+            idx = self._index
+            live = (idx["used"] == 1) & (idx["start"] + self.capacity >= head)
+            return {
+                "capacity_bytes": self.capacity,
+                "entries": int(live.sum()),
+                "bytes": int(idx["length"][live].sum()),
+                "written_bytes": head,
+            }
+
+# ------------------------
+# Process-wide instance + typed helpers
+# ------------------------
+
+_CACHE: Optional[SharedCache] = None
+_CACHE_LOCK = threading.Lock()
+
+def _default_path() -> Path:
+    if settings.SHARED_CACHE_PATH:
+        return Path(settings.SHARED_CACHE_PATH)
+    shm = Path("/dev/shm")
+    return (shm if shm.is_dir() else settings.CACHE_DIR) / "visionblocks-shared.slab"
+
+def get_cache() -> Optional[SharedCache]:
+    """The host-wide cache, or None when disabled (SHARED_CACHE_MB=0) or unsupported."""
+    global _CACHE
+    if fcntl is None or settings.SHARED_CACHE_MB <= 0:
+        return None
+    path, capacity, fp = _default_path(), settings.SHARED_CACHE_MB * 2**20, fingerprint()
+    with _CACHE_LOCK:
+        if _CACHE is None or (_CACHE.path, _CACHE.capacity, _CACHE.fingerprint) != (path, capacity, fp):
+            if _CACHE is not None:
+                _CACHE.close()
+            _CACHE = SharedCache(path, capacity, fingerprint=fp)
+        return _CACHE
+
+@atexit.register
+def _detach() -> None:
+    if _CACHE is not None:
+        _CACHE.close()
+
+def get_bytes(kind: str, key: str) -> Optional[bytes]:
+    cache = get_cache()
+    if cache is None:
+        return None
+    try:
+        data = cache.get(f"{kind}:{key}")
+    except OSError:
+        return None
+    metrics.count("visionblocks_cache_requests_total", cache=f"shared_{kind}", result="hit" if data is not None else "miss")
+    return data
+
+def put_bytes(kind: str, key: str, value: bytes) -> None:
+    cache = get_cache()
+    if cache is not None:
+        try:
+            cache.put(f"{kind}:{key}", value)
+        except OSError:
+            pass
+
+_FRAME_HEADER = struct.Struct("<III")  # height, width, channels (0 = 2-D)
+
+def get_frame(key: str) -> Optional["np.ndarray"]:
+    """A cached uint8 frame (read-only), or None."""
+    data = get_bytes("frame", key)
+    if data is None:
+        return None
+    h, w, c = _FRAME_HEADER.unpack_from(data)
+    arr = np.frombuffer(data, dtype=np.uint8, offset=_FRAME_HEADER.size)
+    return arr.reshape((h, w, c) if c else (h, w))
+
+def put_frame(key: str, frame: "np.ndarray") -> None:
+    c = frame.shape[2] if frame.ndim == 3 else 0
+    head = _FRAME_HEADER.pack(frame.shape[0], frame.shape[1], c)
+    put_bytes("frame", key, head + np.ascontiguousarray(frame).tobytes())
+
+def _used_bytes() -> int:
+    cache = get_cache()
+    if cache is None:
+        return 0
+    try:
+        return cache.stats()["bytes"]
+    except OSError:
+        return 0
+
+metrics.register_gauge(
+    "visionblocks_shared_cache_bytes", _used_bytes,
+    help="Live bytes in the host-wide shared cache slab.",
+)
+
+def file_key(path: Path) -> str:
+    """Cache key part that changes whenever the file does."""
+    st = os.stat(path)
+    return f"{Path(path).resolve()}:{st.st_mtime_ns}:{st.st_size}"
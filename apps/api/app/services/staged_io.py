@@ -0,0 +1,164 @@
+"""
+Staged I/O for bulk passes over dataset files (exports, hash indexing).
+
+    read-ahead thread  ->  compute (caller / pool)  ->  write-behind thread
+
+read_ahead() loads file bytes up to IO_READ_AHEAD items in front of the
+compute loop; WriteBehind drains encoded outputs to disk from a queue of
+IO_WRITE_BEHIND files. Both queues are bounded, so a pass holds at most
+that many compressed files in memory however large the dataset, and a
+full queue simply blocks the faster side. The stage threads sit in
+read()/write() syscalls, which release the GIL, so disk (or a network
+mount behind DATASETS_DIR) overlaps decode/encode even on one core: a
+pass takes about max(I/O, CPU) instead of their sum.
+"""
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Iterable, Iterator, Optional, Tuple, TypeVar
+import queue
+import threading
+
+from app.core import metrics
+from app.core.config import settings
+
+T = TypeVar("T")
+
+_DONE = object()
+_POLL_S = 0.1  # how often a blocked stage thread checks for cancellation
+
+def _put(q: "queue.Queue", value: Any, stop: threading.Event) -> bool:
+    """Blocking put that gives up once `stop` is set."""
+    while not stop.is_set():
+        try:
+            q.put(value, timeout=_POLL_S)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def read_ahead(
+    items: Iterable[T], read: Callable[[T], Any], depth: Optional[int] = None
+) -> Iterator[Tuple[T, Any]]:
+    """
+    Yield (item, read(item)) in order while a background thread runs read()
+    up to `depth` items ahead. An exception from read() is re-raised when
+    its item is reached; closing the iterator early stops the reader.
+    """
+    depth = max(1, depth or settings.IO_READ_AHEAD)
+    q: "queue.Queue" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def reader() -> None:
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                try:
+                    with metrics.stage("read"):
+                        got = (item, read(item), None)
+                except Exception as e:
+                    got = (item, None, e)
+                if not _put(q, got, stop):
+                    return
+        finally:
+            _put(q, _DONE, stop)
+
+    thread = threading.Thread(target=reader, name="read-ahead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            got = q.get()
+            if got is _DONE:
+                return
+            item, value, err = got
+            if err is not None:
+                raise err
+            yield item, value
+    finally:
+        stop.set()
+        thread.join()
+
+def staged_map(
+    fn: Callable[[T, Any], Any],
+    items: Iterable[T],
+    read: Callable[[T], Any],
+    workers: int = 1,
+    depth: Optional[int] = None,
+) -> Iterator[Any]:
+    """
+    fn(item, read(item)) for every item, in order: reads run ahead on their
+    own thread, fn on `workers` threads with at most max(depth, workers)
+    results in flight.
+    """
+    depth = max(1, depth or settings.IO_READ_AHEAD)
+    window: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="staged") as pool:
+        reads = read_ahead(items, read, depth)
+        try:
+            for item, data in reads:
+                window.append(pool.submit(fn, item, data))
+                if len(window) >= max(depth, workers):
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            reads.close()
+            for fut in window:
+                fut.cancel()
+
+class WriteBehind:
+    """
+    Background file writer. put() queues (path, bytes) and only blocks when
+    `depth` writes are already pending; close() (or leaving the with
+    block) waits for the queue to drain and re-raises the first write
+    error. After a failed write the rest of the queue is dropped.
+    """
+
+    def __init__(self, depth: Optional[int] = None) -> None:
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, depth or settings.IO_WRITE_BEHIND))
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._q.get()
+            if job is None:
+                return
+            if self._error is not None:
+                continue
+            path, data = job
+            try:
+                with metrics.stage("write"):
+                    Path(path).write_bytes(data)
+            except BaseException as e:
+                self._error = e
+
+    def put(self, path: Path, data: bytes) -> None:
+        if self._error is not None:
+            raise self._error
+        self._q.put((path, data))
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._q.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> "WriteBehind":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # already failing: flush what was queued, keep the original error
+        try:
+            self.close()
+        except BaseException:
+            pass
@@ -0,0 +1,199 @@
+"""
+Tiled, memory-bounded execution of compiled pipelines for very large images.
+
+Local ops (blur/sharpen, edges) run on overlapping tiles with a halo wide
+enough that every output pixel sees the same neighbourhood as a full-frame
+run; point-wise ops run on tiles without halo. Steps that need a global
+statistic use a two-pass reduction: zscore accumulates per-channel sums,
+and the sobel/laplacian/prewitt edge paths find the global magnitude
+min/max before thresholding. Geometry ops (resize, crop, pad) still run
+full-frame on uint8, which is cheap next to the float32 copies they avoid.
+
+Working set is two uint8 frames (current + output) plus O(tile²) scratch,
+instead of several full-frame uint8/float32 buffers.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.image_ops import (
+    GRADIENT_EDGE_METHODS,
+    CompiledOp,
+    _edge_magnitude,
+    _render_edges,
+    _zscore_map,
+    cv2,
+    np,
+    op_blur_sharpen,
+    op_brightness_contrast,
+    op_normalize,
+    op_to_grayscale,
+)
+
+# Hysteresis in Canny follows edge chains of any length; a wide halo makes
+# seams invisible in practice but the tiled result is not bit-exact.
+CANNY_HALO = 32
+
+def iter_tiles(h: int, w: int, tile: int) -> Iterator[Tuple[int, int, int, int]]:
+    """(y0, y1, x0, x1) core rectangles covering an h x w frame."""
+    for y0 in range(0, h, tile):
+        for x0 in range(0, w, tile):
+            yield y0, min(h, y0 + tile), x0, min(w, x0 + tile)
+
+def _with_halo(src: np.ndarray, y0: int, y1: int, x0: int, x1: int, halo: int) -> Tuple[np.ndarray, int, int]:
+    """Tile view grown by `halo` (clamped to the frame) and the core offset inside it."""
+    h, w = src.shape[:2]
+    ys0, xs0 = max(0, y0 - halo), max(0, x0 - halo)
+    ys1, xs1 = min(h, y1 + halo), min(w, x1 + halo)
+    return src[ys0:ys1, xs0:xs1], y0 - ys0, x0 - xs0
+
+def map_tiles(
+    src: np.ndarray,
+    fn: Callable[[np.ndarray], np.ndarray],
+    halo: int = 0,
+    tile: int = 1024,
+    dst: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Apply a shape-preserving op tile by tile into `dst` (allocated if None)."""
+    if dst is None:
+        dst = np.empty_like(src)
+    for y0, y1, x0, x1 in iter_tiles(src.shape[0], src.shape[1], tile):
+        sub, oy, ox = _with_halo(src, y0, y1, x0, x1, halo)
+        res = fn(sub)
+        dst[y0:y1, x0:x1] = res[oy:oy + (y1 - y0), ox:ox + (x1 - x0)]
+    return dst
+
+# ------------------------
+# Tiled op variants
+# ------------------------
+
+def _blur_sharpen_halo(blur: float, sharp: float) -> int:
+    halo = 0
+    if blur > 0:
+        k = max(1, int(round(blur * 2 + 1)))
+        halo += (k + 1) // 2
+    if sharp > 0:
+        halo += 1  # 3x3 unsharp-mask blur
+    return halo + 1
+
+def tiled_blur_sharpen(src: np.ndarray, tile: int, blur: float, sharp: float) -> np.ndarray:
+    blur, sharp = float(blur or 0), float(sharp or 0)
+    return map_tiles(src, lambda t: op_blur_sharpen(t, blur=blur, sharp=sharp),
+                     halo=_blur_sharpen_halo(blur, sharp), tile=tile)
+
+def tiled_edges(src: np.ndarray, tile: int, method: str, threshold: int, overlay: bool) -> np.ndarray:
+    h, w = src.shape[:2]
+    if method not in GRADIENT_EDGE_METHODS:
+        # canny (and the canny fallback for unknown methods)
+        if method == "canny":
+            lo, hi = max(0, int(threshold)), min(255, int(threshold) + 60)
+        else:
+            lo, hi = 100, 160
+
+        def canny_tile(t: np.ndarray) -> np.ndarray:
+            gray = cv2.cvtColor(t, cv2.COLOR_BGR2GRAY)
+            return _render_edges(t, (cv2.Canny(gray, lo, hi) > 0).astype(np.uint8), overlay)
+
+        return map_tiles(src, canny_tile, halo=CANNY_HALO, tile=tile)
+
+    # pass 1: global min/max of the gradient magnitude (3x3 kernels -> halo 1)
+    lo_v, hi_v = np.inf, -np.inf
+    for y0, y1, x0, x1 in iter_tiles(h, w, tile):
+        sub, oy, ox = _with_halo(src, y0, y1, x0, x1, 2)
+        mag = _edge_magnitude(cv2.cvtColor(sub, cv2.COLOR_BGR2GRAY), method)
+        core = mag[oy:oy + (y1 - y0), ox:ox + (x1 - x0)]
+        mn, mx, _, _ = cv2.minMaxLoc(core)
+        lo_v, hi_v = min(lo_v, mn), max(hi_v, mx)
+
+    # same mapping as cv2.normalize(NORM_MINMAX, 0..255), then uint8 truncation
+    scale = 255.0 * (1.0 / (hi_v - lo_v)) if hi_v - lo_v > np.finfo(np.float64).eps else 0.0
+    shift = -lo_v * scale
+    thr = int(threshold)
+
+    # pass 2: threshold against the global range
+    def edge_tile(t: np.ndarray) -> np.ndarray:
+        mag = _edge_magnitude(cv2.cvtColor(t, cv2.COLOR_BGR2GRAY), method)
+        mag *= np.float32(scale)
+        mag += np.float32(shift)
+        mask = (mag.astype(np.uint8) >= thr).astype(np.uint8)
+        return _render_edges(t, mask, overlay)
+
+    return map_tiles(src, edge_tile, halo=2, tile=tile)
+
+def tiled_normalize(src: np.ndarray, tile: int, mode: str) -> np.ndarray:
+    if mode != "zscore":
+        return map_tiles(src, lambda t: op_normalize(t, mode=mode), tile=tile)
+
+    # pass 1: per-channel sums in float64
+    n = 0
+    s1 = np.zeros(3, dtype=np.float64)
+    s2 = np.zeros(3, dtype=np.float64)
+    for y0, y1, x0, x1 in iter_tiles(src.shape[0], src.shape[1], tile):
+        t = src[y0:y1, x0:x1].reshape(-1, 3).astype(np.float64)
+        n += t.shape[0]
+        s1 += t.sum(axis=0)
+        s2 += np.square(t).sum(axis=0)
+    mu = s1 / max(1, n)
+    var = np.maximum(s2 / max(1, n) - np.square(mu), 0.0)
+    sd = np.sqrt(var)
+    sd[sd == 0] = 1.0
+    mu32, sd32 = mu.astype(np.float32), sd.astype(np.float32)
+
+    # pass 2: map every tile with the global statistics
+    return map_tiles(src, lambda t: _zscore_map(t.astype(np.float32), mu32, sd32).astype(np.uint8), tile=tile)
+
+# op type -> tiled implementation (src, tile, **kwargs) -> dst
+TILED_OPS: Dict[str, Callable[..., np.ndarray]] = {
+    "brightness_contrast": lambda src, tile, **kw: map_tiles(src, lambda t: op_brightness_contrast(t, **kw), tile=tile),
+    "to_grayscale": lambda src, tile, **kw: map_tiles(src, op_to_grayscale, tile=tile),
+    "blur_sharpen": tiled_blur_sharpen,
+    "edges": tiled_edges,
+    "normalize": tiled_normalize,
+}
+
+# ------------------------
+# Runner
+# ------------------------
+
+def run_tiled(orig_cv: np.ndarray, steps: List[CompiledOp], tile: Optional[int] = None) -> np.ndarray:
+    """
+    Run compiled steps with tiled variants where available. `orig_cv` is
+    never modified; the result may alias it (e.g. empty pipeline).
+    """
+    tile = int(tile or settings.TILE_SIZE)
+    # keep the original alive only if a later reset needs it
+    last_reset = max((i for i, s in enumerate(steps) if s.type == "reset"), default=-1)
+    orig: Optional[np.ndarray] = orig_cv
+    cur = orig_cv
+    for i, step in enumerate(steps):
+        if step.type == "reset":
+            # tiled ops never write into their input, so no copy is needed
+            cur = orig
+        elif step.type in TILED_OPS:
+            with metrics.op(step.type):
+                cur = TILED_OPS[step.type](cur, tile, **step.kwargs)
+        else:
+            cur = step(cur, orig)
+        if i >= last_reset:
+            orig = None
+    return cur
+
+def apply_tiled(original_pil: Image.Image, steps: List[CompiledOp], tile: Optional[int] = None) -> Image.Image:
+    """
+    apply_compiled for very large images: converts colour order in place
+    rather than through extra full-frame copies, then runs tiled.
+    """
+    with metrics.stage("decode"):
+        img = original_pil if original_pil.mode == "RGB" else original_pil.convert("RGB")
+        bgr = np.array(img)
+        cv2.cvtColor(bgr, cv2.COLOR_RGB2BGR, dst=bgr)
+    out = run_tiled(bgr, steps, tile)
+    del bgr
+    with metrics.stage("to_pil"):
+        if not out.flags.writeable or not out.flags.c_contiguous:
+            out = out.copy()
+        cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=out)
+        return Image.fromarray(out)
@@ -0,0 +1,25 @@
+"""
+Speed benchmarks for the VisionBlocks API.
+
+Run from apps/api:
+
+    python -m benchmarks                       # all suites, print a table
+    python -m benchmarks --suite ops --sizes 512,2048
+    python -m benchmarks --save-baseline benchmarks/baselines/local.json
+    python -m benchmarks --baseline benchmarks/baselines/local.json --max-regression 0.25
+
+Load testing against a running server (uvicorn subprocess, in-process or
+an existing URL) lives in benchmarks.loadtest:
+
+    python -m benchmarks.loadtest --workers 4 --concurrency 1,8,32
+
+Encoder backends/presets compared on real dataset images (ms and KB):
+
+    python -m benchmarks.bench_encoding --dataset recyclables-mini
+
+Cold-start timing (import, index build, first op) in fresh interpreters:
+
+    python -m benchmarks.coldstart --importtime
+
+Correctness lives in tests/; this package only measures time.
+"""
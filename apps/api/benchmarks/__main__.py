@@ -0,0 +1,80 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import List
+import argparse
+import json
+import sys
+from dataclasses import asdict
+
+from benchmarks.harness import Case, Result, find_regressions, format_table, load_baseline, measure, save_baseline
+from benchmarks.synthetic import DEFAULT_SIZES
+
+SUITES = ("ops", "codec", "endpoints")
+
+def _parse_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(prog="python -m benchmarks", description="VisionBlocks API benchmarks")
+    p.add_argument("--suite", default=",".join(SUITES), help=f"comma list of {', '.join(SUITES)}")
+    p.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="longest image sides, comma list")
+    p.add_argument("--filter", default="", help="only run cases whose name contains this substring")
+    p.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per case (at least)")
+    p.add_argument("--min-runs", type=int, default=5)
+    p.add_argument("--warmup", type=int, default=2)
+    p.add_argument("--save-baseline", type=Path, help="write results as a JSON baseline")
+    p.add_argument("--baseline", type=Path, help="compare against this JSON baseline")
+    p.add_argument("--max-regression", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    p.add_argument("--metric", default="p50_ms", choices=("mean_ms", "p50_ms", "p90_ms", "p99_ms", "min_ms"))
+    p.add_argument("--json", type=Path, help="also write raw results to this file")
+    return p.parse_args(argv)
+
+def _run(cases: List[Case], args: argparse.Namespace) -> List[Result]:
+    results: List[Result] = []
+    for case in cases:
+        if args.filter and args.filter not in case.name:
+            continue
+        results.append(measure(case, warmup=args.warmup, min_runs=args.min_runs, min_time=args.min_time))
+        print(f"  {case.name}: p50 {results[-1].p50_ms:.2f} ms", file=sys.stderr)
+    return results
+
+def main(argv: List[str] | None = None) -> int:
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    suites = [s.strip() for s in args.suite.split(",") if s.strip()]
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        print(f"unknown suite(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    results: List[Result] = []
+    if "ops" in suites or "codec" in suites:
+        from benchmarks.bench_ops import codec_cases, op_cases
+        if "ops" in suites:
+            results += _run(op_cases(sizes), args)
+        if "codec" in suites:
+            from benchmarks.bench_encoding import encoder_cases
+            from benchmarks.bench_json import json_cases
+            results += _run(codec_cases(sizes) + encoder_cases(sizes) + json_cases(), args)
+    if "endpoints" in suites:
+        from benchmarks.bench_endpoints import endpoint_session
+        with endpoint_session(sizes) as cases:
+            results += _run(cases, args)
+
+    print(format_table(results))
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps([asdict(r) for r in results], indent=2), encoding="utf-8")
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+        print(f"baseline written: {args.save_baseline}")
+    if args.baseline:
+        regressions = find_regressions(results, load_baseline(args.baseline), args.max_regression, args.metric)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.max_regression:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nno regressions over {args.max_regression:.0%} vs {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Encoder backend comparison: time per (backend, format, preset) for the
+codec suite, plus a size report over real dataset images.
+
+    python -m benchmarks --suite codec --filter encode/
+    python -m benchmarks.bench_encoding --dataset recyclables-mini --limit 40
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+import argparse
+import statistics
+import sys
+import time
+
+from PIL import Image
+
+from app.services import encoding
+from benchmarks.harness import Case
+from benchmarks.synthetic import make_pil
+
+# (format, preset) pairs worth comparing; lossless JPEG is not a thing
+COMBOS: Tuple[Tuple[str, str], ...] = (
+    ("PNG", "preview"), ("PNG", "export"), ("PNG", "export_small"),
+    ("JPEG", "preview"), ("JPEG", "export"), ("JPEG", "export_small"),
+    ("WEBP", "preview"), ("WEBP", "export"), ("WEBP", "export_lossless"),
+)
+
+def _encoder(im: Image.Image, fmt: str, preset: str, backend: str) -> Callable[[], Any]:
+    return lambda: encoding.encode(im, fmt, preset, backend)
+
+def encoder_cases(sizes: Sequence[int]) -> List[Case]:
+    cases: List[Case] = []
+    for side in sizes:
+        im = make_pil(side)
+        px = im.width * im.height
+        for fmt, preset in COMBOS:
+            for backend in ("cv2", "pil"):
+                name = f"encode/{backend}[{fmt.lower()}:{preset}]@{side}"
+                cases.append(Case(name, _encoder(im, fmt, preset, backend), px, ["codec", "encode"]))
+    return cases
+
+def size_report(images: Iterable[Image.Image], repeat: int = 3) -> List[Dict[str, Any]]:
+    """Median encode ms and mean KB per (backend, format, preset) over `images`."""
+    ims = [im.convert("RGB") for im in images]
+    rows: List[Dict[str, Any]] = []
+    for fmt, preset in COMBOS:
+        for backend in ("cv2", "pil"):
+            times: List[float] = []
+            sizes: List[int] = []
+            for im in ims:
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    data, _ = encoding.encode(im, fmt, preset, backend)
+                    times.append((time.perf_counter() - t0) * 1000.0)
+                sizes.append(len(data))
+            rows.append({
+                "backend": backend, "format": fmt, "preset": preset,
+                "p50_ms": statistics.median(times) if times else 0.0,
+                "mean_kb": (sum(sizes) / len(sizes) / 1024.0) if sizes else 0.0,
+            })
+    return rows
+
+def _dataset_images(key: str, limit: int) -> List[Image.Image]:
+    from app.services.image_ops import DATASETS_DIR, IMG_EXTS
+    root = DATASETS_DIR / key / "images"
+    files = sorted(p for p in root.rglob("*") if p.suffix.lower() in IMG_EXTS)[:limit]
+    out: List[Image.Image] = []
+    for fp in files:
+        with Image.open(fp) as im:
+            out.append(im.convert("RGB"))
+    return out
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m benchmarks.bench_encoding", description="Encoder size/speed report")
+    p.add_argument("--dataset", default="recyclables-mini")
+    p.add_argument("--limit", type=int, default=40, help="max images to encode")
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+
+    ims = _dataset_images(args.dataset, args.limit)
+    if not ims:
+        print(f"no images found for dataset '{args.dataset}'", file=sys.stderr)
+        return 2
+    print(f"{len(ims)} image(s) from {args.dataset}")
+    print(f"{'backend':<8} {'format':<6} {'preset':<16} {'p50 ms':>9} {'mean KB':>9}")
+    for r in size_report(ims, args.repeat):
+        print(f"{r['backend']:<8} {r['format']:<6} {r['preset']:<16} {r['p50_ms']:>9.2f} {r['mean_kb']:>9.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
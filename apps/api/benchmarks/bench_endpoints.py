@@ -0,0 +1,87 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Iterator, List, Sequence
+import shutil
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.image_ops import DATASETS_DIR
+from benchmarks.bench_ops import PIPELINES
+from benchmarks.harness import Case
+from benchmarks.synthetic import make_pil
+
+BENCH_DATASET = "_bench-synthetic"
+
+@contextmanager
+def synthetic_dataset(sizes: Sequence[int]) -> Iterator[str]:
+    """
+    Temporary dataset with one PNG and one JPEG per size under
+    images/s<size>/, removed afterwards.
+    """
+    root = DATASETS_DIR / BENCH_DATASET
+    if root.exists():
+        shutil.rmtree(root)
+    try:
+        for side in sizes:
+            d = root / "images" / f"s{side}"
+            d.mkdir(parents=True, exist_ok=True)
+            im = make_pil(side)
+            im.save(d / "img.png", format="PNG")
+            im.save(d / "img.jpg", format="JPEG", quality=90)
+        yield BENCH_DATASET
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def _get(client: TestClient, url: str, **params):
+    def run():
+        r = client.get(url, params=params)
+        r.raise_for_status()
+    return run
+
+def _post(client: TestClient, url: str, payload: dict):
+    def run():
+        r = client.post(url, json=payload)
+        r.raise_for_status()
+    return run
+
+def endpoint_cases(client: TestClient, key: str, sizes: Sequence[int]) -> List[Case]:
+    cases: List[Case] = [
+        Case("http/GET /datasets", _get(client, "/datasets"), tags=["http"]),
+        Case("http/GET /datasets/{key}/info", _get(client, f"/datasets/{key}/info"), tags=["http"]),
+    ]
+    for side in sizes:
+        px = side * (side * 3 // 4)
+        for ext in ("png", "jpg"):
+            rel = f"images/s{side}/img.{ext}"
+            tag = f"{ext}@{side}"
+            cases += [
+                Case(f"http/GET grayscale[{tag}]", _get(client, f"/datasets/{key}/grayscale", path=rel), px, ["http"]),
+                Case(f"http/GET split_channels[{tag}]", _get(client, f"/datasets/{key}/split_channels", path=rel), px, ["http"]),
+                Case(
+                    f"http/GET views[all,{tag}]",
+                    _get(client, f"/datasets/{key}/views", path=rel,
+                         views=["original", "grayscale", "r", "g", "b", "histogram", "edges"]),
+                    px, ["http"],
+                ),
+            ]
+            for pname, ops in PIPELINES.items():
+                cases.append(Case(
+                    f"http/POST apply[{pname},{tag}]",
+                    _post(client, "/preprocess/apply", {"dataset_key": key, "path": rel, "ops": ops}),
+                    px, ["http"],
+                ))
+    rels = [f"images/s{side}/img.{ext}" for side in sizes for ext in ("png", "jpg")]
+    cases.append(Case(
+        f"http/POST batch_apply[{len(rels)} imgs]",
+        _post(client, "/preprocess/batch_apply",
+              {"dataset_key": key, "paths": rels, "ops": PIPELINES["module2_typical"], "max_side": 128}),
+        tags=["http"],
+    ))
+    return cases
+
+@contextmanager
+def endpoint_session(sizes: Sequence[int]) -> Iterator[List[Case]]:
+    with synthetic_dataset(sizes) as key:
+        client = TestClient(app)
+        yield endpoint_cases(client, key, sizes)
@@ -0,0 +1,60 @@
+"""
+Response serialization for image payloads: the old path (pydantic
+response_model validation + jsonable_encoder + stdlib json over str data
+URLs) against TimedJSONResponse with orjson and RawJSON data URLs.
+
+Payloads mimic /preprocess/apply: two data URLs of `mb` MB raw image
+bytes each (base64 adds a third), plus a few small fields.
+
+    python -m benchmarks --suite codec --filter json/
+"""
+from __future__ import annotations
+from typing import Any, Callable, List, Sequence
+import base64
+import json
+import os
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.responses import RawJSON, json_bytes
+from app.models.schemas import SplitChannelsResponse
+from benchmarks.harness import Case
+
+def _str_url(data: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(data).decode('ascii')}"
+
+def _raw_url(data: bytes) -> RawJSON:
+    return RawJSON(b'"data:', b"image/png", b";base64,", base64.b64encode(data), b'"')
+
+def _old_path(blobs: List[bytes]) -> Callable[[], Any]:
+    def run() -> bytes:
+        urls = [_str_url(b) for b in blobs]
+        model = SplitChannelsResponse(dataset_key="k", path="p", r_data_url=urls[0], g_data_url=urls[1], b_data_url=urls[2])
+        content = jsonable_encoder(model)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    return run
+
+def _str_orjson(blobs: List[bytes]) -> Callable[[], Any]:
+    def run() -> bytes:
+        urls = [_str_url(b) for b in blobs]
+        return json_bytes({"dataset_key": "k", "path": "p", "r_data_url": urls[0], "g_data_url": urls[1], "b_data_url": urls[2]})
+    return run
+
+def _raw(blobs: List[bytes]) -> Callable[[], Any]:
+    def run() -> bytes:
+        urls = [_raw_url(b) for b in blobs]
+        return json_bytes({"dataset_key": "k", "path": "p", "r_data_url": urls[0], "g_data_url": urls[1], "b_data_url": urls[2]})
+    return run
+
+def json_cases(sizes_mb: Sequence[float] = (1.0, 4.0)) -> List[Case]:
+    """Body build time for 3 data URLs totalling `mb` MB of encoded image."""
+    cases: List[Case] = []
+    for mb in sizes_mb:
+        blobs = [os.urandom(int(mb * 2**20 / 3)) for _ in range(3)]
+        tag = f"{mb:g}MB"
+        cases += [
+            Case(f"json/model+stdlib[{tag}]", _old_path(blobs), tags=["codec", "json"]),
+            Case(f"json/orjson_str[{tag}]", _str_orjson(blobs), tags=["codec", "json"]),
+            Case(f"json/orjson_raw[{tag}]", _raw(blobs), tags=["codec", "json"]),
+        ]
+    return cases
@@ -0,0 +1,131 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Sequence
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.services import batching, image_ops, loader
+from benchmarks.harness import Case
+from benchmarks.synthetic import encoded, make_bgr, make_pil
+
+# op_* function name -> list of (variant label, kwargs); cv_img is passed first.
+OP_VARIANTS: Dict[str, List[tuple]] = {
+    "op_reset": [("", {})],  # cv_orig filled in below
+    "op_resize": [
+        ("size", {"mode": "size", "w": 224, "h": 224}),
+        ("size_keep", {"mode": "size", "keep": True, "w": 224, "h": 224}),
+        ("fit", {"mode": "fit", "maxside": 256}),
+        ("scale50", {"mode": "scale", "pct": 50}),
+    ],
+    "op_crop_center": [("224", {"w": 224, "h": 224})],
+    "op_pad": [
+        ("constant", {"w": 0, "h": 0, "mode": "constant"}),  # w/h filled in below (+64 px)
+        ("edge", {"w": 0, "h": 0, "mode": "edge"}),
+        ("reflect", {"w": 0, "h": 0, "mode": "reflect"}),
+    ],
+    "op_brightness_contrast": [("", {"b": 20, "c": 15})],
+    "op_blur_sharpen": [
+        ("blur", {"blur": 3, "sharp": 0}),
+        ("sharp", {"blur": 0, "sharp": 1.5}),
+        ("both", {"blur": 2, "sharp": 1}),
+    ],
+    "op_edges": [
+        (f"{m}{'_overlay' if ov else ''}", {"method": m, "threshold": 80, "overlay": ov})
+        for m in ("canny", "sobel", "laplacian", "prewitt")
+        for ov in (False, True)
+    ],
+    "op_to_grayscale": [("", {})],
+    "op_normalize": [(m, {"mode": m}) for m in ("zero_one", "minus_one_one", "zscore")],
+}
+
+PIPELINES: Dict[str, List[Dict[str, Any]]] = {
+    "module2_typical": [
+        {"type": "reset"},
+        {"type": "resize", "mode": "fit", "maxside": 512},
+        {"type": "pad", "w": 512, "h": 512, "mode": "edge"},
+        {"type": "brightness_contrast", "b": 10, "c": 10},
+        {"type": "normalize", "mode": "zero_one"},
+    ],
+    "full_res_heavy": [
+        {"type": "blur_sharpen", "blur": 2, "sharp": 1},
+        {"type": "edges", "method": "sobel", "threshold": 60, "overlay": True},
+        {"type": "normalize", "mode": "zscore"},
+    ],
+}
+
+def all_op_names() -> List[str]:
+    return sorted(n for n in dir(image_ops) if n.startswith("op_") and callable(getattr(image_ops, n)))
+
+def _op_call(fn: Callable, img: np.ndarray, kwargs: Dict[str, Any]) -> Callable[[], Any]:
+    return lambda: fn(img, **kwargs)
+
+def op_cases(sizes: Sequence[int]) -> List[Case]:
+    missing = [n for n in all_op_names() if n not in OP_VARIANTS]
+    if missing:
+        raise RuntimeError(f"No benchmark variants for: {', '.join(missing)} (add them to OP_VARIANTS)")
+
+    cases: List[Case] = []
+    for side in sizes:
+        img = make_bgr(side)
+        px = img.shape[0] * img.shape[1]
+        for name in all_op_names():
+            fn = getattr(image_ops, name)
+            for label, kwargs in OP_VARIANTS[name]:
+                kw = dict(kwargs)
+                if name == "op_reset":
+                    kw["cv_orig"] = img
+                if name == "op_pad":
+                    kw["w"], kw["h"] = img.shape[1] + 64, img.shape[0] + 64
+                case_name = f"ops/{name}{'[' + label + ']' if label else ''}@{side}"
+                cases.append(Case(case_name, _op_call(fn, img, kw), pixels=px, tags=["ops"]))
+
+        pil = make_pil(side)
+        for pname, ops in PIPELINES.items():
+            steps = image_ops.compile_pipeline(ops)
+            cases.append(Case(f"pipeline/apply_pipeline[{pname}]@{side}", lambda pil=pil, ops=ops: image_ops.apply_pipeline(pil, ops), pixels=px, tags=["pipeline"]))
+            cases.append(Case(f"pipeline/apply_compiled[{pname}]@{side}", lambda pil=pil, steps=steps: image_ops.apply_compiled(pil, steps), pixels=px, tags=["pipeline"]))
+
+        # export-style: 16 frames, image by image vs stacked (services/batching.py)
+        frames = [img] * 16
+        steps = image_ops.compile_pipeline(PIPELINES["module2_typical"])
+        cases.append(Case(f"pipeline/per_image[x16]@{side}", lambda f=frames, s=steps: [image_ops.run_compiled(x, s) for x in f], pixels=px * 16, tags=["pipeline"]))
+        cases.append(Case(f"pipeline/run_batched[x16]@{side}", lambda f=frames, s=steps: batching.run_batched(f, s), pixels=px * 16, tags=["pipeline"]))
+    return cases
+
+def codec_cases(sizes: Sequence[int]) -> List[Case]:
+    cases: List[Case] = []
+    for side in sizes:
+        pil = make_pil(side)
+        bgr = make_bgr(side)
+        px = bgr.shape[0] * bgr.shape[1]
+        files = encoded(side)
+
+        def pil_encode(fmt: str, im: Image.Image = pil, **kw: Any) -> Callable[[], Any]:
+            def run() -> bytes:
+                buf = io.BytesIO()
+                im.save(buf, format=fmt, **kw)
+                return buf.getvalue()
+            return run
+
+        def pil_decode(data: bytes) -> Callable[[], Any]:
+            def run() -> Image.Image:
+                with Image.open(io.BytesIO(data)) as im:
+                    return im.convert("RGB")
+            return run
+
+        cases += [
+            Case(f"codec/pil_encode[png]@{side}", pil_encode("PNG"), px, ["codec"]),
+            Case(f"codec/pil_encode[jpeg90]@{side}", pil_encode("JPEG", quality=90), px, ["codec"]),
+            Case(f"codec/cv2_imencode[png]@{side}", lambda b=bgr: cv2.imencode(".png", b), px, ["codec"]),
+            Case(f"codec/cv2_imencode[jpeg90]@{side}", lambda b=bgr: cv2.imencode(".jpg", b, [cv2.IMWRITE_JPEG_QUALITY, 90]), px, ["codec"]),
+            Case(f"codec/pil_decode[png]@{side}", pil_decode(files["PNG"]), px, ["codec"]),
+            Case(f"codec/pil_decode[jpeg]@{side}", pil_decode(files["JPEG"]), px, ["codec"]),
+            Case(f"codec/cv2_imdecode[png]@{side}", lambda d=files["PNG"]: cv2.imdecode(np.frombuffer(d, np.uint8), cv2.IMREAD_COLOR), px, ["codec"]),
+            Case(f"codec/cv2_imdecode[jpeg]@{side}", lambda d=files["JPEG"]: cv2.imdecode(np.frombuffer(d, np.uint8), cv2.IMREAD_COLOR), px, ["codec"]),
+            Case(f"codec/loader_decode[jpeg]@{side}", lambda d=files["JPEG"]: loader.decode_bgr(d), px, ["codec"]),
+            Case(f"codec/pil_to_data_url[png]@{side}", lambda im=pil: image_ops.pil_to_data_url(im, "PNG"), px, ["codec"]),
+            Case(f"codec/pil_to_data_url[jpeg]@{side}", lambda im=pil: image_ops.pil_to_data_url(im, "JPEG"), px, ["codec"]),
+        ]
+    return cases
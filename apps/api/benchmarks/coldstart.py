@@ -0,0 +1,81 @@
+"""
+Cold-start timing for the API, measured in fresh interpreters.
+
+    python -m benchmarks.coldstart            # 5 runs, median
+    python -m benchmarks.coldstart --runs 10 --importtime
+
+Reports, per run: time to import app.main, time to build the dataset index,
+and time until the first image op has paid for the OpenCV/NumPy import.
+With --importtime it also lists the slowest modules from `-X importtime`.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+API_DIR = Path(__file__).resolve().parents[1]
+
+_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from app.services.datasets import get_datasets_index
+get_datasets_index(force_refresh=True)
+t2 = time.perf_counter()
+import sys
+heavy_loaded = "cv2" in sys.modules or "numpy" in sys.modules
+from app.services.image_ops import apply_pipeline
+from PIL import Image
+apply_pipeline(Image.new("RGB", (8, 8)), [{"type": "to_grayscale"}])
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "index_ms": (t2 - t1) * 1000,
+    "first_op_ms": (t3 - t2) * 1000,
+    "heavy_imported_at_startup": heavy_loaded,
+}))
+"""
+
+def probe() -> Dict[str, float]:
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=API_DIR, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(top: int = 15) -> List[str]:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                         cwd=API_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            rows.append((int(parts[1]), parts[2].rstrip()))
+        except ValueError:
+            continue
+    rows.sort(reverse=True)
+    return [f"{us / 1000:9.1f} ms  {name}" for us, name in rows[:top]]
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m benchmarks.coldstart")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--importtime", action="store_true", help="list the slowest cumulative imports")
+    args = p.parse_args(argv)
+
+    runs = [probe() for _ in range(args.runs)]
+    for key in ("import_ms", "index_ms", "first_op_ms"):
+        vals = [r[key] for r in runs]
+        print(f"{key:<12} median {statistics.median(vals):8.1f}  min {min(vals):8.1f}  max {max(vals):8.1f}")
+    eager = any(r["heavy_imported_at_startup"] for r in runs)
+    print(f"cv2/numpy imported at startup: {'yes' if eager else 'no'}")
+    if args.importtime:
+        print("\nslowest imports (cumulative):")
+        print("\n".join(slowest_imports()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import json
+import math
+import platform
+import statistics
+import time
+
+# ------------------------
+# Cases + registry
+# ------------------------
+
+@dataclass
+class Case:
+    """A named callable to time. `pixels` (per call) enables MPix/s reporting."""
+    name: str
+    fn: Callable[[], Any]
+    pixels: int = 0
+    tags: List[str] = field(default_factory=list)
+
+@dataclass
+class Result:
+    name: str
+    n: int
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    min_ms: float
+    max_ms: float
+    ops_per_s: float
+    mpix_per_s: Optional[float] = None
+
+def percentile(samples: List[float], q: float) -> float:
+    """Linear-interpolated percentile, q in [0, 100]."""
+    if not samples:
+        return math.nan
+    xs = sorted(samples)
+    if len(xs) == 1:
+        return xs[0]
+    k = (len(xs) - 1) * (q / 100.0)
+    lo = math.floor(k)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+def summarize(name: str, samples_s: List[float], pixels: int = 0) -> Result:
+    ms = [s * 1000.0 for s in samples_s]
+    mean = statistics.fmean(ms)
+    return Result(
+        name=name,
+        n=len(ms),
+        mean_ms=mean,
+        p50_ms=percentile(ms, 50),
+        p90_ms=percentile(ms, 90),
+        p99_ms=percentile(ms, 99),
+        min_ms=min(ms),
+        max_ms=max(ms),
+        ops_per_s=1000.0 / mean if mean > 0 else math.inf,
+        mpix_per_s=(pixels / 1e6) / (mean / 1000.0) if pixels and mean > 0 else None,
+    )
+
+def measure(case: Case, warmup: int = 2, min_runs: int = 5, min_time: float = 0.5, max_runs: int = 1000) -> Result:
+    """
+    Time `case.fn` until both min_runs and min_time are reached
+    (capped at max_runs). Warmup calls are not recorded.
+    """
+    for _ in range(warmup):
+        case.fn()
+    samples: List[float] = []
+    started = time.perf_counter()
+    while len(samples) < max_runs:
+        t0 = time.perf_counter()
+        case.fn()
+        samples.append(time.perf_counter() - t0)
+        if len(samples) >= min_runs and time.perf_counter() - started >= min_time:
+            break
+    return summarize(case.name, samples, case.pixels)
+
+# ------------------------
+# Baselines
+# ------------------------
+
+def environment() -> Dict[str, str]:
+    """Versions that explain most speed changes between baselines."""
+    env = {"python": platform.python_version(), "machine": platform.machine(), "platform": platform.platform()}
+    for mod in ("numpy", "cv2", "PIL", "fastapi", "pydantic"):
+        try:
+            env[mod] = __import__(mod).__version__
+        except Exception:
+            env[mod] = "n/a"
+    return env
+
+def save_baseline(results: List[Result], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "results": {r.name: asdict(r) for r in results},
+    }
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+def load_baseline(path: Path) -> Dict[str, Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+def find_regressions(
+    results: List[Result],
+    baseline: Dict[str, Dict[str, Any]],
+    max_regression: float = 0.25,
+    metric: str = "p50_ms",
+) -> List[str]:
+    """
+    Cases whose `metric` grew by more than `max_regression` (0.25 = 25%)
+    over the baseline. Cases missing from the baseline are skipped.
+    """
+    out: List[str] = []
+    for r in results:
+        base = baseline.get(r.name)
+        if not base or not base.get(metric):
+            continue
+        old, new = float(base[metric]), float(getattr(r, metric))
+        if new > old * (1.0 + max_regression):
+            out.append(f"{r.name}: {metric} {old:.2f} -> {new:.2f} ms (+{(new / old - 1) * 100:.0f}%)")
+    return out
+
+def format_table(results: List[Result]) -> str:
+    head = f"{'case':<48} {'n':>5} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'ops/s':>9} {'MPix/s':>8}"
+    lines = [head, "-" * len(head)]
+    for r in results:
+        mpix = f"{r.mpix_per_s:8.1f}" if r.mpix_per_s is not None else f"{'':>8}"
+        lines.append(
+            f"{r.name:<48} {r.n:>5} {r.mean_ms:>9.2f} {r.p50_ms:>9.2f} {r.p90_ms:>9.2f} {r.p99_ms:>9.2f} {r.ops_per_s:>9.1f} {mpix}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,362 @@
+"""
+Load generator replaying classroom-style traffic against a local API.
+
+    python -m benchmarks.loadtest                           # uvicorn subprocess, 1 worker
+    python -m benchmarks.loadtest --workers 4 --concurrency 1,8,32 --duration 20
+    python -m benchmarks.loadtest --server inprocess
+    python -m benchmarks.loadtest --url http://10.0.0.5:8000 # already running server
+
+Each virtual user loops over weighted scenarios (sample bursts, stepwise
+/preprocess/apply chains like a Module 2 student, multi-view fetches and the
+occasional small batch_export) against the bundled recyclables-mini dataset.
+For each concurrency level it reports throughput, p50/p95/p99 latency, error
+rate and the server's peak RSS.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import httpx
+
+from benchmarks.harness import percentile
+
+API_DIR = Path(__file__).resolve().parents[1]
+EXPORT_PREFIX = "loadtest-"
+
+# ------------------------
+# Scenarios
+# ------------------------
+
+# A Module 2 chain as students build it: each new block re-runs the whole prefix.
+CHAIN: List[Dict] = [
+    {"type": "reset"},
+    {"type": "resize", "mode": "fit", "maxside": 256},
+    {"type": "pad", "w": 256, "h": 256, "mode": "edge"},
+    {"type": "brightness_contrast", "b": 10, "c": 5},
+    {"type": "blur_sharpen", "blur": 1, "sharp": 0.5},
+    {"type": "edges", "method": "canny", "threshold": 100, "overlay": True},
+    {"type": "normalize", "mode": "zero_one"},
+]
+
+Record = Tuple[str, float, bool]  # (endpoint, seconds, ok)
+
+class VirtualUser:
+    def __init__(self, client: httpx.Client, dataset: str, rng: random.Random, allow_export: bool) -> None:
+        self.client = client
+        self.dataset = dataset
+        self.rng = rng
+        self.allow_export = allow_export
+        self.records: List[Record] = []
+        self.exports: List[str] = []
+
+    def _call(self, name: str, method: str, url: str, **kw) -> Optional[httpx.Response]:
+        t0 = time.perf_counter()
+        try:
+            r = self.client.request(method, url, **kw)
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            r, ok = None, False
+        self.records.append((name, time.perf_counter() - t0, ok))
+        return r if ok else None
+
+    def _sample_path(self) -> Optional[str]:
+        r = self._call("GET /sample", "GET", f"/datasets/{self.dataset}/sample", params={"mode": "random"})
+        return r.json()["path"] if r is not None else None
+
+    def sample_burst(self) -> None:
+        for _ in range(self.rng.randint(3, 6)):
+            self._sample_path()
+
+    def stepwise_chain(self) -> None:
+        path = self._sample_path()
+        if path is None:
+            return
+        for k in range(1, self.rng.randint(3, len(CHAIN)) + 1):
+            self._call("POST /preprocess/apply", "POST", "/preprocess/apply",
+                       json={"dataset_key": self.dataset, "path": path, "ops": CHAIN[:k]})
+
+    def views(self) -> None:
+        self._call("GET /views", "GET", f"/datasets/{self.dataset}/views",
+                   params={"views": ["original", "grayscale", "r", "g", "b", "histogram"]})
+
+    def batch_export(self) -> None:
+        if not self.allow_export:
+            return
+        name = f"{EXPORT_PREFIX}{uuid.uuid4().hex[:8]}"
+        self.exports.append(name)
+        self._call("POST /preprocess/batch_export", "POST", "/preprocess/batch_export", json={
+            "dataset_key": self.dataset,
+            "subset": {"mode": "randomN", "n": 10},
+            "ops": CHAIN[:3],
+            "new_dataset_name": name,
+            "overwrite": True,
+        }, timeout=120)
+
+    def run_until(self, deadline: float, weights: Dict[str, float]) -> None:
+        names = list(weights)
+        w = [weights[n] for n in names]
+        while time.perf_counter() < deadline:
+            getattr(self, self.rng.choices(names, weights=w)[0])()
+
+SCENARIO_WEIGHTS: Dict[str, float] = {
+    "sample_burst": 0.35,
+    "stepwise_chain": 0.45,
+    "views": 0.18,
+    "batch_export": 0.02,
+}
+
+# ------------------------
+# Server management
+# ------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/health/ready", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not become healthy within {timeout}s")
+
+def _rss_tree_kb(pid: int) -> Optional[int]:
+    """Current RSS of pid plus its descendants (Linux /proc only)."""
+    proc = Path("/proc")
+    if not proc.exists():
+        return None
+    children: Dict[int, List[int]] = {}
+    for d in proc.iterdir():
+        if not d.name.isdigit():
+            continue
+        try:
+            stat = (d / "stat").read_text()
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(d.name))
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            for line in (proc / str(p) / "status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+                    break
+        except OSError:
+            pass
+        stack.extend(children.get(p, []))
+    return total
+
+class RssSampler(threading.Thread):
+    """Polls RSS of a process tree and keeps the peak."""
+
+    def __init__(self, pid: int, interval: float = 0.2) -> None:
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb: Optional[int] = None
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.is_set():
+            kb = _rss_tree_kb(self.pid)
+            if kb is not None:
+                self.peak_kb = max(self.peak_kb or 0, kb)
+            self._stop_evt.wait(self.interval)
+
+    def stop(self) -> Optional[int]:
+        self._stop_evt.set()
+        self.join()
+        return self.peak_kb
+
+class LocalServer:
+    """Start the API as a uvicorn subprocess or in a background thread."""
+
+    def __init__(self, mode: str, workers: int = 1) -> None:
+        self.mode = mode
+        self.workers = workers
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.pid = os.getpid()
+        self._proc: Optional[subprocess.Popen] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "LocalServer":
+        if self.mode == "uvicorn":
+            cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+                   "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"]
+            self._proc = subprocess.Popen(cmd, cwd=API_DIR)
+            self.pid = self._proc.pid
+        else:
+            import uvicorn
+            sys.path.insert(0, str(API_DIR))
+            from app.main import app
+            config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+            self._server = uvicorn.Server(config)
+            self._thread = threading.Thread(target=self._server.run, daemon=True)
+            self._thread.start()
+        _wait_ready(self.url)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._proc is not None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=15)
+
+# ------------------------
+# Runner + report
+# ------------------------
+
+@dataclass
+class LevelReport:
+    concurrency: int
+    duration_s: float
+    requests: int
+    errors: int
+    error_rate: float
+    throughput_rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    peak_rss_mb: Optional[float]
+    by_endpoint: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+def _latency_stats(records: List[Record]) -> Dict[str, float]:
+    ms = [s * 1000.0 for _, s, _ in records]
+    return {
+        "n": len(ms),
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "errors": sum(1 for *_, ok in records if not ok),
+    }
+
+def run_level(url: str, dataset: str, concurrency: int, duration: float, seed: int,
+              allow_export: bool, pid: Optional[int]) -> Tuple[LevelReport, List[str]]:
+    sampler = RssSampler(pid) if pid is not None else None
+    if sampler:
+        sampler.start()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    users: List[VirtualUser] = []
+    with httpx.Client(base_url=url, timeout=60.0, limits=limits) as client:
+        users = [VirtualUser(client, dataset, random.Random(seed + i), allow_export) for i in range(concurrency)]
+        deadline = time.perf_counter() + duration
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=u.run_until, args=(deadline, SCENARIO_WEIGHTS)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    peak_kb = sampler.stop() if sampler else None
+
+    records = [r for u in users for r in u.records]
+    stats = _latency_stats(records)
+    by_ep: Dict[str, List[Record]] = {}
+    for rec in records:
+        by_ep.setdefault(rec[0], []).append(rec)
+    report = LevelReport(
+        concurrency=concurrency,
+        duration_s=elapsed,
+        requests=len(records),
+        errors=int(stats["errors"]),
+        error_rate=(stats["errors"] / len(records)) if records else 0.0,
+        throughput_rps=len(records) / elapsed if elapsed > 0 else 0.0,
+        p50_ms=stats["p50_ms"],
+        p95_ms=stats["p95_ms"],
+        p99_ms=stats["p99_ms"],
+        peak_rss_mb=(peak_kb / 1024.0) if peak_kb else None,
+        by_endpoint={name: _latency_stats(recs) for name, recs in sorted(by_ep.items())},
+    )
+    return report, [name for u in users for name in u.exports]
+
+def format_report(reports: List[LevelReport]) -> str:
+    head = f"{'conc':>5} {'reqs':>7} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'err%':>6} {'peakRSS':>9}"
+    lines = [head, "-" * len(head)]
+    for r in reports:
+        rss = f"{r.peak_rss_mb:7.0f}MB" if r.peak_rss_mb is not None else f"{'n/a':>9}"
+        lines.append(
+            f"{r.concurrency:>5} {r.requests:>7} {r.throughput_rps:>8.1f} {r.p50_ms:>9.1f} "
+            f"{r.p95_ms:>9.1f} {r.p99_ms:>9.1f} {r.error_rate * 100:>6.2f} {rss}"
+        )
+    return "\n".join(lines)
+
+def _cleanup_exports(names: List[str]) -> None:
+    from app.services.image_ops import DATASETS_DIR
+    for name in names:
+        shutil.rmtree(DATASETS_DIR / name, ignore_errors=True)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description=__doc__.split("\n\n")[0])
+    p.add_argument("--server", choices=("uvicorn", "inprocess"), default="uvicorn")
+    p.add_argument("--url", help="target an already running server instead of starting one")
+    p.add_argument("--workers", type=int, default=1, help="uvicorn --workers (subprocess mode)")
+    p.add_argument("--dataset", default="recyclables-mini")
+    p.add_argument("--concurrency", default="1,4,16", help="comma list of virtual-user counts")
+    p.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--no-export", action="store_true", help="skip the batch_export scenario")
+    p.add_argument("--json", type=Path, help="write the reports to this file")
+    p.add_argument("--max-error-rate", type=float, default=0.05, help="exit non-zero above this error rate")
+    args = p.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    reports: List[LevelReport] = []
+    exports: List[str] = []
+    # exports are only cleaned up when we own the datasets directory
+    allow_export = not args.no_export and not args.url
+
+    def sweep(url: str, pid: Optional[int]) -> None:
+        for c in levels:
+            print(f"concurrency {c} for {args.duration:.0f}s ...", file=sys.stderr)
+            report, names = run_level(url, args.dataset, c, args.duration, args.seed, allow_export, pid)
+            reports.append(report)
+            exports.extend(names)
+
+    try:
+        if args.url:
+            sweep(args.url.rstrip("/"), None)
+        else:
+            with LocalServer(args.server, args.workers) as server:
+                sweep(server.url, server.pid)
+    finally:
+        if exports:
+            _cleanup_exports(exports)
+
+    label = args.url or f"{args.server}, workers={args.workers if args.server == 'uvicorn' else 1}"
+    print(f"\n{label}")
+    print(format_report(reports))
+    if args.server == "inprocess" and not args.url:
+        print("(in-process RSS includes the load generator itself)")
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps([asdict(r) for r in reports], indent=2), encoding="utf-8")
+    return 1 if any(r.error_rate > args.max_error_rate for r in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
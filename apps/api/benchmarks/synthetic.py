@@ -0,0 +1,41 @@
+from __future__ import annotations
+from typing import Dict
+import io
+
+import numpy as np
+from PIL import Image
+
+# Longest side (px) -> label used in case names
+DEFAULT_SIZES = (256, 1024, 2048)
+
+def make_bgr(side: int, seed: int = 0) -> np.ndarray:
+    """
+    Deterministic 4:3 BGR uint8 test image: colour gradients, hard-edged
+    rectangles (so edge detectors find something) and mild noise.
+    """
+    h, w = max(1, side * 3 // 4), side
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    img = np.empty((h, w, 3), dtype=np.float32)
+    img[..., 0] = 255.0 * xx / max(1, w - 1)
+    img[..., 1] = 255.0 * yy / max(1, h - 1)
+    img[..., 2] = 127.5 + 127.5 * np.sin(xx / 17.0) * np.cos(yy / 23.0)
+    for _ in range(12):
+        x0, y0 = int(rng.integers(0, w)), int(rng.integers(0, h))
+        x1, y1 = min(w, x0 + int(rng.integers(w // 16 + 1, w // 4 + 2))), min(h, y0 + int(rng.integers(h // 16 + 1, h // 4 + 2)))
+        img[y0:y1, x0:x1] = rng.integers(0, 256, size=3)
+    img += rng.normal(0.0, 6.0, size=img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def make_pil(side: int, seed: int = 0) -> Image.Image:
+    return Image.fromarray(np.ascontiguousarray(make_bgr(side, seed)[..., ::-1]))
+
+def encoded(side: int, seed: int = 0) -> Dict[str, bytes]:
+    """The same synthetic image as PNG and JPEG file bytes."""
+    im = make_pil(side, seed)
+    out: Dict[str, bytes] = {}
+    for fmt, kw in (("PNG", {}), ("JPEG", {"quality": 90})):
+        buf = io.BytesIO()
+        im.save(buf, format=fmt, **kw)
+        out[fmt] = buf.getvalue()
+    return out
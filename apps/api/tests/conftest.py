@@ -8,6 +8,20 @@ from fastapi.testclient import TestClient
 from app.main import app
 from app.services.image_ops import DATASETS_DIR
 
+@pytest.fixture(autouse=True)
+def _shared_cache_slab(tmp_path, monkeypatch):
+    """A private shared-cache slab per test (never the host's /dev/shm one)."""
+    from app.core.config import settings
+    from app.services import shared_cache
+
+    monkeypatch.setattr(settings, "SHARED_CACHE_PATH", tmp_path / "shared.slab")
+    # no background hashing outliving a test's CACHE_DIR
+    monkeypatch.setattr(settings, "PHASH_ON_INDEX", False)
+    yield
+    cache = shared_cache._CACHE
+    if cache is not None:
+        cache.close()
+
 @pytest.fixture(scope="session")
 def client():
     return TestClient(app)
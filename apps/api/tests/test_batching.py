@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from app.services.batching import run_batched, segments
+from app.services.image_ops import compile_pipeline, run_compiled
+
+def _frames() -> list:
+    rng = np.random.default_rng(3)
+    shapes = [(60, 80), (60, 80), (45, 70), (60, 80), (30, 30)]
+    return [rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8) for h, w in shapes]
+
+@pytest.mark.parametrize("ops", [
+    [{"type": "resize", "mode": "size", "w": 64, "h": 48},
+     {"type": "brightness_contrast", "b": 15, "c": -20},
+     {"type": "normalize", "mode": "zscore"}],
+    [{"type": "to_grayscale"}, {"type": "normalize", "mode": "minus_one_one"}],
+    [{"type": "pad", "w": 90, "h": 70, "mode": "constant"},
+     {"type": "normalize", "mode": "zero_one"},
+     {"type": "edges", "method": "sobel", "threshold": 60, "overlay": True},
+     {"type": "reset"},
+     {"type": "brightness_contrast", "b": -10, "c": 30}],
+])
+def test_batched_matches_per_image(ops):
+    frames = _frames()
+    steps = compile_pipeline(ops)
+    expected = [run_compiled(f, steps) for f in frames]
+    got = run_batched(frames, steps)
+    assert len(got) == len(expected)
+    for a, b in zip(got, expected):
+        assert a.shape == b.shape
+        assert np.array_equal(a, b)
+
+def test_segments_group_batchable_runs():
+    steps = compile_pipeline([
+        {"type": "resize", "mode": "size", "w": 32, "h": 32},
+        {"type": "brightness_contrast", "b": 1, "c": 1},
+        {"type": "to_grayscale"},
+        {"type": "blur_sharpen", "blur": 1},
+    ])
+    assert [(b, len(run)) for b, run in segments(steps)] == [(False, 1), (True, 2), (False, 1)]
+
+_BUDGET_OPS = [{"type": "resize", "mode": "size", "w": 64, "h": 48}, {"type": "brightness_contrast", "b": 10, "c": 0}]
+
+def _export_batches(monkeypatch, key, gov, cleanup) -> list:
+    """Export four images under `gov`; returns the frame count of each batched run."""
+    from app.services import batching, memory
+    from app.services.image_ops import export_dataset, list_all_images, DATASETS_DIR
+
+    sizes = []
+    real = batching.run_batched
+    monkeypatch.setattr(batching, "run_batched", lambda frames, steps: sizes.append(len(frames)) or real(frames, steps))
+    monkeypatch.setattr(memory, "governor", gov)
+    rels = [str(p.relative_to(DATASETS_DIR / key)) for p in list_all_images(key)[:4]]
+    cleanup("test-batch-budget")
+    res = export_dataset(key, rels, _BUDGET_OPS, "test-batch-budget", overwrite=True)
+    assert res["processed"] == 4
+    return sizes
+
+def test_export_batches_with_budget_disabled(monkeypatch, any_dataset_key, temp_export_cleanup):
+    from app.core.config import settings
+    from app.services.memory import MemoryGovernor
+
+    monkeypatch.setattr(settings, "MEMORY_BUDGET_MB", 0)  # "0 disables"
+    assert sum(_export_batches(monkeypatch, any_dataset_key, MemoryGovernor(0, 1.0), temp_export_cleanup)) == 4
+
+def test_export_flushes_instead_of_waiting_on_a_contended_budget(monkeypatch, any_dataset_key, temp_export_cleanup):
+    from PIL import Image
+    from app.services.image_ops import DATASETS_DIR, compile_pipeline, list_all_images
+    from app.services.memory import MemoryGovernor, estimate_bytes
+
+    steps = compile_pipeline(_BUDGET_OPS)
+    ests = []
+    for p in list_all_images(any_dataset_key)[:4]:
+        with Image.open(p) as im:
+            ests.append(estimate_bytes(im.size, steps, 3))
+    # room for one frame at a time: a batch that waited for a second would time out
+    gov = MemoryGovernor(max(ests) + 1, 0.2)
+    assert _export_batches(monkeypatch, any_dataset_key, gov, temp_export_cleanup) == []
+    assert gov.snapshot()["reserved_bytes"] == 0
+    assert gov.snapshot()["rejected_total"] == 0
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from benchmarks.bench_ops import OP_VARIANTS, all_op_names
+from benchmarks.harness import find_regressions, percentile, summarize
+
+def test_every_op_has_benchmark_variants():
+    """A new op_* function must be added to the benchmark suite."""
+    assert set(all_op_names()) <= set(OP_VARIANTS)
+
+def test_harness_stats_and_regression_gate():
+    samples = [0.001 * i for i in range(1, 101)]  # 1..100 ms
+    r = summarize("case", samples, pixels=1_000_000)
+    assert abs(r.p50_ms - 50.5) < 1e-6
+    assert abs(percentile([1.0, 2.0, 3.0, 4.0], 100) - 4.0) < 1e-9
+    assert r.mpix_per_s and r.mpix_per_s > 0
+
+    baseline = {"case": {"p50_ms": 40.0}, "other": {"p50_ms": 1.0}}
+    assert find_regressions([r], baseline, max_regression=0.5) == []
+    assert len(find_regressions([r], baseline, max_regression=0.1)) == 1
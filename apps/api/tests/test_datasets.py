@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import wait
+
+import numpy as np
+from PIL import Image
+
+from fastapi.testclient import TestClient
+from app.core.config import settings
+from app.services import image_ops, memory
+from app.services.datasets import create_virtual_dataset, get_datasets_index, index_hashes, virtual_frame, virtual_spec
+from app.services.image_ops import DATASETS_DIR
+from app.services.memory import MemoryGovernor
+from app.services.minibatch import batch_order, read_records
+from app.services.phash import ensure_hashes
+
+def _png(color) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (12, 8), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+def _zip(members: dict, compression: int = zipfile.ZIP_STORED) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+def _wait_job(client: TestClient, job_id: str) -> dict:
+    """Poll an upload job until it is done or failed."""
+    for _ in range(200):
+        job = client.get(f"/datasets/uploads/{job_id}").json()
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(job)
+
+def test_multi_view_single_request(client: TestClient, any_dataset_key: str, any_image_rel: str):
+    """
+    Request every view for one path and confirm they all come back
+    in one response, with per-channel histograms of 256 bins.
+    """
+    views = ["original", "grayscale", "r", "g", "b", "histogram", "edges"]
+    resp = client.get(
+        f"/datasets/{any_dataset_key}/views",
+        params={"path": any_image_rel, "views": views, "edges_method": "sobel"},
+    )
+    assert resp.status_code == 200, resp.text
+    data = resp.json()
+    assert data["path"] == any_image_rel
+    assert set(data["views"]) == {"original", "grayscale", "r", "g", "b", "edges"}
+    for url in data["views"].values():
+        assert url.startswith("data:image/png;base64,")
+    hist = data["histogram"]
+    assert set(hist) == {"r", "g", "b"}
+    assert all(len(counts) == 256 for counts in hist.values())
+    # every preview pixel lands in exactly one bin per channel
+    assert sum(hist["r"]) == sum(hist["g"]) == sum(hist["b"]) > 0
+
+def test_multi_view_sample_and_unknown_view(client: TestClient, any_dataset_key: str):
+    """
+    Without a path the endpoint samples like /sample; unknown views are a 400.
+    """
+    resp = client.get(f"/datasets/{any_dataset_key}/views", params={"mode": "index", "index": 0, "views": ["r"]})
+    assert resp.status_code == 200, resp.text
+    data = resp.json()
+    assert data["index_used"] == 0
+    assert data["label"]
+    assert list(data["views"]) == ["r"]
+    assert data["histogram"] is None
+
+    bad = client.get(f"/datasets/{any_dataset_key}/views", params={"views": ["nope"]})
+    assert bad.status_code == 400
+
+def test_duplicates_and_export_skip(client: TestClient, temp_export_cleanup):
+    """
+    A .jpg/.png pair of the same picture (and a slightly brightened copy in
+    another class) is one duplicate group; batch_export can skip it.
+    """
+    key = "pytest-dupes"
+    temp_export_cleanup(key)
+    temp_export_cleanup("pytest-dupes-export")
+    rng = np.random.default_rng(3)
+    for cls in ("a", "b"):
+        (DATASETS_DIR / key / "images" / cls).mkdir(parents=True, exist_ok=True)
+    base = (rng.random((96, 128, 3)) * 255).astype(np.uint8)
+    base = np.asarray(Image.fromarray(base).resize((32, 24)).resize((128, 96), Image.BICUBIC))
+    Image.fromarray(base).save(DATASETS_DIR / key / "images" / "a" / "one.png")
+    Image.fromarray(base).save(DATASETS_DIR / key / "images" / "a" / "one.jpg", quality=85)
+    Image.fromarray(np.clip(base.astype(int) + 12, 0, 255).astype(np.uint8)).save(DATASETS_DIR / key / "images" / "b" / "copy.png")
+    Image.fromarray((rng.random((96, 128, 3)) * 255).astype(np.uint8)).save(DATASETS_DIR / key / "images" / "b" / "other.png")
+
+    try:
+        resp = client.get(f"/datasets/{key}/duplicates", params={"max_distance": 6})
+        assert resp.status_code == 200, resp.text
+        data = resp.json()
+        assert data["images_hashed"] == 4
+        assert len(data["groups"]) == 1
+        group = data["groups"][0]
+        assert sorted(group["paths"]) == ["images/a/one.jpg", "images/a/one.png", "images/b/copy.png"]
+        assert set(group["classes"]) == {"a", "b"}
+
+        resp = client.post("/preprocess/batch_export", json={
+            "dataset_key": key,
+            "subset": {"mode": "all"},
+            "ops": [],
+            "new_dataset_name": "pytest-dupes-export",
+            "skip_duplicates": True,
+            "duplicate_max_distance": 6,
+        })
+        assert resp.status_code == 200, resp.text
+        assert resp.json()["processed"] == 2
+        assert resp.json()["skipped_duplicates"] == 2
+    finally:
+        (settings.CACHE_DIR / "phash" / f"{key}.json").unlink(missing_ok=True)
+
+def test_index_hashes_datasets_with_png_decodes_under_the_governor(temp_export_cleanup, tmp_path, monkeypatch):
+    """The index-time hash pass fills the phash store; PNGs are admitted by the governor."""
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path)
+    gov = MemoryGovernor(2**30, 1.0)
+    monkeypatch.setattr(memory, "governor", gov)
+    key = "pytest-index-hashes"
+    temp_export_cleanup(key)
+    (DATASETS_DIR / key / "images" / "a").mkdir(parents=True)
+    Image.new("RGB", (64, 48), (200, 10, 10)).save(DATASETS_DIR / key / "images" / "a" / "x.png")
+    Image.new("RGB", (64, 48), (10, 200, 10)).save(DATASETS_DIR / key / "images" / "a" / "y.jpg")
+
+    ds = get_datasets_index(force_refresh=True)[key]
+    index_hashes([ds])
+    assert (tmp_path / "phash" / f"{key}.json").exists()
+    assert gov.snapshot()["admitted_total"] == 1  # the PNG; the JPEG decodes at 1/8 via draft
+    assert gov.snapshot()["reserved_bytes"] == 0
+    assert len(ensure_hashes(key, ds.root, [r["path"] for r in ds.rows])) == 2
+
+def test_virtual_dataset_sample_and_materialize(client: TestClient, any_dataset_key: str, temp_export_cleanup):
+    """A virtual dataset costs no pixels on disk until materialized."""
+    vkey, mkey = "pytest-virtual-gray", "pytest-virtual-gray-real"
+    temp_export_cleanup(vkey)
+    temp_export_cleanup(mkey)
+    ops = [{"type": "resize", "mode": "fit", "maxside": 64}, {"type": "to_grayscale"}]
+    resp = client.post("/preprocess/virtual", json={
+        "dataset_key": any_dataset_key,
+        "subset": {"mode": "perClass", "n": 1},
+        "ops": ops,
+        "new_dataset_name": vkey,
+    })
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["image_count"] > 0
+    assert not (DATASETS_DIR / vkey / "images").exists()
+
+    info = client.get(f"/datasets/{vkey}/info").json()
+    assert info["virtual"] is True and info["base_dataset"] == any_dataset_key
+
+    # first index may point at a missing base file (stale index.csv rows)
+    for i in range(5):
+        s = client.get(f"/datasets/{vkey}/sample", params={"mode": "index", "index": i})
+        if s.status_code == 200:
+            break
+    assert s.status_code == 200, s.text
+    views = client.get(f"/datasets/{vkey}/views", params={"path": s.json()["path"], "views": ["original"]}).json()
+    assert max(views["shape"][:2]) == 64
+
+    # a virtual dataset can be a preprocess source too
+    after = client.post("/preprocess/apply", json={"dataset_key": vkey, "path": s.json()["path"], "ops": []})
+    assert after.status_code == 200 and max(after.json()["after_shape"][:2]) == 64
+
+    mat = client.post("/preprocess/materialize", json={"dataset_key": vkey, "new_dataset_name": mkey})
+    assert mat.status_code == 200, mat.text
+    assert mat.json()["processed"] > 0
+    assert (DATASETS_DIR / mkey / "images").exists()
+
+def test_deep_zoom_tiles(client: TestClient, any_dataset_key: str, any_image_rel: str, tmp_path, monkeypatch):
+    """
+    Pyramid info, a full-resolution tile, ETag revalidation, an op plan
+    with its own pyramid, and out-of-range tiles.
+    """
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path)
+    base = f"/datasets/{any_dataset_key}/tiles"
+    params = {"path": any_image_rel, "format": "png"}
+
+    info = client.get(f"{base}/info", params=params)
+    assert info.status_code == 200, info.text
+    info = info.json()
+    top = info["max_level"]
+    assert info["levels"][0]["size"] == [1, 1]
+    assert info["levels"][top]["size"] == [info["width"], info["height"]]
+
+    resp = client.get(f"{base}/{top}/0/0", params=params)
+    assert resp.status_code == 200, resp.text
+    assert resp.headers["content-type"] == "image/png"
+    with Image.open(io.BytesIO(resp.content)) as im:
+        assert im.size == (min(info["width"], info["tile_size"]), min(info["height"], info["tile_size"]))
+    etag = resp.headers["etag"]
+    again = client.get(f"{base}/{top}/0/0", params=params, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    ops = json.dumps([{"type": "edges", "method": "sobel", "threshold": 60}])
+    edged = client.get(f"{base}/{top}/0/0", params={**params, "ops": ops})
+    assert edged.status_code == 200, edged.text
+    assert edged.headers["etag"] != etag
+
+    cols, rows = info["levels"][top]["grid"]
+    assert client.get(f"{base}/{top}/{cols}/0", params=params).status_code == 404
+    assert client.get(f"{base}/{top + 1}/0/0", params=params).status_code == 404
+    assert client.get(f"{base}/0/0/0", params={**params, "ops": "{}"}).status_code == 400
+
+def test_deep_zoom_virtual_dataset_revalidation_and_pruning(
+    client: TestClient, any_dataset_key: str, temp_export_cleanup, tmp_path, monkeypatch,
+):
+    """
+    Virtual datasets tile from their base files, a matching If-None-Match
+    is answered without building anything, and old pyramids are pruned.
+    """
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path)
+    vkey = "pytest-virtual-tiles"
+    temp_export_cleanup(vkey)
+    resp = client.post("/preprocess/virtual", json={
+        "dataset_key": any_dataset_key,
+        "subset": {"mode": "perClass", "n": 2},
+        "ops": [{"type": "resize", "mode": "fit", "maxside": 300}],
+        "new_dataset_name": vkey,
+    })
+    assert resp.status_code == 200, resp.text
+    rels = [r for r in sorted(virtual_spec(vkey).paths) if (DATASETS_DIR / any_dataset_key / r).exists()]
+
+    base = f"/datasets/{vkey}/tiles"
+    info = client.get(f"{base}/info", params={"path": rels[0]})
+    assert info.status_code == 200, info.text
+    assert max(info.json()["width"], info.json()["height"]) == 300
+    tile = client.get(f"{base}/0/0/0", params={"path": rels[0]})
+    assert tile.status_code == 200, tile.text
+
+    shutil.rmtree(tmp_path / "tiles")
+    again = client.get(f"{base}/0/0/0", params={"path": rels[0]}, headers={"If-None-Match": tile.headers["etag"]})
+    assert again.status_code == 304
+    assert not (tmp_path / "tiles").exists()
+
+    # a stale 2 MB pyramid goes once a new build pushes the folder past the cap
+    stale = tmp_path / "tiles" / ("0" * 40)
+    stale.mkdir(parents=True)
+    (stale / "info.json").write_bytes(bytes(2 * 2**20))
+    os.utime(stale, (1, 1))
+    monkeypatch.setattr(settings, "DEEPZOOM_CACHE_MB", 1)
+    assert client.get(f"{base}/0/0/0", params={"path": rels[1]}).status_code == 200
+    assert not stale.exists()
+    assert len(list((tmp_path / "tiles").iterdir())) == 1
+
+def test_archive_upload_ingest(client: TestClient, temp_export_cleanup, tmp_path, monkeypatch):
+    """
+    A zip with two class folders, a non-image, a fake .jpg and a path
+    traversal name becomes a dataset with only the real images.
+    """
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path)
+    key = "pytest-upload"
+    temp_export_cleanup(key)
+
+    body = _zip({
+        "photos/images/cats/a.png": _png("red"),
+        "photos/images/cats/b.png": _png("green"),
+        "photos/images/dogs/a.png": _png("blue"),
+        "photos/images/dogs/broken.jpg": b"not a jpeg",
+        "photos/readme.txt": b"hello",
+        "../../escape/evil.png": _png("white"),
+    })
+
+    resp = client.post("/datasets/upload", files={"file": ("set.zip", body)}, data={"name": key})
+    assert resp.status_code == 202, resp.text
+    job = _wait_job(client, resp.json()["id"])
+    assert job["state"] == "done", job
+    assert job["images"] == 4 and job["skipped"] == 2
+    assert job["classes"] == ["cats", "dogs", "escape"]
+    assert not (DATASETS_DIR.parent / "escape").exists()
+
+    info = client.get(f"/datasets/{key}/info").json()
+    assert info["approx_count"] == {"cats": 2, "dogs": 1, "escape": 1}
+    assert client.get(f"/datasets/{key}/sample", params={"mode": "index", "index": 0}).status_code == 200
+
+    again = client.post("/datasets/upload", files={"file": ("set.zip", body)}, data={"name": key})
+    assert again.status_code == 409
+
+def test_archive_upload_limits_and_raw_body(client: TestClient, temp_export_cleanup, tmp_path, monkeypatch):
+    """
+    A raw-body upload whose renamed duplicate meets a real member keeps all
+    three files; an archive that expands past UPLOAD_MAX_EXTRACTED_MB fails
+    and a body over UPLOAD_MAX_MB is refused from its Content-Length.
+    """
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path)
+
+    def upload(key: str, members: dict):
+        temp_export_cleanup(key)
+        resp = client.post("/datasets/upload", params={"name": key}, content=_zip(members, zipfile.ZIP_DEFLATED),
+                           headers={"content-type": "application/zip"})
+        assert resp.status_code == 202, resp.text
+        return _wait_job(client, resp.json()["id"])
+
+    job = upload("pytest-upload-names", {"c/x.png": _png("red"), "d/c/x.png": _png("green"), "c/x_1.png": _png("blue")})
+    assert job["state"] == "done" and job["images"] == 3, job
+    files = sorted(p.name for p in (DATASETS_DIR / "pytest-upload-names" / "images" / "c").iterdir())
+    assert files == ["x.png", "x_1.png", "x_1_1.png"]
+
+    monkeypatch.setattr(settings, "UPLOAD_MAX_EXTRACTED_MB", 1)
+    job = upload("pytest-upload-bomb", {"c/a.png": bytes(2**19), "c/b.png": bytes(2**19), "c/c.png": bytes(2**19)})
+    assert job["state"] == "failed" and "expands" in job["error"]
+    assert not (DATASETS_DIR / "pytest-upload-bomb").exists()
+
+    monkeypatch.setattr(settings, "UPLOAD_MAX_MB", 1)
+    resp = client.post("/datasets/upload", params={"name": "pytest-upload-big"}, content=bytes(2**20 + 1))
+    assert resp.status_code == 413
+
+def test_minibatch_stream(client: TestClient, any_dataset_key: str):
+    """
+    Seeded, stratified batches of a fixed-size op plan decode as npy
+    tensors; the same seed gives the same order; mixed sizes are refused.
+    """
+    ops = json.dumps([{"type": "resize", "mode": "size", "w": 24, "h": 16}])
+    params = {"batch_size": 8, "order": "stratified", "seed": 3, "ops": ops, "max_batches": 2}
+    resp = client.get(f"/datasets/{any_dataset_key}/batches", params=params)
+    assert resp.status_code == 200, resp.text
+    records = list(read_records(io.BytesIO(resp.content)))
+    final = records[-1][0]
+    assert final["done"] is True and final["batches"] == len(records) - 1 == 2
+    header, x, y = records[0]
+    assert x.shape == (8, 16, 24, 3) and x.dtype.name == "uint8"
+    assert y.shape == (8,) and set(y.tolist()) <= set(range(len(header["classes"])))
+    # stratified: the first batch already spans every class
+    assert len(set(y.tolist())) == len(header["classes"])
+
+    again = list(read_records(io.BytesIO(client.get(f"/datasets/{any_dataset_key}/batches", params=params).content)))
+    assert [h["paths"] for h, _, _ in again[:-1]] == [h["paths"] for h, _, _ in records[:-1]]
+
+    labels = [i % 3 for i in range(30)]
+    assert batch_order(labels, "shuffle", 1, 0) == batch_order(labels, "shuffle", 1, 0)
+    assert batch_order(labels, "shuffle", 1, 0) != batch_order(labels, "shuffle", 1, 1)
+    assert sorted(batch_order(labels, "stratified", 1, 0)) == list(range(30))
+    mixed = client.get(f"/datasets/{any_dataset_key}/batches", params={"batch_size": 4, "order": "sequential", "max_batches": 1})
+    # the mismatch shows up mid-stream: a 200 whose last record is the error
+    assert mixed.status_code == 200
+    final = list(read_records(io.BytesIO(mixed.content)))[-1][0]
+    assert "differ in shape" in final["error"] and final["batches"] == 0
+
+
+def test_minibatch_stream_bounds_work_and_reports_a_busy_budget(client: TestClient, any_dataset_key: str, monkeypatch):
+    """
+    At most two frames per worker are queued at once, and a busy memory
+    budget ends the stream with an "error" record instead of skipping rows.
+    """
+    pending, peak = set(), []
+    real = image_ops.submit_work
+
+    def counted(fn, *args):
+        fut = real(fn, *args)
+        pending.add(fut)
+        peak.append(len({f for f in pending if not f.done()}))
+        fut.add_done_callback(pending.discard)
+        return fut
+
+    monkeypatch.setattr(image_ops, "submit_work", counted)
+    ops = json.dumps([{"type": "resize", "mode": "size", "w": 24, "h": 16}])
+    params = {"batch_size": 64, "ops": ops, "max_batches": 1}
+    resp = client.get(f"/datasets/{any_dataset_key}/batches", params=params)
+    assert list(read_records(io.BytesIO(resp.content)))[-1][0]["done"] is True
+    assert 0 < max(peak) <= 2 * image_ops.worker_count() + 1  # + the frame being collected
+    wait(list(pending))  # reservations are taken and returned on the governor in place
+
+    gov = MemoryGovernor(1000, 0.05)
+    gov.acquire(1000)  # another request holds the whole budget
+    monkeypatch.setattr(memory, "governor", gov)
+    resp = client.get(f"/datasets/{any_dataset_key}/batches", params=params)
+    final = list(read_records(io.BytesIO(resp.content)))[-1][0]
+    assert "Server is busy" in final["error"] and final["skipped"] == 0
+    wait(list(pending))
+    gov.release(1000)
+    assert gov.snapshot()["reserved_bytes"] == 0
+
+def test_virtual_frame_follows_base_file_edits(temp_export_cleanup):
+    """An edited base image is recomputed, not served from the frame LRU."""
+    base, vkey = "pytest-vbase", "pytest-vbase-virtual"
+    temp_export_cleanup(base)
+    temp_export_cleanup(vkey)
+    img = DATASETS_DIR / base / "images" / "c" / "x.png"
+    img.parent.mkdir(parents=True)
+    Image.new("RGB", (16, 16), (10, 10, 10)).save(img)
+    get_datasets_index(force_refresh=True)
+    create_virtual_dataset(name=vkey, base_dataset=base, rel_paths=["images/c/x.png"], ops=[{"type": "reset"}])
+
+    assert virtual_frame(vkey, "images/c/x.png")[0, 0, 0] == 10
+    Image.new("RGB", (16, 16), (200, 200, 200)).save(img)
+    os.utime(img, ns=(0, img.stat().st_mtime_ns + 10**9))
+    assert virtual_frame(vkey, "images/c/x.png")[0, 0, 0] == 200
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+
+from app.core import responses
+from app.core.responses import json_bytes
+from app.services.encoding import data_url_json, encode, to_data_url
+from app.services.image_ops import DATASETS_DIR
+
+@pytest.mark.parametrize("backend", ["cv2", "pil"])
+@pytest.mark.parametrize("fmt,preset", [("PNG", "preview"), ("PNG", "export_small"), ("WEBP", "export_lossless")])
+def test_lossless_round_trip(backend, fmt, preset):
+    """Both backends agree on channel order and lossless presets keep pixels."""
+    rgb = np.random.default_rng(0).integers(0, 256, size=(37, 53, 3), dtype=np.uint8)
+    data, mime = encode(Image.fromarray(rgb), fmt, preset, backend)
+    assert mime == f"image/{fmt.lower()}"
+    with Image.open(io.BytesIO(data)) as im:
+        assert im.format == fmt
+        assert np.array_equal(np.asarray(im.convert("RGB")), rgb)
+
+def test_array_input_is_bgr_and_data_url():
+    bgr = np.zeros((8, 8, 3), dtype=np.uint8)
+    bgr[..., 0] = 255  # blue
+    url = to_data_url(bgr, "PNG")
+    assert url.startswith("data:image/png;base64,")
+    data, _ = encode(bgr, "PNG", "preview", "cv2")
+    with Image.open(io.BytesIO(data)) as im:
+        assert im.convert("RGB").getpixel((0, 0)) == (0, 0, 255)
+
+def test_batch_export_output_format(client: TestClient, any_dataset_key: str, temp_export_cleanup):
+    new_name = "pytest-encode-webp"
+    temp_export_cleanup(new_name)
+    payload = {
+        "dataset_key": any_dataset_key,
+        "subset": {"mode": "firstN", "n": 3, "shuffle": False},
+        "ops": [{"type": "resize", "mode": "fit", "maxside": 64}],
+        "new_dataset_name": new_name,
+        "output_format": "webp",
+        "encode_preset": "export_small",
+    }
+    resp = client.post("/preprocess/batch_export", json=payload)
+    assert resp.status_code == 200, resp.text
+    out_dir = DATASETS_DIR / new_name
+    files = [p for p in (out_dir / "images").rglob("*") if p.is_file()]
+    assert files and all(p.suffix == ".webp" for p in files)
+    meta = json.loads((out_dir / "metadata.json").read_text(encoding="utf-8"))
+    assert meta["format"] == "webp" and meta["encode_preset"] == "export_small"
+
+    bad = client.post("/preprocess/batch_export", json={**payload, "output_format": "gif", "overwrite": True})
+    assert bad.status_code == 422
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_raw_json_data_urls(fast, monkeypatch):
+    """RawJSON data URLs serialize to the same JSON as str ones, with or without orjson."""
+    if not fast:
+        monkeypatch.setattr(responses, "orjson", None)
+    arr = np.random.default_rng(2).integers(0, 256, size=(20, 30, 3), dtype=np.uint8)
+    body = json_bytes({"path": "\x00raw0\x00", "a": data_url_json(arr, "PNG"), "n": [1, data_url_json(arr, "JPEG")]})
+    data = json.loads(body)
+    assert data == {"path": "\x00raw0\x00", "a": to_data_url(arr, "PNG"), "n": [1, to_data_url(arr, "JPEG")]}
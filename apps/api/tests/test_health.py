@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app.services.datasets import get_datasets_index
+
+def test_liveness_and_readiness(client: TestClient):
+    resp = client.get("/health")
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "ok"
+    assert "ready" in resp.json()
+
+    get_datasets_index()
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200
+    assert ready.json()["ready"] is True
+
+def test_app_import_does_not_load_opencv_or_numpy():
+    """cv2/numpy are deferred until the first op needs them (cold start)."""
+    code = "import sys, app.main; print('cv2' in sys.modules, 'numpy' in sys.modules)"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).resolve().parents[1], capture_output=True, text=True, check=True,
+    )
+    assert out.stdout.split() == ["False", "False"]
+
+def test_readiness_reports_and_retries_failed_warmup(client: TestClient, monkeypatch):
+    """A failing warm-up build is reported by /health/ready and retried."""
+    import threading
+    import time
+
+    from app.services import datasets
+
+    real = datasets.discover_datasets
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("datasets volume not mounted")
+        return real()
+
+    monkeypatch.setattr(datasets, "discover_datasets", flaky)
+    monkeypatch.setattr(datasets, "_INDEX_READY", threading.Event())
+    monkeypatch.setattr(datasets, "_INDEX_ERROR", None)
+    t = datasets.warm_datasets_index()
+
+    deadline = time.time() + 5
+    while datasets.datasets_index_error() is None and not datasets.datasets_index_ready() and time.time() < deadline:
+        time.sleep(0.01)
+    resp = client.get("/health/ready")
+    assert resp.status_code == 503
+    assert resp.json()["status"] == "error" and "not mounted" in resp.json()["detail"]
+
+    t.join(timeout=5)
+    assert client.get("/health/ready").status_code == 200
+    assert len(calls) == 2
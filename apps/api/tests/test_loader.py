@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.services import loader, memory
+from app.services.image_ops import compile_pipeline, run_compiled
+from app.services.memory import admit_file
+
+def _open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+@pytest.fixture
+def png_path(tmp_path):
+    rgb = np.random.default_rng(1).integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+    path = tmp_path / "x.png"
+    Image.fromarray(rgb).save(path)
+    return path, rgb
+
+def test_load_is_read_only_bgr(png_path):
+    path, rgb = png_path
+    arr = loader.load_bgr(path)
+    assert not arr.flags.writeable
+    assert np.array_equal(arr[..., ::-1], rgb)
+
+    # every op accepts the read-only frame without copying it first
+    steps = compile_pipeline([
+        {"type": "blur_sharpen", "blur": 0, "sharp": 0},
+        {"type": "normalize", "mode": "zscore"},
+        {"type": "reset"},
+        {"type": "edges", "method": "sobel", "threshold": 80, "overlay": True},
+    ])
+    run_compiled(arr, steps)
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_no_fds_left_open(png_path):
+    path, _ = png_path
+    # the shared cache keeps its slab, mapping and lock fds for the process lifetime
+    with admit_file(path, []):
+        pass
+    before = _open_fds()
+    for _ in range(50):
+        with admit_file(path, []) as arr:
+            assert arr.shape == (48, 64, 3)
+        with loader.open_pil(path) as im:
+            im.load()
+        assert im.size == (64, 48)
+    assert _open_fds() == before
+
+def test_oversize_jpeg_uses_reduced_decode(tmp_path, monkeypatch):
+    path = tmp_path / "big.jpg"
+    Image.new("RGB", (800, 600), (10, 20, 30)).save(path, quality=90)
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 100 * 75)
+    with admit_file(path, []) as arr:
+        assert arr.shape[0] * arr.shape[1] <= 100 * 75
+        assert not arr.flags.writeable
+    assert memory.governor.snapshot()["reserved_bytes"] == 0
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.services import memory
+from app.services.image_ops import compile_pipeline, infer_output_shape, run_compiled
+from app.services.memory import MemoryBudgetExceeded, MemoryGovernor, admit, estimate_bytes
+
+@pytest.mark.parametrize("ops", [
+    [{"type": "resize", "mode": "size", "w": 100, "h": 40, "keep": "TRUE"}, {"type": "pad", "w": 120, "h": 120, "mode": "edge"}],
+    [{"type": "resize", "mode": "fit", "maxside": 77}, {"type": "crop_center", "w": 50, "h": 500}],
+    [{"type": "resize", "mode": "scale", "pct": 33}, {"type": "reset"}, {"type": "pad", "w": 10, "h": 10, "mode": "reflect"}],
+    [{"type": "crop_center", "w": 64, "h": 64}, {"type": "pad", "w": 96, "h": 80, "mode": "other"}],
+])
+def test_infer_output_shape_matches_execution(ops):
+    img = np.zeros((123, 181, 3), dtype=np.uint8)
+    steps = compile_pipeline(ops)
+    assert infer_output_shape(steps, img.shape[:2]) == run_compiled(img, steps).shape
+
+def test_estimate_grows_with_pixels_and_ops():
+    none = compile_pipeline([])
+    heavy = compile_pipeline([{"type": "edges", "method": "sobel"}, {"type": "normalize", "mode": "zscore"}])
+    assert estimate_bytes((200, 100), none) < estimate_bytes((400, 200), none)
+    assert estimate_bytes((400, 200), none) < estimate_bytes((400, 200), heavy)
+
+def test_governor_waits_then_times_out():
+    gov = MemoryGovernor(budget_bytes=100, wait_timeout=0.05)
+    gov.acquire(80)
+    with pytest.raises(MemoryBudgetExceeded) as exc:
+        gov.acquire(30)
+    assert exc.value.status_code == 503
+
+    # a waiter is admitted as soon as budget is released
+    done = threading.Event()
+    def waiter():
+        with gov.reserve(30, timeout=5):
+            done.set()
+    t = threading.Thread(target=waiter)
+    t.start()
+    gov.release(80)
+    t.join(5)
+    assert done.is_set()
+    assert gov.snapshot()["reserved_bytes"] == 0
+
+def test_admit_downscales_or_rejects_oversize(monkeypatch, tmp_path):
+    path = tmp_path / "big.png"
+    Image.new("RGB", (800, 600), (10, 20, 30)).save(path)
+    steps = compile_pipeline([{"type": "to_grayscale"}])
+    budget = estimate_bytes((200, 150), steps) + 800 * 600 * 3
+    monkeypatch.setattr(memory, "governor", MemoryGovernor(budget, 1.0))
+
+    monkeypatch.setattr(settings, "MEMORY_OVERSIZE_POLICY", "downscale")
+    with Image.open(path) as src, admit(src, steps) as im:
+        assert im.width < 800 and im.width / im.height == pytest.approx(800 / 600, rel=0.02)
+        assert memory.governor.snapshot()["reserved_bytes"] > 0
+    assert memory.governor.snapshot()["downscaled_total"] == 1
+
+    monkeypatch.setattr(settings, "MEMORY_OVERSIZE_POLICY", "reject")
+    with pytest.raises(MemoryBudgetExceeded) as exc:
+        with Image.open(path) as src, admit(src, steps):
+            pass
+    assert exc.value.status_code == 413
+
+def test_memory_usage_endpoint(client):
+    data = client.get("/health/memory").json()
+    assert data["budget_bytes"] == settings.MEMORY_BUDGET_MB * 2**20
+    assert data["reserved_bytes"] >= 0
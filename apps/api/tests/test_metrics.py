@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+
+def test_server_timing_header_and_metrics_endpoint(client: TestClient, any_dataset_key: str, any_image_rel: str):
+    payload = {
+        "dataset_key": any_dataset_key,
+        "path": any_image_rel,
+        "ops": [{"type": "blur_sharpen", "blur": 1, "sharp": 0}, {"type": "to_grayscale"}],
+    }
+    resp = client.post("/preprocess/apply", json=payload)
+    assert resp.status_code == 200, resp.text
+    timing = resp.headers["server-timing"]
+    for name in ("read", "decode", "op.blur_sharpen", "op.to_grayscale", "encode", "base64", "json", "app"):
+        assert f"{name};dur=" in timing
+
+    text = client.get("/metrics").text
+    assert 'visionblocks_op_seconds_count{op="blur_sharpen"}' in text
+    assert 'visionblocks_stage_seconds_bucket{stage="decode",le="+Inf"}' in text
+    assert 'visionblocks_http_request_seconds_count{method="POST",route="/preprocess/apply",status="200"}' in text
+    assert 'visionblocks_queue_depth{queue="image_ops"}' in text
+
+def test_metrics_disabled_adds_no_header(client: TestClient):
+    metrics.set_enabled(False)
+    try:
+        resp = client.get("/health")
+        assert resp.status_code == 200
+        assert "server-timing" not in resp.headers
+    finally:
+        metrics.set_enabled(True)
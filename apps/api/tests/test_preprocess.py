@@ -1,10 +1,20 @@
 from __future__ import annotations
 
+import base64
+import io
 import json
 from typing import Dict, Any
 
+import pytest
+from PIL import Image
+
 from fastapi.testclient import TestClient
-from app.services.image_ops import DATASETS_DIR
+from app.core.config import settings
+from app.routes import preprocess
+from app.services import cost_model, live_preview
+from app.services.image_ops import DATASETS_DIR, export_dataset
+from app.services.live_preview import PreviewSession
+from app.services.memory import MemoryBudgetExceeded, MemoryGovernor
 
 def test_preprocess_apply_basic(client: TestClient, any_dataset_key: str, any_image_rel: str):
     """
@@ -53,6 +63,18 @@ def test_preprocess_apply_edges_normalize(client: TestClient, any_dataset_key: s
     assert c == 3
     assert h > 0 and w > 0
 
+def test_preprocess_apply_echoes_each_requests_path(client: TestClient, any_dataset_key: str, any_image_rel: str):
+    """Two spellings of one file share the pixels but not each other's echoed path."""
+    cls = any_image_rel.split("/")[1]
+    alias = any_image_rel.replace(f"/{cls}/", f"/{cls}/../{cls}/", 1)
+    ops = [{"type": "resize", "mode": "fit", "maxside": 64}]
+    first = client.post("/preprocess/apply", json={"dataset_key": any_dataset_key, "path": any_image_rel, "ops": ops})
+    second = client.post("/preprocess/apply", json={"dataset_key": any_dataset_key, "path": alias, "ops": ops})
+    assert first.status_code == 200 and second.status_code == 200, second.text
+    assert first.json()["path"] == any_image_rel
+    assert second.json()["path"] == alias
+    assert second.json()["after_data_url"] == first.json()["after_data_url"]
+
 def test_batch_export_conflict_and_overwrite(
     client: TestClient,
     any_dataset_key: str,
@@ -104,3 +126,221 @@ def test_batch_export_conflict_and_overwrite(
     assert resp3.status_code == 200, resp3.text
     data3 = resp3.json()
     assert data3["new_dataset_key"] == new_name
+
+def test_batch_apply_grid_and_stream(client: TestClient, any_dataset_key: str):
+    """
+    Preview one pipeline over a per-class selection, buffered and as NDJSON.
+    """
+    payload = {
+        "dataset_key": any_dataset_key,
+        "subset": {"mode": "perClass", "n": 2},
+        "ops": [
+            {"type": "resize", "mode": "fit", "maxside": 200},
+            {"type": "to_grayscale"},
+        ],
+        "max_side": 64,
+    }
+    resp = client.post("/preprocess/batch_apply", json=payload)
+    assert resp.status_code == 200, resp.text
+    items = resp.json()["items"]
+    classes = {it["path"].split("/")[1] for it in items}
+    assert len(items) == 2 * len(classes)
+    for it in items:
+        assert it["error"] is None
+        assert it["after_data_url"].startswith("data:image/")
+        assert max(it["after_shape"][:2]) == 200
+
+    stream = client.post("/preprocess/batch_apply", json={**payload, "stream": True})
+    assert stream.status_code == 200, stream.text
+    lines = [json.loads(line) for line in stream.text.splitlines() if line]
+    assert sorted(it["path"] for it in lines) == sorted(it["path"] for it in items)
+
+def test_live_preview_session_recomputes_changed_tail(client: TestClient, any_dataset_key: str, any_image_rel: str):
+    """Edits recompute from the first changed step; a newer edit wins."""
+    def until(ws, kind):
+        msgs = []
+        while True:
+            m = ws.receive_json()
+            msgs.append(m)
+            if m["type"] in (kind, "error"):
+                return msgs
+
+    with client.websocket_connect("/preprocess/session") as ws:
+        ws.send_json({"type": "open", "dataset_key": any_dataset_key, "path": any_image_rel, "max_side": 64})
+        ready = ws.receive_json()
+        assert ready["type"] == "ready", ready
+        assert ready["before_data_url"].startswith("data:image/")
+
+        ops = [{"type": "resize", "mode": "fit", "maxside": 96}, {"type": "to_grayscale"}]
+        ws.send_json({"type": "ops", "rev": 1, "ops": ops})
+        msgs = until(ws, "done")
+        assert msgs[0] == {"type": "accepted", "rev": 1, "from_step": 0, "steps": 2}
+        assert [m["index"] for m in msgs if m["type"] == "step"] == [0, 1]
+        assert max(msgs[-1]["after_shape"][:2]) == 96
+
+        # change only the last step: step 0 is reused
+        ws.send_json({"type": "splice", "rev": 2, "start": 1, "delete": 1, "insert": [{"type": "crop_center", "w": 32, "h": 32}]})
+        msgs = until(ws, "done")
+        assert msgs[0]["from_step"] == 1
+        assert [m["index"] for m in msgs if m["type"] == "step"] == [1]
+        assert msgs[-1]["after_shape"] == [32, 32, 3]
+
+        # bad op: rejected, previous state kept
+        ws.send_json({"type": "ops", "rev": 3, "ops": [{"type": "crop_center", "w": "wide", "h": 8}]})
+        assert ws.receive_json()["type"] == "error"
+
+        # back-to-back edits: the last one always completes
+        ws.send_json({"type": "ops", "rev": 4, "ops": [{"type": "blur_sharpen", "blur": 3, "sharp": 0}]})
+        ws.send_json({"type": "ops", "rev": 5, "ops": [{"type": "blur_sharpen", "blur": 1, "sharp": 0}]})
+        last = None
+        while last is None or last.get("rev") != 5 or last["type"] != "done":
+            last = ws.receive_json()
+        assert last["steps"] == 1
+
+def test_live_preview_session_holds_its_kept_frames(client: TestClient, any_dataset_key: str, any_image_rel: str, monkeypatch):
+    """Kept frames stay reserved until trimmed or the socket closes; an original over the budget is refused."""
+    gov = MemoryGovernor(2**30, 1.0)
+    monkeypatch.setattr(live_preview, "governor", gov)
+
+    session = PreviewSession(any_dataset_key, any_image_rel)
+    assert gov.reserved == session.original.nbytes
+    generation, _ = session.set_ops([{"type": "resize", "mode": "fit", "maxside": 64}, {"type": "to_grayscale"}])
+    for i in range(2):
+        session.compute_step(generation, i)
+    assert gov.reserved == session.original.nbytes + sum(r.nbytes for r in session.results)
+    session.set_ops([{"type": "resize", "mode": "fit", "maxside": 64}])  # trims step 1
+    assert gov.reserved == session.original.nbytes + session.results[0].nbytes
+    session.close()
+    session.close()
+    assert (gov.reserved, gov.active) == (0, 0)
+
+    with client.websocket_connect("/preprocess/session") as ws:
+        ws.send_json({"type": "open", "dataset_key": any_dataset_key, "path": any_image_rel})
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "ops", "rev": 1, "ops": [{"type": "to_grayscale"}]})
+        while ws.receive_json()["type"] != "done":
+            pass
+        assert gov.reserved > 0
+    assert (gov.reserved, gov.active) == (0, 0)
+
+    gov.budget = 1024
+    with pytest.raises(MemoryBudgetExceeded) as e:
+        PreviewSession(any_dataset_key, any_image_rel)
+    assert e.value.status_code == 413
+    assert gov.reserved == 0
+
+def test_batch_export_dry_run(client: TestClient, any_dataset_key: str, temp_export_cleanup, monkeypatch):
+    """
+    dry_run prices the plan from headers without writing anything; the
+    estimate tracks the real export, and configured limits refuse it.
+    """
+    new_name = "pytest-dry-run"
+    temp_export_cleanup(new_name)
+    payload = {
+        "dataset_key": any_dataset_key,
+        "subset": {"mode": "firstN", "n": 6, "shuffle": False},
+        "ops": [{"type": "resize", "mode": "size", "w": 160, "h": 120}, {"type": "blur_sharpen", "blur": 1.5}],
+        "new_dataset_name": new_name,
+        "output_format": "png",
+        "dry_run": True,
+    }
+    resp = client.post("/preprocess/batch_export", json=payload)
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    est = body["estimate"]
+    assert body["processed"] == 0 and not (DATASETS_DIR / new_name).exists()
+    assert est["largest_output"] == [160, 120]
+    assert est["raw_bytes"] == est["images"] * 160 * 120 * 3
+    assert est["seconds"] > 0 and {"decode", "resize", "blur_sharpen", "encode"} <= set(est["seconds_by_stage"])
+    assert est["exceeds"] == []
+
+    real = client.post("/preprocess/batch_export", json={**payload, "dry_run": False})
+    assert real.status_code == 200, real.text
+    written = sum(p.stat().st_size for p in (DATASETS_DIR / new_name / "images").rglob("*.png"))
+    assert real.json()["processed"] == est["images"]
+    assert written / 4 < est["output_bytes"] < written * 4
+
+    monkeypatch.setattr(settings, "EXPORT_MAX_OUTPUT_MB", 1)
+    big = {**payload, "ops": [{"type": "resize", "mode": "size", "w": 4000, "h": 4000}], "overwrite": True}
+    assert client.post("/preprocess/batch_export", json=big).json()["estimate"]["exceeds"]
+    refused = client.post("/preprocess/batch_export", json={**big, "dry_run": False})
+    assert refused.status_code == 413, refused.text
+
+def test_cost_model_calibrates_per_op_type_and_never_inline_for_real_exports(
+    client: TestClient, any_dataset_key: str, temp_export_cleanup, tmp_path, monkeypatch,
+):
+    """
+    A huge resize is priced from its inferred size, not run; parameters
+    never add table entries; real exports skip the estimate unless a MAX
+    limit is set, and then calibrate in the background.
+    """
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path)
+    cost_model.reset()
+    rels = preprocess._select_rel_paths(any_dataset_key, preprocess.LoopSubset(mode="firstN", n=2))
+    small = [{"type": "resize", "mode": "size", "w": 160, "h": 120}]
+    huge = [{"type": "resize", "mode": "size", "w": 12000, "h": 12000}]
+
+    # not measured yet: the estimate says so, and time limits wait for it
+    quick = cost_model.estimate_export(any_dataset_key, rels, small, measure=False)
+    assert quick["calibrated"] is False
+    cost_model._background.join(30)
+    assert "op:resize" in cost_model.snapshot()
+
+    a = cost_model.estimate_export(any_dataset_key, rels, small)
+    keys = set(cost_model.snapshot())
+    b = cost_model.estimate_export(any_dataset_key, rels, huge)
+    assert set(cost_model.snapshot()) == keys and a["calibrated"] and b["calibrated"]
+    # charged per output pixel (the larger side of the step)
+    per_px = cost_model.snapshot()["op:resize"]
+    assert b["seconds_by_stage"]["resize"] == pytest.approx(per_px * 12000 * 12000 * b["images"], rel=0.01)
+
+    def no_estimate(*args, **kwargs):
+        raise AssertionError("real export ran the estimate")
+
+    monkeypatch.setattr(preprocess, "estimate_export", no_estimate)
+    new_name = "pytest-no-estimate"
+    temp_export_cleanup(new_name)
+    resp = client.post("/preprocess/batch_export", json={
+        "dataset_key": any_dataset_key,
+        "subset": {"mode": "firstN", "n": 2, "shuffle": False},
+        "ops": small,
+        "new_dataset_name": new_name,
+    })
+    assert resp.status_code == 200, resp.text
+    cost_model.reset()
+
+def test_export_forced_format_keeps_same_stem_files(temp_export_cleanup):
+    """a.jpg and a.png both exported as PNG must not overwrite each other."""
+    src, dst = "pytest-stem-src", "pytest-stem-dst"
+    temp_export_cleanup(src)
+    temp_export_cleanup(dst)
+    cls_dir = DATASETS_DIR / src / "images" / "c"
+    cls_dir.mkdir(parents=True)
+    Image.new("RGB", (8, 8), (255, 0, 0)).save(cls_dir / "a.jpg")
+    Image.new("RGB", (8, 8), (0, 0, 255)).save(cls_dir / "a.png")
+    Image.new("RGB", (8, 8), (0, 255, 0)).save(cls_dir / "a_jpg.png")
+
+    result = export_dataset(src, ["images/c/a.jpg", "images/c/a.png", "images/c/a_jpg.png"], [], dst, output_format="png")
+    names = sorted(p.name for p in (DATASETS_DIR / dst / "images" / "c").iterdir())
+    assert result["processed"] == 3
+    assert len(names) == 3 and "a.png" in names
+
+def test_live_preview_session_rejects_malformed_messages(client: TestClient, any_dataset_key: str, any_image_rel: str):
+    """Bad JSON, non-objects and bad fields get an error; the socket stays usable."""
+    with client.websocket_connect("/preprocess/session") as ws:
+        ws.send_text("{not json")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json([1, 2])
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"type": "open", "dataset_key": any_dataset_key, "path": any_image_rel, "max_side": "big"})
+        assert ws.receive_json()["status"] == 400
+
+        # huge max_side is clamped like batch_apply's
+        ws.send_json({"type": "open", "dataset_key": any_dataset_key, "path": any_image_rel, "max_side": 10**6})
+        ready = ws.receive_json()
+        assert ready["type"] == "ready", ready
+        preview = Image.open(io.BytesIO(base64.b64decode(ready["before_data_url"].split(",", 1)[1])))
+        assert max(preview.size) == min(1024, max(ready["shape"][:2]))
+
+        ws.send_json({"type": "ops", "rev": 1, "ops": "resize"})
+        assert ws.receive_json() == {"type": "error", "rev": 1, "status": 400, "detail": "ops must be a list of objects."}
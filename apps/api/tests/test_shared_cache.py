@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.services import shared_cache
+from app.services.memory import admit_file
+from app.services.shared_cache import SharedCache
+
+pytestmark = pytest.mark.skipif(shared_cache.fcntl is None, reason="shared tier needs fcntl")
+
+def test_put_get_and_fifo_eviction(tmp_path):
+    cache = SharedCache(tmp_path / "s.slab", capacity=4096, slots=16)
+    assert cache.get("a") is None
+    assert cache.put("a", b"x" * 1000)
+    assert cache.get("a") == b"x" * 1000
+
+    # a second handle on the same file (another worker) sees the entry
+    other = SharedCache(tmp_path / "s.slab", capacity=4096, slots=16)
+    assert other.get("a") == b"x" * 1000
+
+    # over a quarter of the slab is refused; later writes evict the oldest
+    assert not cache.put("big", b"y" * 2000)
+    for i in range(5):
+        other.put(f"k{i}", bytes([i]) * 1000)
+    assert cache.get("a") is None
+    assert cache.get("k4") == bytes([4]) * 1000
+    assert cache.stats()["entries"] <= 4
+
+def test_frame_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SHARED_CACHE_PATH", tmp_path / "f.slab")
+    monkeypatch.setattr(settings, "SHARED_CACHE_MB", 1)
+    frame = np.random.default_rng(0).integers(0, 256, size=(20, 30, 3), dtype=np.uint8)
+    shared_cache.put_frame("img", frame)
+    got = shared_cache.get_frame("img")
+    assert got is not None and np.array_equal(got, frame)
+    assert not got.flags.writeable
+
+def test_fingerprint_mismatch_never_truncates_an_attached_slab(tmp_path):
+    path = tmp_path / "fp.slab"
+    old = SharedCache(path, capacity=4096, slots=16, fingerprint=1)
+    assert old.put("a", b"x" * 100)
+
+    # another build while the old one is attached: no tier, old data intact
+    new = SharedCache(path, capacity=4096, slots=16, fingerprint=2)
+    with pytest.raises(shared_cache.SlabBusy):
+        new.get("a")
+    assert old.get("a") == b"x" * 100
+
+    # once the old build detaches the slab is re-created for the new one
+    old.close()
+    new._busy_until = 0.0
+    assert new.get("a") is None
+    assert new.put("b", b"y")
+    new.close()
+    assert not path.exists()
+
+def test_only_shared_decodes_enter_the_slab(tmp_path):
+    path = tmp_path / "x.png"
+    Image.new("RGB", (40, 30), (1, 2, 3)).save(path)
+    key = shared_cache.file_key(path)
+    with admit_file(path, []):  # bulk pass: decode only
+        pass
+    assert shared_cache.get_frame(key) is None
+    with admit_file(path, [], share=True):
+        pass
+    assert shared_cache.get_frame(key).shape == (30, 40, 3)
+
+def test_concurrent_first_attach_shares_one_slab(tmp_path):
+    path = tmp_path / "new.slab"
+    # another worker is mid-attach (holds its shared lock-file flock)
+    other = os.open(path.with_name("new.slab.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    shared_cache.fcntl.flock(other, shared_cache.fcntl.LOCK_SH)
+    try:
+        caches = [SharedCache(path, capacity=4096, slots=16, fingerprint=7) for _ in range(4)]
+        with ThreadPoolExecutor(4) as pool:
+            assert all(pool.map(lambda c: c.put(f"k{id(c)}", b"v"), caches))
+        assert all(caches[0].get(f"k{id(c)}") == b"v" for c in caches)
+        for c in caches:
+            c.close()
+    finally:
+        os.close(other)
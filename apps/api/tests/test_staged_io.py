@@ -0,0 +1,56 @@
+from __future__ import annotations
+import threading
+import time
+
+import pytest
+
+from app.services.staged_io import WriteBehind, read_ahead, staged_map
+
+def test_read_ahead_order_errors_and_early_close():
+    seen = []
+
+    def read(i: int) -> int:
+        seen.append(i)
+        if i == 5:
+            raise OSError("gone")
+        return i * 10
+
+    it = read_ahead(range(8), read, depth=2)
+    assert [next(it) for _ in range(3)] == [(0, 0), (1, 10), (2, 20)]
+    with pytest.raises(OSError):
+        for _ in it:
+            pass
+    # stopped after the failure: no reads far beyond the queue depth
+    assert max(seen) <= 5 + 3
+
+    # closing early stops the reader thread
+    it = read_ahead(range(10_000), lambda i: i, depth=4)
+    next(it)
+    it.close()
+    assert not any(t.name == "read-ahead" for t in threading.enumerate())
+
+def test_stages_overlap():
+    # 10 reads and 10 computes of 20 ms each: ~0.2 s staged vs ~0.4 s serial
+    def read(i: int) -> int:
+        time.sleep(0.02)
+        return i
+
+    def work(i: int, data: int) -> int:
+        time.sleep(0.02)
+        return data * 2
+
+    t0 = time.perf_counter()
+    assert list(staged_map(work, range(10), read, workers=1, depth=4)) == [i * 2 for i in range(10)]
+    assert time.perf_counter() - t0 < 0.35
+
+def test_write_behind(tmp_path):
+    with WriteBehind(depth=2) as w:
+        for i in range(5):
+            w.put(tmp_path / f"{i}.bin", bytes([i]) * 3)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{i}.bin" for i in range(5)]
+    assert (tmp_path / "4.bin").read_bytes() == b"\x04\x04\x04"
+
+    w = WriteBehind()
+    w.put(tmp_path / "missing" / "x.bin", b"x")
+    with pytest.raises(FileNotFoundError):
+        w.close()
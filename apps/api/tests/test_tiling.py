@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from app.services.image_ops import compile_pipeline, run_compiled
+from app.services.tiling import run_tiled
+
+def _synthetic(h: int = 150, w: int = 210) -> np.ndarray:
+    rng = np.random.default_rng(7)
+    yy, xx = np.mgrid[0:h, 0:w]
+    img = np.stack([xx * 255 // w, yy * 255 // h, (xx + yy) % 256], axis=-1).astype(np.int32)
+    img[40:90, 60:140] = (200, 30, 90)
+    img += rng.integers(-12, 12, size=img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize("ops", [
+    [{"type": "brightness_contrast", "b": 20, "c": -10}],
+    [{"type": "to_grayscale"}, {"type": "normalize", "mode": "minus_one_one"}],
+    [{"type": "blur_sharpen", "blur": 2.5, "sharp": 1.5}],
+    [{"type": "edges", "method": "sobel", "threshold": 60, "overlay": True}],
+    [{"type": "edges", "method": "laplacian", "threshold": 40, "overlay": False}],
+    [{"type": "edges", "method": "prewitt", "threshold": 70, "overlay": False}],
+    [{"type": "resize", "mode": "scale", "pct": 80}, {"type": "reset"}, {"type": "crop_center", "w": 100, "h": 90}],
+])
+def test_tiled_matches_full_frame(ops):
+    """Small tiles force many seams; results must match the full-frame run."""
+    img = _synthetic()
+    steps = compile_pipeline(ops)
+    full = run_compiled(img, steps)
+    tiled = run_tiled(img, steps, tile=37)
+    assert tiled.shape == full.shape
+    # gradient paths may differ on a handful of pixels sitting exactly on a
+    # uint8 rounding boundary; everything else is bit-exact
+    assert np.count_nonzero(np.any(tiled != full, axis=-1)) <= full.shape[0] * full.shape[1] // 1000
+
+def test_tiled_zscore_two_pass():
+    img = _synthetic()
+    steps = compile_pipeline([{"type": "normalize", "mode": "zscore"}])
+    full = run_compiled(img, steps).astype(int)
+    tiled = run_tiled(img, steps, tile=32).astype(int)
+    assert np.abs(full - tiled).max() <= 1
+
+def test_tiled_canny_close_to_full_frame():
+    img = _synthetic()
+    steps = compile_pipeline([{"type": "edges", "method": "canny", "threshold": 50, "overlay": False}])
+    full = run_compiled(img, steps)
+    tiled = run_tiled(img, steps, tile=64)
+    assert np.mean(full != tiled) < 0.01